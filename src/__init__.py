@@ -0,0 +1,22 @@
+################################################################################
+# Analysis package: skim, fiducial requirements, histograms and plots.         #
+# Author: Michael Peters                                                       #
+################################################################################
+'''The step scripts double as modules: each defines parse_args(argv) and
+main(argv), and only runs when executed as a script. They import their
+helpers as top-level utils.* modules (as when run from src/), so this
+directory is put on sys.path on import, e.g.
+
+    from src import hist_all
+    hist_all.main(['sig'])
+
+ROOT is imported lazily (see utils/lazy_import.py), so importing a module or
+printing --help does not pay for it.
+'''
+
+import os
+import sys
+
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
@@ -0,0 +1,367 @@
+###############################################################################
+# Benchmark of the processing stages on synthetic ntuples.                    #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''For each size, writes a synthetic raw ntuple (see utils/synthetic.py) and
+runs the chain of stages on it, each in a forked child process:
+
+- red_root: skim of the raw ntuple, with each engine
+- fid_reqs: fiducial requirements on the reduced ntuple, with each engine
+- hist_gen, hist_rec, hist_mass: histogram stages (no cache), and hist_all
+  for the three in one pass
+- bkg_ana: background analysis
+- bkg_candidates_*: all candidates of the background analysis kept in a
+  CandidateTable, or as Candidate dataclasses, to compare their memory use
+- calc_*: the efficiency functions
+
+Every stage reports wall time, CPU time, input events/sec and the peak RSS of
+its process. The results are printed as a table, followed by the speedup of
+alternative engines over the baseline ones (SPEEDUPS) and the memory saved by
+compact data structures (MEMORY), and written to a JSON file for comparing
+runs. Outputs of one stage are the inputs of the next, so a
+subset of stages needs the earlier ones in the same work directory.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import resource
+import subprocess
+from utils.lazy_import import ROOT
+from utils.synthetic import write_ntuple
+
+SIZES = [10000, 100000]
+
+#===============================================================================
+# Stages: each takes the work files and returns the number of input events
+
+
+def _open_tree(infile):
+    tfile = ROOT.TFile.Open(infile, 'READ')
+    return tfile, tfile.Get('tree')
+
+
+def red_root(engine):
+    def run(files):
+        from red_root import run_engine
+        chain = ROOT.TChain('tree')
+        chain.Add(files['raw'])
+        out = files['red'] if engine == 'loop' else files[f'red_{engine}']
+        run_engine(chain, out, engine, use_index=False)
+        return chain.GetEntries()
+    return run
+
+
+def fid_reqs(engine):
+    def run(files):
+        from fid_reqs import apply_fiducial_reqs, apply_fiducial_reqs_columnar
+        from utils.calculate_efficiency import EfficiencyCounts
+        tfile, tree = _open_tree(files['red'])
+        out = files['fid'] if engine == 'loop' else files[f'fid_{engine}']
+        new_tfile = ROOT.TFile.Open(out, 'RECREATE')
+        new_tfile.cd()
+        select = (apply_fiducial_reqs_columnar if engine == 'columnar'
+                  else apply_fiducial_reqs)
+        select(tree, EfficiencyCounts()).Write()
+        new_tfile.Close()
+        nentries = tree.GetEntries()
+        tfile.Close()
+        return nentries
+    return run
+
+
+def hist(names):
+    def run(files):
+        from utils.hist_engine import run_stages
+        outfiles = {name: files[f'hist_{name}'] for name in names}
+        run_stages(files['fid'], outfiles, use_cache=False)
+        tfile, tree = _open_tree(files['fid'])
+        return tree.GetEntries()
+    return run
+
+
+def bkg_ana(files):
+    from bkg_ana import analyze
+    tfile, tree = _open_tree(files['fid'])
+    analyze(tree)
+    return tree.GetEntries()
+
+
+def bkg_candidates(objects):
+    def run(files):
+        from bkg_ana import CandidateTable, count_background
+
+        class Collect:
+            """Verbose writer keeping every candidate in one table."""
+            def __init__(self):
+                self.table = CandidateTable()
+
+            def write(self, candidates):
+                self.table.append(**candidates.data())
+
+        tfile, tree = _open_tree(files['fid'])
+        collect = Collect()
+        count_background(tree, verbose_writer=collect)
+        # Keep the candidates alive until the peak RSS is taken
+        run.kept = list(collect.table) if objects else collect.table.data()
+        return tree.GetEntries()
+    return run
+
+
+def efficiency(name):
+    def run(files):
+        import utils.calculate_efficiency as calc
+        tfile, tree = _open_tree(files['fid'])
+        getattr(calc, name)(tree)
+        return tree.GetEntries()
+    return run
+
+
+STAGES = {
+    'red_root_loop': red_root('loop'),
+    'red_root_twophase': red_root('twophase'),
+    'red_root_rdf': red_root('rdf'),
+    'fid_reqs_loop': fid_reqs('loop'),
+    'fid_reqs_columnar': fid_reqs('columnar'),
+    'hist_gen': hist(['gen']),
+    'hist_rec': hist(['rec']),
+    'hist_mass': hist(['mass']),
+    'hist_all': hist(['gen', 'rec', 'mass']),
+    'bkg_ana': bkg_ana,
+    'bkg_candidates_table': bkg_candidates(False),
+    'bkg_candidates_objects': bkg_candidates(True),
+    'calc_ratio': efficiency('calc_ratio'),
+    'calc_efficiency': efficiency('calc_efficiency'),
+    'calc_sig_ratio': efficiency('calc_sig_ratio'),
+    'calc_sig_efficiency': efficiency('calc_sig_efficiency'),
+}
+
+# (stage, baseline stage) pairs whose wall time ratio is reported
+SPEEDUPS = [
+    ('red_root_twophase', 'red_root_loop'),
+    ('red_root_rdf', 'red_root_loop'),
+    ('fid_reqs_columnar', 'fid_reqs_loop'),
+]
+# (stage, baseline stage) pairs whose peak RSS above the parent's is reported
+MEMORY = [
+    ('bkg_candidates_table', 'bkg_candidates_objects'),
+]
+
+
+def work_files(workdir, nevents):
+    """Return the input and output files of the stages for one size."""
+    pre = os.path.join(workdir, f'n{nevents}_')
+    files = {'raw': pre + 'raw.root', 'red': pre + 'reduced.root',
+             'fid': pre + 'fiducial.root'}
+    for engine in ('twophase', 'rdf'):
+        files[f'red_{engine}'] = pre + f'reduced_{engine}.root'
+    files['fid_columnar'] = pre + 'fiducial_columnar.root'
+    for name in ('gen', 'rec', 'mass'):
+        files[f'hist_{name}'] = pre + f'hist_{name}.root'
+    return files
+
+
+#===============================================================================
+
+
+def measure(func, files, quiet=True):
+    """Run func(files) in a forked child process.
+
+    Returns a dict with the wall and CPU time, the number of input events
+    and the peak RSS (MB) of the child, or the error if it failed.
+    """
+    sys.stdout.flush()
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        if quiet:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+        try:
+            wall, cpu = time.perf_counter(), time.process_time()
+            nevents = func(files)
+            result = {'wall_s': time.perf_counter() - wall,
+                      'cpu_s': time.process_time() - cpu,
+                      'nevents': nevents}
+        except Exception as err:
+            result = {'error': f'{type(err).__name__}: {err}'}
+        with os.fdopen(wfd, 'w') as pipe:
+            json.dump(result, pipe)
+        sys.stdout.flush()
+        os._exit(0)
+
+    os.close(wfd)
+    with os.fdopen(rfd) as pipe:
+        text = pipe.read()
+    _, status, usage = os.wait4(pid, 0)
+    result = json.loads(text) if text else {'error': f'exit status {status}'}
+    # ru_maxrss is in kB on Linux
+    result['peak_rss_mb'] = usage.ru_maxrss / 1024
+    if 'wall_s' in result:
+        result['events_per_s'] = result['nevents'] / max(result['wall_s'],
+                                                         1e-9)
+    return result
+
+
+def speedups(results):
+    """Return the wall time speedup of each SPEEDUPS stage over its baseline,
+    for every size where both ran."""
+    wall = {(res['stage'], res['size']): res['wall_s'] for res in results
+            if 'wall_s' in res}
+    out = []
+    for stage, base in SPEEDUPS:
+        for (name, size), seconds in wall.items():
+            if name != stage or (base, size) not in wall: continue
+            out.append({'stage': stage, 'baseline': base, 'size': size,
+                        'speedup': wall[base, size] / max(seconds, 1e-9)})
+    return out
+
+
+def memory_savings(results, baseline):
+    """Return the peak RSS above baseline (MB) of each MEMORY stage and its
+    baseline stage, for every size where both ran."""
+    rss = {(res['stage'], res['size']): res['peak_rss_mb'] - baseline
+           for res in results if 'error' not in res}
+    out = []
+    for stage, base in MEMORY:
+        for (name, size), mb in rss.items():
+            if name != stage or (base, size) not in rss: continue
+            out.append({'stage': stage, 'baseline': base, 'size': size,
+                        'rss_mb': mb, 'baseline_rss_mb': rss[base, size]})
+    return out
+
+
+def run_info():
+    """Return a description of the machine and code of the run."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=src,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': socket.gethostname(), 'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'root': ROOT.gROOT.GetVersion(), 'commit': commit}
+
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--sizes',
+        type=int,
+        nargs='+',
+        default=SIZES,
+        help=f'Raw events per benchmark (default: {SIZES})'
+    )
+    parser.add_argument(
+        '-s', '--stages',
+        nargs='+',
+        choices=list(STAGES),
+        default=list(STAGES),
+        metavar='STAGE',
+        help='Stages to run, in pipeline order (default: all): '
+             + ', '.join(STAGES)
+    )
+    parser.add_argument(
+        '--sparsity',
+        type=float,
+        default=0.9,
+        help='Fraction of empty raw events (default: 0.9)'
+    )
+    parser.add_argument(
+        '--signal-fraction',
+        type=float,
+        default=0.1,
+        help='Fraction of non-empty events with a signal decay (default: 0.1)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed of the synthetic ntuples (default: 0)'
+    )
+    parser.add_argument(
+        '-w', '--workdir',
+        default='bench/work',
+        help='Directory for the synthetic and intermediate files '
+             '(default: bench/work)'
+    )
+    parser.add_argument(
+        '-o', '--outfile',
+        default='bench/stages.json',
+        help='JSON results file (default: bench/stages.json)'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Show the output of the stages'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the stage benchmarks and write the results. Returns the number of
+    failed stages."""
+    args = parse_args(argv)
+    os.makedirs(args.workdir, exist_ok=True)
+    os.makedirs(os.path.dirname(args.outfile) or '.', exist_ok=True)
+
+    # Load ROOT once, before forking the stages
+    ROOT.gROOT.SetBatch(True)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    stages = [name for name in STAGES if name in args.stages]
+
+    results = []
+    print(f'{"stage":<20} {"events":>10} {"wall [s]":>9} {"cpu [s]":>8} '
+          f'{"events/s":>11} {"RSS [MB]":>9}')
+    for nevents in args.sizes:
+        files = work_files(args.workdir, nevents)
+        write_ntuple(files['raw'], nevents, args.sparsity,
+                     args.signal_fraction, args.seed)
+        for name in stages:
+            res = measure(STAGES[name], files, not args.verbose)
+            res.update(stage=name, size=nevents)
+            results.append(res)
+            if 'error' in res:
+                print(f'{name:<20} {"":>10} FAILED: {res["error"]}')
+                continue
+            print(f'{name:<20} {res["nevents"]:>10,d} {res["wall_s"]:9.3f} '
+                  f'{res["cpu_s"]:8.3f} {res["events_per_s"]:11,.0f} '
+                  f'{res["peak_rss_mb"]:9.1f}')
+
+    ratios = speedups(results)
+    for res in ratios:
+        print(f'{res["stage"]} vs {res["baseline"]} ({res["size"]:,d} '
+              f'events): {res["speedup"]:.1f}x faster')
+    savings = memory_savings(results, baseline)
+    for res in savings:
+        print(f'{res["stage"]} vs {res["baseline"]} ({res["size"]:,d} '
+              f'events): {res["rss_mb"]:.1f} MB vs '
+              f'{res["baseline_rss_mb"]:.1f} MB above the parent process')
+
+    summary = {'run': run_info(),
+               'config': {'sizes': args.sizes, 'sparsity': args.sparsity,
+                          'signal_fraction': args.signal_fraction,
+                          'seed': args.seed},
+               'baseline_rss_mb': baseline,
+               'results': results,
+               'speedups': ratios,
+               'memory': savings}
+    with open(args.outfile, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f'Done: wrote results to {args.outfile}')
+    return sum('error' in res for res in results)
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
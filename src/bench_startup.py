@@ -0,0 +1,102 @@
+###############################################################################
+# Benchmark of the startup time of the step scripts.                          #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Times `python <script> --help` for every entry point in src/, which
+measures interpreter startup plus module imports, and checks that ROOT is
+not imported on that path.'''
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ['red_root.py', 'fid_reqs.py', 'hist_all.py', 'hist_gen.py',
+                'hist_rec.py', 'hist_mass.py', 'hist_cache.py', 'bkg_ana.py',
+                'plot_rec.py', 'plot_gen.py', 'plot_mass.py', 'plotter.py',
+                'make_synth.py', 'bench_stages.py', 'export_columns.py']
+
+# Run a script with --help and report whether it imported ROOT
+_PROBE = '''
+import sys, runpy
+class Probe:
+    imported = False
+    def find_spec(self, name, path=None, target=None):
+        if name == 'ROOT': Probe.imported = True
+sys.meta_path.insert(0, Probe())
+sys.argv = [sys.argv[1], '--help']
+sys.path.insert(0, {src!r})
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write('ROOT_IMPORTED=%d\\n' % Probe.imported)
+'''
+
+#===============================================================================
+
+
+def time_help(script, repeat=5):
+    """Run script --help repeat times.
+
+    Returns (wall times in seconds, whether ROOT was imported).
+    """
+    probe = _PROBE.format(src=SRC)
+    times, root = [], False
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = subprocess.run([sys.executable, '-c', probe,
+                              os.path.join(SRC, script)],
+                             capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        root |= 'ROOT_IMPORTED=1' in res.stderr
+    return times, root
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'scripts',
+        nargs='*',
+        default=ENTRY_POINTS,
+        help='Scripts to time (default: all entry points)'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=5,
+        help='Runs per script (default: 5)'
+    )
+    parser.add_argument(
+        '--max',
+        type=float,
+        default=1.0,
+        help='Fail if the median time of a script exceeds this (seconds)'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Time --help of the entry points. Returns the number that are too slow
+    or import ROOT."""
+    args = parse_args(argv)
+
+    print(f'{"script":<14} {"min [s]":>8} {"median [s]":>11}  ROOT')
+    nbad = 0
+    for script in args.scripts:
+        times, root = time_help(script, args.repeat)
+        median = statistics.median(times)
+        bad = root or median > args.max
+        nbad += bad
+        print(f'{script:<14} {min(times):8.3f} {median:11.3f}  '
+              f'{"yes" if root else "no":<4}{"  <-- FAIL" if bad else ""}')
+    return nbad
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -5,37 +5,25 @@
 
 from __future__ import annotations
 
-import ROOT
 import argparse
+import sys
+import gzip
+import json
+import shutil
+import tempfile
+import numpy as np
 from dataclasses import dataclass
 from enum import Enum
 from collections import Counter
+from utils.lazy_import import ROOT
 from utils.calculate_efficiency import calc_ratio, calc_sig_ratio
 from utils.calculate_efficiency import calc_efficiency, calc_sig_efficiency
-
-# Parse command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('-v', '--verbose', action='store_true', 
-                    help='Enable verbose output')
-parser.add_argument('-s', '--sig', action='store_true',
-                    help='Analyze signal file instead of minbias file')
-parser.add_argument('-o', '--outfile', action='store_true',
-                    help='Write to output text file (default: none)')
-args = parser.parse_args()
-
-verbose = args.verbose
-is_sig_file = args.sig
-write_to_outfile = args.outfile
-
-if is_sig_file:
-    infile = 'ntuple/MC_2018_Signal/fid_probnnmu_95_20260120.root'
-else:
-    # infile = 'red/reduced.root'
-    # infile = 'red/reduced_fiducial_cuts.root'
-    infile = 'red/reduced_fiducial_reqs.root'
-
-if write_to_outfile: print(f'Reading from {infile}, writing to out/bkg_ana.txt.')
-else: print(f'Reading from {infile}.')
+from utils.calculate_efficiency import RATIO_BRANCHES, SIG_RATIO_BRANCHES
+from utils.columnar import iter_chunks
+from utils.column_cache import load_columns
+from utils.instrument import Monitor
+from utils.mapreduce import map_reduce
+from utils.truth_match import truth_match, PID_MISMATCH, NO_MATCH, WRONG_MOTHER
 
 # Possible error categories for a decay candidate
 class ErrorType(str, Enum):
@@ -69,165 +57,342 @@ class Candidate:
     has_dimu_mismatch: bool
     has_dimu_err: bool
 
-fid_fail = []  # Particles failing LHCb fiducial cuts
-ncan, nsig, nbkg = 0, 0, 0  # Total candidates, signal, and background counters
-candidates: list[Candidate] = []  # List of all candidates
-mup_mismatches = []  # List of MC pids causing mu+ PID mismatches
-mum_mismatches = []  # List of MC pids causing mu- PID mismatches
-pho_mismatches = []  # List of MC pids causing photon PID mismatches
-other_mismatches = []  # List of MC pids causing other mismatches
-
-# Combine files to create single histogram
-tfile = ROOT.TFile.Open(infile, 'READ')
-tree = tfile.Get('tree')
-
-# Event loop
-for entryIdx in range(0, tree.GetEntries()):
-    tree.GetEntry(entryIdx)
-    
-    # Reconstructed particle information
-    tag_pid = getattr(tree, 'tag_pid')
-    prt_pid = getattr(tree, 'prt_pid')
-    # MC-matching index information
-    prt_idx_gen = getattr(tree, 'prt_idx_gen')
-    prt_idx_mom = getattr(tree, 'prt_idx_mom')
-    # Generator particle information
-    mc_pid = getattr(tree, 'mc_pid')
-    mc_idx_mom = getattr(tree, 'mc_idx_mom')
-
-    # Reformat above lists for easier handling
-    prt_pid = [int(pid) for pid in prt_pid]
-    prt_idx_gen = [int(idx) for idx in prt_idx_gen]
-    prt_idx_mom = [int(idx) for idx in prt_idx_mom]
-    mc_pid = [int(pid) for pid in mc_pid]
-    mc_idx_mom = [int(idx) for idx in mc_idx_mom]
-
-    # Skip empty events
-    ntags = len(tag_pid)
-    if ntags == 0: continue
-    ncan += ntags
-    
-    for i in range(ntags):
-        if tag_pid[i] != 221: continue  # skip failed reco/non-eta candidates
-
-        is_signal = True
-        dtrs: list[DaughterMatch] = []
-        dimu_mismatch = [False, False]
-        dimu_err = [False, False]
-
-        # Requires at least one MC eta candidate
-        # Note: cannot handle multiple eta candidates (very rare)
-        if mc_pid[0] != 221: is_signal = False
-
-        for j in range(i*3, i*3+3):
-            if prt_idx_mom[j] != i: break  # Skip failed reco, shouldn't happen
-            if tag_pid[i] != 221: continue  # Skip failed reco/non-eta candidates
-
-            is_pid_mismatch, is_from_eta = False, True
-
-            # Particle has no MC match
-            if prt_idx_gen[j] == -1:
-                is_signal = False
-                is_from_eta = False
-                err_type = ErrorType.OTHER_ERROR
-            # Particle matches to a MC particle with a different pid
-            elif mc_pid[prt_idx_gen[j]] != prt_pid[j]:
-                is_signal = False
-                is_from_eta = False
-                is_pid_mismatch = True
-            # Particle is correct pid but didn't come from eta candidate
-            elif mc_idx_mom[prt_idx_gen[j]] != i:
-                is_signal = False
-                is_from_eta = False
-            
-            # Background
-            if not is_from_eta:
-                # Classify PID mismatch type
-                if is_pid_mismatch:
-                    # MUON_PID_MISMATCH condition
-                    if prt_pid[j] == -13:
-                        err_type = ErrorType.MUP_PID_MISMATCH
-                        mup_mismatches.append(mc_pid[prt_idx_gen[j]])
-                        dimu_mismatch[0] = True
-                    # MUON_PID_MISMATCH condition
-                    elif prt_pid[j] == 13:
-                        err_type = ErrorType.MUM_PID_MISMATCH
-                        mum_mismatches.append(mc_pid[prt_idx_gen[j]])
-                        dimu_mismatch[1] = True
-                    # PHOTON_PID_MISMATCH condition
-                    elif prt_pid[j] == 22:
-                        err_type = ErrorType.PHOTON_PID_MISMATCH
-                        pho_mismatches.append(mc_pid[prt_idx_gen[j]])
-                    else:
-                        err_type = ErrorType.OTHER_ERROR
-                        other_mismatches.append(mc_pid[prt_idx_gen[j]])
-                # Classify daughter error type
-                elif not is_from_eta:
-                    if prt_pid[j] == -13:
-                        err_type = ErrorType.MUP_ERROR
-                        dimu_err[0] = True
-                    elif prt_pid[j] == 13:
-                        err_type = ErrorType.MUM_ERROR
-                        dimu_err[1] = True
-                    elif prt_pid[j] == 22:
-                        err_type = ErrorType.PHOTON_ERROR
-                # Some other error which should be studied
-                else: err_type = ErrorType.OTHER_ERROR
-            else: err_type = None  # Correctly matched dtr of signal candidate
-
-            try: 
-                dtrs.append(DaughterMatch(prt_pid=prt_pid[j],
-                    prt_idx_gen=prt_idx_gen[j],
-                    mc_pid=mc_pid[prt_idx_gen[j]],
-                    mc_idx_mom=mc_idx_mom[prt_idx_gen[j]],
-                    err_type=err_type))
-            except: 
-                dtrs.append(DaughterMatch(prt_pid=prt_pid[j],
-                    prt_idx_gen=prt_idx_gen[j],
-                    mc_pid=None,
-                    mc_idx_mom=None,
-                    err_type=err_type))
-                print('Warning: Could not assign mc_pid or mc_idx_mom for daughter.')
-
-        if is_signal: nsig += 1
-        else: nbkg += 1
-        candidate = Candidate(evt=entryIdx,
-                              can_idx=i,
-                              dtrs=dtrs,
-                              has_dimu_mismatch=all(dimu_mismatch),
-                              has_dimu_err=all(dimu_err))
-        candidates.append(candidate)
-        
-# Collect analytics
 ERROR_TYPES = list(ErrorType)
-err_counters = {err: 0 for err in ERROR_TYPES}
-mup_err_only_count, mum_err_only_count = 0, 0
-mu_AND_dimu_err_count = 0
-for can in candidates:
-    # Dimuon errors can only be observed at candidate-level
-    if can.has_dimu_mismatch: 
-        err_counters[ErrorType.DIMUON_PID_MISMATCH] += 1
-    if can.has_dimu_err: 
-        err_counters[ErrorType.DIMUON_ERROR] += 1
-    for dtr in can.dtrs:
+
+
+class CandidateTable:
+    """Columnar store of candidates, appended a chunk at a time.
+
+    Each column is a typed NumPy array with one row per candidate (and three
+    columns for daughter information), which is far smaller than a Candidate
+    dataclass with a list of DaughterMatch dataclasses per candidate. The
+    verbose report is written from the columns through records(), without
+    building any dataclass. Iterating over the table yields Candidate objects
+    one at a time, so code written for a list of Candidates works unchanged.
+
+    Daughter error types are stored as indices into ERROR_TYPES, -1 for None.
+    Daughters beyond ndtr, and MC info of daughters without an MC match
+    (has_mc False), are not used.
+    """
+    columns = {
+        'evt': np.int64, 'can_idx': np.int32, 'ndtr': np.int8,
+        'has_dimu_mismatch': np.bool_, 'has_dimu_err': np.bool_,
+        'prt_pid': np.int32, 'prt_idx_gen': np.int32, 'has_mc': np.bool_,
+        'mc_pid': np.int32, 'mc_idx_mom': np.int32, 'err_code': np.int8,
+    }
+
+    def __init__(self):
+        self._parts = {name: [] for name in self.columns}
+        self._data = None
+
+    def append(self, **cols):
+        """Append a block of candidates, one array per column."""
+        for name, dtype in self.columns.items():
+            self._parts[name].append(np.asarray(cols[name], dtype=dtype))
+        self._data = None
+
+    def data(self):
+        """Return a dict of column arrays."""
+        if self._data is None:
+            self._data = {}
+            for name, dtype in self.columns.items():
+                parts = self._parts[name]
+                self._data[name] = (np.concatenate(parts) if parts
+                                    else np.zeros(0, dtype=dtype))
+            # Keep a single block so later appends do not copy everything twice
+            self._parts = {name: [col] for name, col in self._data.items()}
+        return self._data
+
+    def nbytes(self):
+        """Return the memory used by the column arrays in bytes."""
+        return sum(col.nbytes for col in self.data().values())
+
+    def __len__(self):
+        return len(self.data()['evt'])
+
+    def records(self):
+        """Yield a JSON-serializable dict per candidate, read from the column
+        arrays (converted to lists once)."""
+        d = {name: col.tolist() for name, col in self.data().items()}
+        for c in range(len(d['evt'])):
+            has_mc, err_code = d['has_mc'][c], d['err_code'][c]
+            mc_pid, mc_idx_mom = d['mc_pid'][c], d['mc_idx_mom'][c]
+            dtrs = [{'prt_pid': d['prt_pid'][c][k],
+                     'prt_idx_gen': d['prt_idx_gen'][c][k],
+                     'mc_pid': mc_pid[k] if has_mc[k] else None,
+                     'mc_idx_mom': mc_idx_mom[k] if has_mc[k] else None,
+                     'err_type': (ERROR_TYPES[err_code[k]].value
+                                  if err_code[k] >= 0 else None)}
+                    for k in range(d['ndtr'][c])]
+            yield {'evt': d['evt'][c],
+                   'can_idx': d['can_idx'][c],
+                   'has_dimu_mismatch': d['has_dimu_mismatch'][c],
+                   'has_dimu_err': d['has_dimu_err'][c],
+                   'dtrs': dtrs}
+
+    def __iter__(self):
+        d = self.data()
+        for c in range(len(d['evt'])):
+            dtrs = []
+            for k in range(d['ndtr'][c]):
+                has_mc = d['has_mc'][c, k]
+                err_code = d['err_code'][c, k]
+                dtrs.append(DaughterMatch(prt_pid=int(d['prt_pid'][c, k]),
+                    prt_idx_gen=int(d['prt_idx_gen'][c, k]),
+                    mc_pid=int(d['mc_pid'][c, k]) if has_mc else None,
+                    mc_idx_mom=int(d['mc_idx_mom'][c, k]) if has_mc else None,
+                    err_type=ERROR_TYPES[err_code] if err_code >= 0 else None))
+            yield Candidate(evt=int(d['evt'][c]),
+                            can_idx=int(d['can_idx'][c]),
+                            dtrs=dtrs,
+                            has_dimu_mismatch=bool(d['has_dimu_mismatch'][c]),
+                            has_dimu_err=bool(d['has_dimu_err'][c]))
+
+
+
+class ReportWriter:
+    """Write report text to several streams (e.g. stdout and a file) as it is
+    produced, instead of building the whole report in memory first."""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+
+
+def open_report(path, compress=False):
+    """Open a report file for writing text, gzip-compressed if requested.
+    Returns the file object and the actual file name."""
+    if compress:
+        path += '.gz'
+        return gzip.open(path, 'wt'), path
+    return open(path, 'w'), path
+
+
+def format_int(value, width):
+    """Format an int right-aligned in width, or '-' if it is None (e.g. the
+    MC info of a daughter without an MC match)."""
+    return f'{"-" if value is None else value:>{width}}'
+
+
+class VerboseWriter:
+    """Stream the per-candidate verbose section while the events are
+    processed, in one of two formats:
+
+    - text: the human readable section of the report. It has to follow the
+      summary, which is only known at the end, so it is spilled to a
+      temporary file and copied after the summary by finish().
+    - jsonl: one JSON object per candidate, written straight to its own file.
+    """
+
+    def __init__(self, fmt='text', path=None, compress=False):
+        self.fmt = fmt
+        self.path = None
+        if fmt == 'jsonl':
+            self.out, self.path = open_report(path, compress)
+        else:
+            self.out = tempfile.TemporaryFile('w+')
+            self.out.write('Verbose candidate information:\n')
+
+    def write(self, candidates):
+        """Write the candidates of a CandidateTable."""
+        for rec in candidates.records():
+            if self.fmt == 'jsonl':
+                self.out.write(json.dumps(rec) + '\n')
+                continue
+            self.out.write(f'\nEvent {rec["evt"]}, '
+                           f'Candidate {rec["can_idx"]}:\n')
+            for dtr in rec['dtrs']:
+                err_type = dtr['err_type'] and ErrorType(dtr['err_type'])
+                gen_idx = format_int(dtr['prt_idx_gen'], 2)
+                mc_pid = format_int(dtr['mc_pid'], 5)
+                mc_idx_mom = format_int(dtr['mc_idx_mom'], 2)
+                self.out.write(f'- Daughter PID {dtr["prt_pid"]:3d}, '
+                               f'Gen idx {gen_idx}, '
+                               f'MC PID {mc_pid}, '
+                               f'MC mom idx {mc_idx_mom}, '
+                               f'Error type: {err_type}\n')
+
+    def finish(self, report=None):
+        """Close the section. The text section is copied to report."""
+        if self.fmt == 'text' and report is not None:
+            self.out.seek(0)
+            report.write('\n')
+            shutil.copyfileobj(self.out, report)
+        self.out.close()
+
+
+# Branches needed for truth-matching
+BRANCHES = ['tag_pid', 'prt_pid', 'prt_idx_gen', 'prt_idx_mom',
+            'mc_pid', 'mc_idx_mom']
+
+
+def classify_daughters(match):
+    """Return the ErrorType code (index into ERROR_TYPES, or -1 for correctly
+    matched daughters) of every daughter of a TruthMatch, shape (n, 3).
+
+    Daughters with an MC match of the wrong pid get a *_PID_MISMATCH type.
+    Daughters without an MC match, or whose MC match has the wrong mother, get
+    a *_ERROR type. Both fall back to OTHER_ERROR for non mu/gamma daughters.
+    """
+    pid = match.prt_pid
+    is_mismatch = match.code == PID_MISMATCH
+    is_error = (match.code == NO_MATCH) | (match.code == WRONG_MOTHER)
+    conditions = [is_mismatch & (pid == -13), is_mismatch & (pid == 13),
+                  is_mismatch & (pid == 22), is_error & (pid == -13),
+                  is_error & (pid == 13), is_error & (pid == 22),
+                  is_mismatch | is_error]
+    choices = [ErrorType.MUP_PID_MISMATCH, ErrorType.MUM_PID_MISMATCH,
+               ErrorType.PHOTON_PID_MISMATCH, ErrorType.MUP_ERROR,
+               ErrorType.MUM_ERROR, ErrorType.PHOTON_ERROR,
+               ErrorType.OTHER_ERROR]
+    codes = [ERROR_TYPES.index(err) for err in choices]
+    return np.select(conditions, codes, default=-1)
+
+
+def count_err(codes, err, mask):
+    """Count daughters with error type err among those selected by mask."""
+    return int(np.count_nonzero((codes == ERROR_TYPES.index(err)) & mask))
+
+
+class BkgCounts:
+    """Background analysis counters, updated chunk by chunk so memory does
+    not grow with the input."""
+
+    def __init__(self):
+        self.ncan, self.nsig, self.nbkg = 0, 0, 0  # Total, signal, background
+        self.mup_mismatches = Counter()  # MC pids causing mu+ PID mismatches
+        self.mum_mismatches = Counter()  # MC pids causing mu- PID mismatches
+        self.pho_mismatches = Counter()  # MC pids causing photon PID mismatches
+        self.other_mismatches = Counter()  # MC pids causing other mismatches
+        # Background error counts
+        self.err_counters = {err: 0 for err in ERROR_TYPES}
+        self.mup_err_only_count, self.mum_err_only_count = 0, 0
+        self.mu_AND_dimu_err_count = 0
+
+    def add_chunk(self, chunk, verbose_writer=None):
+        """Truth-match the candidates of a Chunk and update the counters.
+        Candidates are also written to verbose_writer, if given."""
+        match = truth_match(chunk)
+        self.ncan += len(match)
+
+        # Skip failed reco/non-eta candidates
+        is_eta = match.tag_pid == 221
+        err_code = classify_daughters(match)
+
+        # MC pids causing PID mismatches, in candidate and daughter order
+        is_mismatch = (match.code == PID_MISMATCH) & is_eta[:, None]
+        pid = match.prt_pid
+        self.mup_mismatches.update(
+            match.mc_pid[is_mismatch & (pid == -13)].tolist())
+        self.mum_mismatches.update(
+            match.mc_pid[is_mismatch & (pid == 13)].tolist())
+        self.pho_mismatches.update(
+            match.mc_pid[is_mismatch & (pid == 22)].tolist())
+        self.other_mismatches.update(match.mc_pid[is_mismatch & (pid != -13)
+                                     & (pid != 13) & (pid != 22)].tolist())
+
+        # Dimuon errors can only be observed at candidate-level
+        is_error = (match.code == NO_MATCH) | (match.code == WRONG_MOTHER)
+        has_dimu_mismatch = (np.any(is_mismatch & (pid == -13), axis=1)
+                             & np.any(is_mismatch & (pid == 13), axis=1))
+        has_dimu_err = (np.any(is_error & (pid == -13), axis=1)
+                        & np.any(is_error & (pid == 13), axis=1))
+
+        self.nsig += int(np.count_nonzero(match.is_signal[is_eta]))
+        self.nbkg += int(np.count_nonzero(~match.is_signal[is_eta]))
+
         # Increment daughter counters
-        for err in ERROR_TYPES:
-            if dtr.err_type == err:
-                err_counters[err] += 1
-                if err == ErrorType.MUP_PID_MISMATCH and not can.has_dimu_mismatch:
-                    mup_err_only_count += 1
-                elif err == ErrorType.MUM_PID_MISMATCH and not can.has_dimu_mismatch:
-                    mum_err_only_count += 1
-                elif err == ErrorType.MUP_ERROR and not can.has_dimu_err:
-                    mu_AND_dimu_err_count += 1
-                elif err == ErrorType.MUM_ERROR and not can.has_dimu_err:
-                    mu_AND_dimu_err_count += 1
-
-# Add MUON_ONLY_* counters
-err_counters[ErrorType.MUP_ONLY_PID_MISMATCH] = mup_err_only_count
-err_counters[ErrorType.MUM_ONLY_PID_MISMATCH] = mum_err_only_count
-err_counters[ErrorType.MUP_ONLY_ERROR] = mup_err_only_count
-err_counters[ErrorType.MUM_ONLY_ERROR] = mum_err_only_count
+        err_counters = self.err_counters
+        codes = err_code[is_eta]
+        ncodes = np.bincount(codes[codes >= 0], minlength=len(ERROR_TYPES))
+        for err, n in zip(ERROR_TYPES, ncodes): err_counters[err] += int(n)
+        dimu_mismatch = has_dimu_mismatch[is_eta][:, None]
+        dimu_err = has_dimu_err[is_eta][:, None]
+        err_counters[ErrorType.DIMUON_PID_MISMATCH] += int(np.sum(dimu_mismatch))
+        err_counters[ErrorType.DIMUON_ERROR] += int(np.sum(dimu_err))
+        # Single muon errors in candidates without the dimuon error
+        self.mup_err_only_count += count_err(
+            codes, ErrorType.MUP_PID_MISMATCH, ~dimu_mismatch)
+        self.mum_err_only_count += count_err(
+            codes, ErrorType.MUM_PID_MISMATCH, ~dimu_mismatch)
+        self.mu_AND_dimu_err_count += (
+            count_err(codes, ErrorType.MUP_ERROR, ~dimu_err)
+            + count_err(codes, ErrorType.MUM_ERROR, ~dimu_err))
+
+        for _ in range(np.count_nonzero((match.valid & ~match.has_mc)[is_eta])):
+            print('Warning: Could not assign mc_pid or mc_idx_mom for '
+                  'daughter.')
+        if verbose_writer is None: return
+
+        # Write candidates with their valid daughters to the verbose report
+        ndtr = np.sum(match.valid, axis=1)
+        candidates = CandidateTable()
+        candidates.append(evt=chunk.start + match.evt[is_eta],
+                          can_idx=match.can_idx[is_eta],
+                          ndtr=ndtr[is_eta],
+                          has_dimu_mismatch=has_dimu_mismatch[is_eta],
+                          has_dimu_err=has_dimu_err[is_eta],
+                          prt_pid=match.prt_pid[is_eta],
+                          prt_idx_gen=match.prt_idx_gen[is_eta],
+                          has_mc=match.has_mc[is_eta],
+                          mc_pid=match.mc_pid[is_eta],
+                          mc_idx_mom=match.mc_idx_mom[is_eta],
+                          err_code=err_code[is_eta])
+        verbose_writer.write(candidates)
+
+    def merge(self, other):
+        """Add the counters of other, filled from the entries following those
+        of self. Counters are updated in order, so most_common() ranks ties
+        as in a single pass. Returns self."""
+        self.ncan += other.ncan
+        self.nsig += other.nsig
+        self.nbkg += other.nbkg
+        self.mup_mismatches.update(other.mup_mismatches)
+        self.mum_mismatches.update(other.mum_mismatches)
+        self.pho_mismatches.update(other.pho_mismatches)
+        self.other_mismatches.update(other.other_mismatches)
+        for err, n in other.err_counters.items():
+            self.err_counters[err] += n
+        self.mup_err_only_count += other.mup_err_only_count
+        self.mum_err_only_count += other.mum_err_only_count
+        self.mu_AND_dimu_err_count += other.mu_AND_dimu_err_count
+        return self
+
+    def error_counts(self):
+        """Return the background error counts, including MU*_ONLY_*."""
+        err_counters = dict(self.err_counters)
+        err_counters[ErrorType.MUP_ONLY_PID_MISMATCH] = self.mup_err_only_count
+        err_counters[ErrorType.MUM_ONLY_PID_MISMATCH] = self.mum_err_only_count
+        err_counters[ErrorType.MUP_ONLY_ERROR] = self.mup_err_only_count
+        err_counters[ErrorType.MUM_ONLY_ERROR] = self.mum_err_only_count
+        return err_counters
+
+
+def count_background(tree, first=0, last=None, phase=None,
+                     verbose_writer=None):
+    """Shard task: BkgCounts of entries [first, last) of tree (see
+    utils/mapreduce.py)."""
+    counts = BkgCounts()
+    # Chunked event loop
+    for chunk in iter_chunks(tree, BRANCHES, first=first, last=last):
+        counts.add_chunk(chunk, verbose_writer)
+        if phase is not None: phase.update(chunk.stop - first)
+    return counts
+
+
+def analyze(tree, verbose_writer=None, monitor=None, njobs=1):
+    """Run the background analysis over a tree, on njobs processes. The
+    verbose report is written in event order, so it needs a single process.
+    Returns a BkgCounts."""
+    with (monitor or Monitor()).phase('analyze', tree.GetEntries()) as phase:
+        if verbose_writer is not None:
+            return count_background(tree, phase=phase,
+                                    verbose_writer=verbose_writer)
+        return map_reduce(tree, count_background, njobs, phase)
+
 
 #-------------------------------------------------------------------------------
 
@@ -253,27 +418,31 @@ def format_pid_freq_table(rows: list[tuple[int, int]]) -> str:
 #-------------------------------------------------------------------------------
 
 
-def get_analytics():
-    output = '='*25 + ' Background Analysis Results ' + '='*26 + '\n'
+def write_analytics(out, counts, tree, njobs=1):
+    """Write the background analysis summary of a BkgCounts to out as it is
+    produced. The efficiencies are computed from tree on njobs processes."""
+    ncan, nsig, nbkg = counts.ncan, counts.nsig, counts.nbkg
+    err_counters = counts.error_counts()
+    out.write('='*25 + ' Background Analysis Results ' + '='*26 + '\n')
     # Key to explain counters
-    output += '*_MISMATCH: Daughter has MC match but reco pid does not match gen pid.\n'
-    output += '*_ERROR: Daughter has MC match but did reco did not match to candidate gen dtr.\n'
-    output += 'Note: DIMUON_* errors do not overwrite single MU*_* errors.\n'
-    output += '-'*80 + '\n'
+    out.write('*_MISMATCH: Daughter has MC match but reco pid does not match gen pid.\n')
+    out.write('*_ERROR: Daughter has MC match but did reco did not match to candidate gen dtr.\n')
+    out.write('Note: DIMUON_* errors do not overwrite single MU*_* errors.\n')
+    out.write('-'*80 + '\n')
     # Summary statistics
-    output += f'Total candidates processed:  {ncan:4d}\n'
-    output += f'Total signal candidates:     {nsig:4d}\n'
-    output += f'Total background candidates: {nbkg:4d}\n'
-    output += '-'*80 + '\n'
+    out.write(f'Total candidates processed:  {ncan:4d}\n')
+    out.write(f'Total signal candidates:     {nsig:4d}\n')
+    out.write(f'Total background candidates: {nbkg:4d}\n')
+    out.write('-'*80 + '\n')
     # Error counts
-    output += 'Background error counts:\n'
+    out.write('Background error counts:\n')
     for err in err_counters:
         # Remove ErrorType. prefix for display
         label = str(err).strip('ErrorType.') + ':'
-        output += f'- {label:<26} {err_counters[err]:4d}\n'
-    output += '-'*80 + '\n'
+        out.write(f'- {label:<26} {err_counters[err]:4d}\n')
+    out.write('-'*80 + '\n')
     # Error rates
-    output += 'Background error rates:\n'
+    out.write('Background error rates:\n')
     # P(dimuon error | muon error) = N(muon & dimuon) / N(muon)
     prob_dimu_given_mu = err_counters[ErrorType.DIMUON_ERROR] / \
                          max(err_counters[ErrorType.MUP_ERROR], 
@@ -283,71 +452,127 @@ def get_analytics():
                err_counters[ErrorType.MUM_ERROR] / ncan)
     # P(photon error)
     prob_pho = err_counters[ErrorType.PHOTON_ERROR] / ncan
-    output += f'- P(dimuon error | muon error) = {prob_dimu_given_mu:.4f}\n'
-    output += f'- P(mu+ error)                 = {prob_mu[0]:.4f}\n'
-    output += f'- P(mu- error)                 = {prob_mu[1]:.4f}\n'
-    output += f'- P(photon error)              = {prob_pho:.4f}\n'
-    output += '-'*80 + '\n'
+    out.write(f'- P(dimuon error | muon error) = {prob_dimu_given_mu:.4f}\n')
+    out.write(f'- P(mu+ error)                 = {prob_mu[0]:.4f}\n')
+    out.write(f'- P(mu- error)                 = {prob_mu[1]:.4f}\n')
+    out.write(f'- P(photon error)              = {prob_pho:.4f}\n')
+    out.write('-'*80 + '\n')
     # List of MC pids causing mismatches
-    output += 'List of PID mismatches (ranked by frequency):\n'
+    out.write('List of PID mismatches (ranked by frequency):\n')
     # Sort list by frequency
-    c_mup = Counter(mup_mismatches)
-    c_mum = Counter(mum_mismatches)
-    c_pho = Counter(pho_mismatches)
-    c_other = Counter(other_mismatches)
+    c_mup = counts.mup_mismatches
+    c_mum = counts.mum_mismatches
+    c_pho = counts.pho_mismatches
+    c_other = counts.other_mismatches
     # Each Counter.most_common() returns [(pid, count), ...]
     # Formatted tables
-    output += '\n--- MU+ ---\n'
-    output += format_pid_freq_table(c_mup.most_common())
+    out.write('\n--- MU+ ---\n')
+    out.write(format_pid_freq_table(c_mup.most_common()))
 
-    output += '\n--- MU- ---\n'
-    output += format_pid_freq_table(c_mum.most_common())
+    out.write('\n--- MU- ---\n')
+    out.write(format_pid_freq_table(c_mum.most_common()))
 
-    output += '\n--- PHOTON ---\n'
-    output += format_pid_freq_table(c_pho.most_common())
+    out.write('\n--- PHOTON ---\n')
+    out.write(format_pid_freq_table(c_pho.most_common()))
 
-    output += '\n--- OTHER ---\n'
-    output += format_pid_freq_table(c_other.most_common())
-    output += '-'*80 + '\n'
+    out.write('\n--- OTHER ---\n')
+    out.write(format_pid_freq_table(c_other.most_common()))
+    out.write('-'*80 + '\n')
 
     # Calculate efficiencies with fiducial requirements in place
-    eff_ratio = calc_ratio(tree)
-    sig_eff_ratio = calc_sig_ratio(tree)
-    eff = calc_efficiency(tree)
-    sig_eff = calc_sig_efficiency(tree)
-
-    output += f'Efficiency with fiducial requirements: {eff_ratio[0]}/{eff_ratio[1]} = {eff:.4f}\n'
-    output += f'Signal efficiency with fiducial requirements: {sig_eff_ratio[0]}/{sig_eff_ratio[1]} = {sig_eff:.4f}\n'
-    output += '-'*80 + '\n'
-    
-    # Verbose output
-    verbose_output = ''
-    if verbose:
-        verbose_output += 'Verbose candidate information:\n'
-        for can in candidates:
-            verbose_output += f'\nEvent {can.evt}, Candidate {can.can_idx}:\n'
-            for dtr in can.dtrs:
-                verbose_output += f'- Daughter PID {dtr.prt_pid:3d}, '
-                verbose_output += f'Gen idx {dtr.prt_idx_gen:2d}, '
-                verbose_output += f'MC PID {dtr.mc_pid:5d}, '
-                verbose_output += f'MC mom idx {dtr.mc_idx_mom:2d}, '
-                verbose_output += f'Error type: {dtr.err_type}\n'
-
-    return output, verbose_output
+    eff_ratio = calc_ratio(tree, njobs)
+    sig_eff_ratio = calc_sig_ratio(tree, njobs)
+    eff = calc_efficiency(tree, njobs)
+    sig_eff = calc_sig_efficiency(tree, njobs)
+
+    out.write(f'Efficiency with fiducial requirements: {eff_ratio[0]}/{eff_ratio[1]} = {eff:.4f}\n')
+    out.write(f'Signal efficiency with fiducial requirements: {sig_eff_ratio[0]}/{sig_eff_ratio[1]} = {sig_eff:.4f}\n')
+    out.write('-'*80 + '\n')
 
 
 #-------------------------------------------------------------------------------
 
-# Print or write analytics to file
-output, verbose_output = get_analytics()
-print(output)
-if write_to_outfile:
-    with open('out/bkg_ana.txt', 'w') as f:
-        f.write('') # Clear file contents
-        f.write(output)
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--verbose', action='store_true', 
+                        help='Enable verbose output')
+    parser.add_argument('-s', '--sig', action='store_true',
+                        help='Analyze signal file instead of minbias file')
+    parser.add_argument('-o', '--outfile', action='store_true',
+                        help='Write to output text file (default: none)')
+    parser.add_argument('--verbose-format', choices=['text', 'jsonl'],
+                        default='text',
+                        help='Verbose section as text in the report, or as '
+                             'JSON lines in out/bkg_ana_candidates.jsonl '
+                             '(default: text)')
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help='Gzip-compress the output files')
+    parser.add_argument('--no-columns', action='store_true',
+                        help='Read the ROOT file even if it has a valid '
+                             'column cache')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes analyzing shards of the '
+                             'tree (default: 1; the verbose report needs 1)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the background analysis and print or write the report."""
+    args = parse_args(argv)
+    verbose = args.verbose
+    is_sig_file = args.sig
+    write_to_outfile = args.outfile
+
+    if is_sig_file:
+        infile = 'ntuple/MC_2018_Signal/fid_probnnmu_95_20260120.root'
+    else:
+        # infile = 'red/reduced.root'
+        # infile = 'red/reduced_fiducial_cuts.root'
+        infile = 'red/reduced_fiducial_reqs.root'
+
+    if write_to_outfile:
+        print(f'Reading from {infile}, writing to out/bkg_ana.txt.')
+    else: print(f'Reading from {infile}.')
+
+    # The verbose report is streamed while the events are processed
+    verbose_writer = None
+    if verbose and write_to_outfile:
+        verbose_writer = VerboseWriter(args.verbose_format,
+                                       'out/bkg_ana_candidates.jsonl',
+                                       args.compress)
+
+    # Memory-mapped column cache if there is a valid one, else the ROOT tree
+    branches = list(dict.fromkeys(BRANCHES + RATIO_BRANCHES
+                                  + SIG_RATIO_BRANCHES))
+    tree = None if args.no_columns else load_columns(infile, branches)
+    if tree is not None: print(f'Reading columns from {tree.cache_dir}')
+    else:
+        tfile = ROOT.TFile.Open(infile, 'READ')
+        tree = tfile.Get('tree')
+    monitor = Monitor('bkg_ana')
+    counts = analyze(tree, verbose_writer, monitor, args.jobs)
+
+    # Print and write analytics to file
+    if write_to_outfile:
+        report, report_path = open_report('out/bkg_ana.txt', args.compress)
+        write_analytics(ReportWriter(sys.stdout, report), counts, tree,
+                        args.jobs)
+        print()
+        if verbose_writer is not None:
+            verbose_writer.finish(report)
+        report.close()
+        monitor.write('out/bkg_ana.run.json', input=infile)
+        print(f'Background analysis results written to {report_path} file.')
+        if verbose_writer is not None and verbose_writer.path:
+            print(f'Verbose candidate information written to {verbose_writer.path}.')
+    else:
+        write_analytics(sys.stdout, counts, tree, args.jobs)
+        print()
         if verbose:
-            f.write('\n' + verbose_output)
-    print('Background analysis results written to out/bkg_ana.txt file.')
-elif verbose: 
-    print('Verbose output not written. Use -o flag to write to file.')
-    print('-' * 80)
+            print('Verbose output not written. Use -o flag to write to file.')
+            print('-' * 80)
+
+
+if __name__ == '__main__':
+    main()
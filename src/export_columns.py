@@ -0,0 +1,69 @@
+###############################################################################
+# Script to export reduced ntuples to memory-mapped column caches.            #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Writes the column cache (see utils/column_cache.py) of each reduced ntuple,
+unless it already has a valid one. The histogram stages and bkg_ana.py then
+read the memory-mapped columns instead of the ROOT file.'''
+
+from utils.column_cache import export_columns, load_meta, columns_path
+import time
+import argparse
+
+DEFAULT_FILES = ['red/reduced_fiducial_reqs.root',
+                 'red/reduced_fiducial_cuts.root']
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'files',
+        nargs='*',
+        default=DEFAULT_FILES,
+        help='ROOT files to export (default: the reduced ntuples)'
+    )
+    parser.add_argument(
+        '-b', '--branches',
+        nargs='+',
+        help='Branches to export (default: all)'
+    )
+    parser.add_argument(
+        '-f', '--force',
+        action='store_true',
+        help='Export even if the cache is valid'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Only report whether each cache is valid'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Export (or check) the column caches."""
+    args = parse_args(argv)
+
+    for infile in args.files:
+        meta = load_meta(infile)
+        if args.check:
+            state = 'valid' if meta else 'missing or out of date'
+            print(f'{columns_path(infile)}: {state}')
+            continue
+        if meta and not args.force and (
+                args.branches is None
+                or set(args.branches) <= set(meta['branches'])):
+            print(f'{columns_path(infile)} is up to date.')
+            continue
+        print(f'Exporting {infile}...')
+        start = time.perf_counter()
+        cache_dir = export_columns(infile, args.branches)
+        print(f'Done: wrote {cache_dir} in '
+              f'{time.perf_counter() - start:.1f} s.')
+
+
+if __name__ == '__main__':
+    main()
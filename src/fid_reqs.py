@@ -4,11 +4,33 @@
 # Author: Michael Peters                                                       #
 ################################################################################
 # TODO: Might replace offline_gen_cuts.py entirely with this
-
-import ROOT
+'''The selection checkpoints its progress every --checkpoint-every entries (see
+utils/checkpoint.py): the entries selected so far are appended to a file in
+the checkpoint directory and the next entry and efficiency counts recorded.
+After a crash, --resume refills the entry list from the checkpoint and
+continues the selection, giving the same output as an uninterrupted run.
+'''
+
+import os
 import sys
 import argparse
-from utils.calculate_efficiency import calc_efficiency, calc_sig_efficiency
+import numpy as np
+from dataclasses import asdict
+from utils.lazy_import import ROOT
+from utils.calculate_efficiency import EfficiencyCounts
+from utils.calculate_efficiency import RATIO_BRANCHES, SIG_RATIO_BRANCHES
+from utils.columnar import iter_chunks, iter_events
+from utils.instrument import Monitor, summary_path
+from utils.checkpoint import Checkpoint, DEFAULT_EVERY
+
+_ENTER_CODE = '''
+#include "TEntryList.h"
+// Add n entry numbers, in increasing order, to an entry list.
+void fid_enter_entries(TEntryList *elist, const Long64_t *entries, Long64_t n)
+{
+    for (Long64_t i = 0; i < n; ++i) elist->Enter(entries[i]);
+}
+'''
 
 #===============================================================================
 
@@ -59,104 +81,329 @@ def passes_reqs(pid, px, py, pz):
 #===============================================================================
 
 
-def apply_fiducial_reqs(tree):
+def apply_fiducial_reqs(tree, counts=None, monitor=None, checkpoint=None):
     """Apply fiducial cuts to generator-level particles.
     
-    Returns a new tree with only events that pass the fiducial cuts.
+    Returns a new tree with only events that pass the fiducial cuts. If an
+    EfficiencyCounts is given, every passing event is also added to it, so the
+    efficiencies need no extra pass over the new tree.
+
+    The cuts are applied event by event on per-event views of the branches
+    (see utils/columnar.py), and the passing entries are copied in one
+    CopyTree call through an entry list. The selection saves and resumes
+    from checkpoint if given.
     """
-
-    new_tree = tree.CloneTree(0)
-
-    print(f'entries: {tree.GetEntries()}')
-    for entryIdx in range(0, tree.GetEntries()):
-        # Print status
-        check_interval = 100000
-        if entryIdx % check_interval == 0 and entryIdx > 0:
-            print(f'  - Processed {entryIdx:,d} events, kept {new_tree.GetEntries()}...')
-        
-        tree.GetEntry(entryIdx)
-        
-        prt_pid = getattr(tree, 'prt_pid')  # Reconstructed particle pids
-        mc_pid = getattr(tree, 'mc_pid')  # MC-matched daughter pids
-        px = getattr(tree, 'mc_px')  # MC-matched daughter px
-        py = getattr(tree, 'mc_py')  # MC-matched daughter py
-        pz = getattr(tree, 'mc_pz')  # MC-matched daughter pz 
-
-        prt_pid = [int(pid) for pid in prt_pid]
-        mc_pid = [int(pid) for pid in mc_pid]
-        
-        passed = True
-        for i in range(0, len(mc_pid) - 3, 4):
-            pids = mc_pid[i:i + 4]
-            px4 = px[i:i + 4]
-            py4 = py[i:i + 4]
-            pz4 = pz[i:i + 4]
-            if len(pids) < 4: continue
-
-            if pids[0] != 221 or pids[1] != -13 or pids[2] != 13 or pids[3] != 22:
-                continue
-
-            passed = all(passes_reqs(pids[j], px4[j], py4[j], pz4[j]) 
-                         for j in range(4))
-            
-        if passed: new_tree.Fill()
-
+    branches = _branches(counts)
+    elist = ROOT.TEntryList(tree)
+    monitor = monitor or Monitor()
+
+    nentries = tree.GetEntries()
+    print(f'entries: {nentries}')
+    start, npassed = _resume_selection(checkpoint, elist, counts)
+    selected = []  # entries passed since the last checkpoint
+    with monitor.phase('select', nentries) as phase:
+        for event in iter_events(tree, branches, first=start):
+            phase.update(event.entry, npassed)  # progress line
+            if checkpoint and checkpoint.due(event.entry):
+                _save_selection(checkpoint, event.entry, selected, npassed,
+                                counts)
+            if not _passes_event(event): continue
+            elist.Enter(event.entry)
+            if checkpoint: selected.append(event.entry)
+            npassed += 1
+
+            if counts is not None:
+                counts.add_event(event.ints('tag_pid'), event.ints('prt_pid'),
+                                 event.ints('prt_idx_gen'),
+                                 event.ints('mc_pid'),
+                                 event.ints('mc_idx_mom'))
+        phase.update(nentries, npassed)
+    # A crash while copying does not have to redo the selection
+    if checkpoint:
+        _save_selection(checkpoint, nentries, selected, npassed, counts)
+
+    return _copy_entries(tree, elist, npassed, monitor)
+
+
+def _branches(counts):
+    """Branches read by the selection, plus those counted if counts."""
+    branches = ['mc_pid', 'mc_px', 'mc_py', 'mc_pz']
+    if counts is not None:
+        branches += [b for b in RATIO_BRANCHES + SIG_RATIO_BRANCHES
+                     if b not in branches]
+    return branches
+
+
+def _passes_event(event):
+    """Return whether an EventView passes the fiducial requirements."""
+    mc_pid = event.ints('mc_pid')  # MC-matched daughter pids
+    px = event['mc_px']  # MC-matched daughter px
+    py = event['mc_py']  # MC-matched daughter py
+    pz = event['mc_pz']  # MC-matched daughter pz 
+
+    passed = True
+    for i in range(0, len(mc_pid) - 3, 4):
+        pids = mc_pid[i:i + 4]
+        px4 = px[i:i + 4]
+        py4 = py[i:i + 4]
+        pz4 = pz[i:i + 4]
+        if len(pids) < 4: continue
+
+        if pids[0] != 221 or pids[1] != -13 or pids[2] != 13 or pids[3] != 22:
+            continue
+
+        passed = all(passes_reqs(pids[j], px4[j], py4[j], pz4[j]) 
+                     for j in range(4))
+    return passed
+
+
+def _resume_selection(checkpoint, elist, counts):
+    """Refill elist and counts from the state of an interrupted selection.
+    Returns the first entry still to select and the number passed so far."""
+    if checkpoint is None or checkpoint.state is None: return 0, 0
+    npassed = checkpoint.get('npassed')
+    path = checkpoint.path('entries.bin')
+    entries = np.fromfile(path, dtype=np.int64, count=npassed)
+    # Drop entries appended after the last saved state
+    os.truncate(path, npassed * entries.itemsize)
+    enter_entries(elist, entries)
+    if counts is not None:
+        counts.merge(EfficiencyCounts(**checkpoint.get('counts')))
+    return checkpoint.start, npassed
+
+
+def _save_selection(checkpoint, entry, selected, npassed, counts):
+    """Append the entries selected since the last checkpoint to its entry
+    file, then save the checkpoint at entry."""
+    os.makedirs(checkpoint.dir, exist_ok=True)
+    with open(checkpoint.path('entries.bin'), 'ab') as f:
+        np.asarray(selected, dtype=np.int64).tofile(f)
+    selected.clear()
+    checkpoint.save(entry, npassed=npassed,
+                    counts=asdict(counts) if counts is not None else None)
+
+
+def enter_entries(elist, entries):
+    """Add an array of entry numbers to a TEntryList in one C++ call."""
+    if len(entries) == 0: return
+    if not hasattr(ROOT, 'fid_enter_entries'):
+        ROOT.gInterpreter.Declare(_ENTER_CODE)
+    ROOT.fid_enter_entries(elist, np.ascontiguousarray(entries,
+                                                       dtype=np.longlong),
+                           len(entries))
+
+
+def _copy_entries(tree, elist, npassed, monitor):
+    """Copy the entries of elist from tree into a new tree."""
+    with monitor.phase('copy', npassed) as phase:
+        tree.SetEntryList(elist)
+        new_tree = tree.CopyTree('')
+        tree.SetEntryList(ROOT.nullptr)
+        phase.update(npassed, npassed)
     return new_tree
 
 
 #===============================================================================
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    '-o', '--outfile',
-    help='Output ROOT file'
-)
-parser.add_argument(
-    '-s', '--sig',
-    action='store_true',
-    help='Use signal file'
-)
-
-args = parser.parse_args()
-
-sig_file = args.sig
-if 'sig' in sys.argv[1:]:
-    sig_file = True
-
-# Default input and output files
-if sig_file:
-    infile = 'ntuple/MC_2018_Signal/probnnmu_95_20260120.root'
-    def_outfile = 'ntuple/MC_2018_Signal/fid_probnnmu_95_20260120.root'
-else:
-    infile = 'red/reduced.root'
-    def_outfile = 'red/reduced_fiducial_reqs.root'
 
-# Output file name
-outfile = ('red' + args.outfile) if args.outfile else def_outfile
-print(f'Reading from {infile}, writing to {outfile}.')
-
-tfile = ROOT.TFile.Open(infile, 'READ')
-tree = tfile.Get('tree')
+def pseudorapidity_np(px, py, pz):
+    """Vectorized pseudorapidity() for arrays of momentum components."""
+    p = np.sqrt(px**2 + py**2 + pz**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosTheta = np.where(p != 0, pz / p, 1.0)
+        eta = -0.5 * np.log((1.0 - cosTheta) / (1.0 + cosTheta))
+    # Same edge cases as pseudorapidity() when cosTheta^2 >= 1
+    edge = np.where(pz == 0, 0.0, np.where(pz > 0, 1e10, -1e10))
+    return np.where(cosTheta * cosTheta < 1, eta, edge)
+
+
+def passes_reqs_np(pid, px, py, pz):
+    """Vectorized passes_reqs() for arrays of (integer) pids and momentum
+    components. Returns a boolean array."""
+    p = np.sqrt(px**2 + py**2 + pz**2)  # momentum
+    pt = np.sqrt(px**2 + py**2)  # transverse momentum
+    eta = pseudorapidity_np(px, py, pz)
+    in_eta = (2.0 < eta) & (eta < 4.5)
+
+    is_muon = np.abs(pid) == 13
+    is_photon = pid == 22
+    is_eta = pid == 221
+    passed = ((is_muon & in_eta & (pt > 500) & (p > 3000))
+              | (is_photon & (pt > 500) & in_eta)
+              | is_eta)
+    # Prevent division by zero (wouldn't pass cuts anyway)
+    return passed & (p != 0)
 
-new_tfile = ROOT.TFile.Open(outfile, "RECREATE")
-new_tfile.cd()
 
-# Apply fiducial requirements
-new_tree = apply_fiducial_reqs(tree)
+def fiducial_mask(chunk):
+    """Return the per-event pass/fail decision of apply_fiducial_reqs for a
+    Chunk with mc_pid, mc_px, mc_py and mc_pz.
 
-print(f'Total kept entries: {new_tree.GetEntries()}')
+    Particles are taken in groups of four, and only groups matching
+    eta -> mu+ mu- gamma are checked. As in the loop version, the event
+    decision is that of the last matching group, and events without one pass.
+    """
+    nevents = len(chunk)
+    offsets = chunk.offsets['mc_pid']
+    pid = chunk['mc_pid'].astype(np.int64)
+    passed = np.ones(nevents, dtype=bool)
+
+    # Global index of the first particle of every full group of four
+    ngroups = np.diff(offsets) // 4
+    group_evt = np.repeat(np.arange(nevents), ngroups)
+    first = np.repeat(offsets[:-1], ngroups)
+    first += 4 * (np.arange(len(group_evt)) - np.repeat(
+        np.cumsum(ngroups) - ngroups, ngroups))
+    if len(first) == 0: return passed
+
+    idx = first[:, None] + np.arange(4)
+    is_decay = np.all(pid[idx] == np.array([221, -13, 13, 22]), axis=1)
+    idx, group_evt = idx[is_decay], group_evt[is_decay]
+    if len(idx) == 0: return passed
+
+    dtr_pass = passes_reqs_np(pid[idx], chunk['mc_px'][idx],
+                              chunk['mc_py'][idx], chunk['mc_pz'][idx])
+    group_pass = np.all(dtr_pass, axis=1)
+
+    # Groups are ordered by event, keep the last one of each event
+    is_last = np.append(group_evt[1:] != group_evt[:-1], True)
+    passed[group_evt[is_last]] = group_pass[is_last]
+    return passed
+
+
+def apply_fiducial_reqs_columnar(tree, counts=None, chunk_size=100000,
+                                 monitor=None, checkpoint=None):
+    """Columnar version of apply_fiducial_reqs.
+
+    The mc branches are read in chunks as flat arrays and the selection is
+    evaluated with array operations instead of event by event. The passing
+    entries of a chunk are added to the entry list in one C++ call.
+    Checkpoints are saved between chunks.
+    """
+    branches = _branches(counts)
+    elist = ROOT.TEntryList(tree)
+    monitor = monitor or Monitor()
+
+    nentries = tree.GetEntries()
+    print(f'entries: {nentries}')
+    start, npassed = _resume_selection(checkpoint, elist, counts)
+    selected = []  # entries passed since the last checkpoint
+    with monitor.phase('select', nentries) as phase:
+        for chunk in iter_chunks(tree, branches, chunk_size, first=start):
+            if checkpoint and checkpoint.due(chunk.start):
+                _save_selection(checkpoint, chunk.start, selected, npassed,
+                                counts)
+            mask = fiducial_mask(chunk)
+            if counts is not None: counts.add_chunk(chunk, mask)
+            passed = np.flatnonzero(mask) + chunk.start
+            enter_entries(elist, passed)
+            if checkpoint: selected.extend(passed.tolist())
+            npassed += len(passed)
+            phase.update(chunk.stop, npassed)
+    if checkpoint:
+        _save_selection(checkpoint, nentries, selected, npassed, counts)
+
+    return _copy_entries(tree, elist, npassed, monitor)
 
-# Close input file
-tfile.Close()
 
-# Calculate efficiencies with fiducial requirements in place
-eff = calc_efficiency(new_tree)
-sig_eff = calc_sig_efficiency(new_tree)
+#===============================================================================
 
-# Write new tree to output file 
-new_tree.Write()
-new_tfile.Close()
 
-print(f'Done: wrote reduced tree with fiducial requirements to {outfile}.')
-print(f'Efficiency with fiducial requirements: {eff:.6f}')
-print(f'Signal efficiency with fiducial requirements: {sig_eff:.6f}')
\ No newline at end of file
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-o', '--outfile',
+        help='Output ROOT file'
+    )
+    parser.add_argument(
+        '-s', '--sig',
+        action='store_true',
+        help='Use signal file'
+    )
+    parser.add_argument(
+        '-e', '--engine',
+        choices=['loop', 'columnar'],
+        default='loop',
+        help='Selection engine (default: loop)'
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        type=int,
+        default=DEFAULT_EVERY,
+        help='Save a checkpoint of the selection every N entries, 0 for none '
+             f'(default: {DEFAULT_EVERY})'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue from the last checkpoint of the output, if any'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Apply the fiducial requirements to the reduced ntuple and print the
+    efficiencies."""
+    args = parse_args(argv)
+
+    sig_file = args.sig
+    if 'sig' in (sys.argv[1:] if argv is None else argv):
+        sig_file = True
+
+    # Default input and output files
+    if sig_file:
+        infile = 'ntuple/MC_2018_Signal/probnnmu_95_20260120.root'
+        def_outfile = 'ntuple/MC_2018_Signal/fid_probnnmu_95_20260120.root'
+    else:
+        infile = 'red/reduced.root'
+        def_outfile = 'red/reduced_fiducial_reqs.root'
+
+    # Output file name
+    outfile = ('red' + args.outfile) if args.outfile else def_outfile
+    print(f'Reading from {infile}, writing to {outfile}.')
+
+    tfile = ROOT.TFile.Open(infile, 'READ')
+    tree = tfile.Get('tree')
+
+    new_tfile = ROOT.TFile.Open(outfile, "RECREATE")
+    new_tfile.cd()
+
+    # Apply fiducial requirements, counting efficiency inputs on the way
+    counts = EfficiencyCounts()
+    monitor = Monitor('fid_reqs')
+    checkpoint = Checkpoint(outfile, 'fid_reqs', [infile],
+                            {'engine': args.engine, 'counts': True},
+                            args.checkpoint_every, args.resume)
+    if args.engine == 'columnar':
+        new_tree = apply_fiducial_reqs_columnar(
+            tree, counts, monitor=monitor, checkpoint=checkpoint)
+    else:
+        new_tree = apply_fiducial_reqs(tree, counts, monitor, checkpoint)
+
+    print(f'Total kept entries: {new_tree.GetEntries()}')
+
+    # Close input file
+    tfile.Close()
+
+    # Efficiencies with fiducial requirements in place, from the counts
+    # collected during the selection (same as
+    # calc_efficiency/calc_sig_efficiency(new_tree))
+    eff = counts.efficiency()
+    sig_eff = counts.sig_efficiency()
+
+    # Write new tree to output file 
+    with monitor.phase('write') as phase:
+        new_tree.Write()
+        new_tfile.Close()
+    checkpoint.clear()
+    monitor.write(summary_path(outfile), engine=args.engine, input=infile,
+                  efficiency=eff, sig_efficiency=sig_eff)
+
+    print(f'Done: wrote reduced tree with fiducial requirements to {outfile}.')
+    print(f'Efficiency with fiducial requirements: {eff:.6f}')
+    print(f'Signal efficiency with fiducial requirements: {sig_eff:.6f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+###############################################################################
+# Step 3 of 4                                                                 #
+# Script to make gen-level, reconstructed and mass histograms in one pass.    #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Reads each input tree once and fills the histograms of hist_gen.py,
+hist_rec.py and hist_mass.py together, writing the same output files. Stages
+that read the same input file share one event loop.'''
+
+from utils.hist_engine import run_stages, default_files, STAGES
+from utils.instrument import Monitor
+import argparse
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'sig',
+        nargs='?',
+        choices=['sig'],
+        help='Use signal files'
+    )
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        choices=list(STAGES),
+        default=list(STAGES),
+        help='Histogram stages to run (default: all)'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always run the event loop, ignoring the histogram cache'
+    )
+    parser.add_argument(
+        '--no-columns',
+        action='store_true',
+        help='Read the ROOT files even if they have a valid column cache'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes filling shards of the tree (default: 1)'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Fill the histograms of the requested stages, one pass per input
+    file."""
+    args = parse_args(argv)
+    sig_file = args.sig == 'sig'
+
+    # Group stages by input file so each file is read once
+    groups = {}
+    for name in args.stages:
+        infile, outfile = default_files(name, sig_file)
+        groups.setdefault(infile, {})[name] = outfile
+
+    monitor = Monitor('hist_all')
+    for infile, outfiles in groups.items():
+        print(f'Reading from {infile}, writing to '
+              f'{", ".join(outfiles.values())}.')
+        run_stages(infile, outfiles, use_cache=not args.no_cache,
+                   monitor=monitor, use_columns=not args.no_columns,
+                   njobs=args.jobs)
+    monitor.write('hist/sig_hist_all.run.json' if sig_file
+                  else 'hist/hist_all.run.json', inputs=list(groups))
+
+
+if __name__ == '__main__':
+    main()
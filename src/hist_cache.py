@@ -0,0 +1,62 @@
+###############################################################################
+# Script to inspect or clear the histogram cache of step 3.                   #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Lists the entries of the content-addressed histogram cache (see
+utils/hist_cache.py), or evicts them, least recently used first.'''
+
+from utils.hist_cache import HistCache, CACHE_DIR, CACHE_MAX_BYTES
+import time
+import argparse
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'command',
+        nargs='?',
+        choices=['list', 'clear'],
+        default='list',
+        help='List the cache entries (default) or clear the cache'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=CACHE_DIR,
+        help='Cache directory'
+    )
+    parser.add_argument(
+        '--keep-mb',
+        type=float,
+        default=0,
+        help='With clear: keep the most recently used entries up to this size'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """List or clear the histogram cache."""
+    args = parse_args(argv)
+
+    cache = HistCache(args.cache_dir)
+
+    if args.command == 'clear':
+        nremoved = cache.clear(int(args.keep_mb * (1 << 20)))
+        print(f'Removed {nremoved} entries from {args.cache_dir}.')
+    else:
+        entries = cache.entries()
+        total = sum(entry['size'] for _, entry in entries)
+        print(f'{len(entries)} entries in {args.cache_dir}, '
+              f'{total / (1 << 20):.1f} / {CACHE_MAX_BYTES / (1 << 20):.0f} MB')
+        for key, entry in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M',
+                                      time.localtime(entry['last_used']))
+            print(f'{key[:12]}  {entry.get("stage", "?"):5s} '
+                  f'{entry["size"] / 1024:8.1f} kB  {entry["hits"]:4d} hits  '
+                  f'{last_used}  {entry.get("input", "")}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+###############################################################################
+# Script to write synthetic ntuples with the schema of the real ones.         #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Writes a synthetic 'tree' ntuple (see utils/synthetic.py) that the step
+scripts can read in place of the real MinBias or signal files, e.g. for tests
+and benchmarks on machines without the data:
+
+    python make_synth.py -n 1000000 -o synth/raw.root
+    python red_root.py -i synth/raw.root -o synth/reduced.root
+'''
+
+import os
+import time
+import argparse
+from utils.synthetic import write_ntuple
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--events',
+        type=int,
+        default=100000,
+        help='Number of events (default: 100000)'
+    )
+    parser.add_argument(
+        '--sparsity',
+        type=float,
+        default=0.9,
+        help='Fraction of empty events (default: 0.9)'
+    )
+    parser.add_argument(
+        '--signal-fraction',
+        type=float,
+        default=0.1,
+        help='Fraction of non-empty events with a signal decay (default: 0.1)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed (default: 0)'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=100000,
+        help='Events generated at a time (default: 100000)'
+    )
+    parser.add_argument(
+        '-o', '--outfile',
+        default='synth/synthetic.root',
+        help='Output ROOT file (default: synth/synthetic.root)'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Write the synthetic ntuple."""
+    args = parse_args(argv)
+    os.makedirs(os.path.dirname(args.outfile) or '.', exist_ok=True)
+
+    print(f'Writing {args.events:,d} events to {args.outfile} (sparsity '
+          f'{args.sparsity}, signal fraction {args.signal_fraction})')
+    start = time.perf_counter()
+    nfilled = write_ntuple(args.outfile, args.events, args.sparsity,
+                           args.signal_fraction, args.seed, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f'Done: wrote {args.events:,d} events ({nfilled:,d} non-empty) to '
+          f'{args.outfile} in {elapsed:.1f} s.')
+
+
+if __name__ == '__main__':
+    main()
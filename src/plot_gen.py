@@ -7,63 +7,69 @@
 # consider:
 # pull plot: see example, either do difference / bin error OR ratio
 
-import ROOT
-import sys
-
-# Optional command line argument: include stats box (none by default)
-include_stats = False
-sig_file = False
-if len(sys.argv) > 1:
-    if 'stats' in sys.argv[1:]:
-        include_stats = True
-    if 'sig' in sys.argv[1:]:
-        sig_file = True
-
-if sig_file:
-    infile = 'hist/sig_hist_gen.root'
-    fileheader = 'figs/sig/'
-else: 
-    infile = 'hist/hist_gen.root'
-    fileheader = 'figs/minbias/'
-
-print(f'Reading from {infile} and writing to {fileheader}*.png')
-
-tfile = ROOT.TFile.Open(infile, 'READ')
-
-# Get histograms from TFile
-hpid = tfile.Get('mc_pid')
-hm = tfile.Get('mc_m')
-hp = tfile.Get('mc_p')
-hpt = tfile.Get('mc_pt')
-hpz = tfile.Get('mc_pz')
-
-# Configure histogram
-for hist in (hpid, hm, hp, hpt, hpz):
+import argparse
+from utils.lazy_import import ROOT
+from utils.render import render_all, load_hist, default_jobs
+from utils.instrument import Monitor, summary_path
+
+# Histograms to draw, one png each
+names = ['mc_pid', 'mc_p', 
+         'mc_m', 
+         'mc_pt', 'mc_pz']
+titles = ['mc pid', 'mc momentum',
+          'mc mass',
+          'mc transverse momentum', 'mc pz']
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default). The
+    options 'stats', 'sig' may be given in any order and set the
+    attributes of the same name. 'legend' is accepted for symmetry with
+    plot_mass.py and ignored; other words are ignored with a warning, as
+    before."""
+    parser = argparse.ArgumentParser(
+        description='Draw the gen-level histograms to figs/*/mc_*.png')
+    parser.add_argument(
+        'options',
+        nargs='*',
+        metavar='{stats,sig,legend}',
+        help="'stats': include stats box, 'sig': use signal file, "
+             "'legend': no effect (these plots have no legend)"
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=default_jobs(len(names)),
+        help='Number of plots rendered in parallel'
+    )
+    args = parser.parse_args(argv)
+    unknown = [opt for opt in args.options
+               if opt not in ('stats', 'sig', 'legend')]
+    if unknown:
+        print(f'Warning: ignoring unknown options: {", ".join(unknown)}')
+    args.stats = 'stats' in args.options
+    args.sig = 'sig' in args.options
+    return args
+
+
+def draw_hist(infile, name, title, outfile, include_stats):
+    """Draw one histogram of infile to outfile on its own canvas."""
+    hist = load_hist(infile, name)
+
+    # Configure histogram
     # hist.Sumw2()  # statistical uncertainties by sum of weights squared
-    # Keep histogram in memory (not remove when files are closed)
-    hist.SetDirectory(0)
     hist.SetStats(0)
     hist.GetYaxis().SetTitle("Events")
     hist.GetXaxis().SetTitle("Momentum [MeV/c]")
     hist.SetFillStyle(0)  # no fill style
     hist.SetLineColor(ROOT.kBlue)
 
-# Create canvas
-canvas = ROOT.TCanvas('canvas')
-canvas.cd()
+    # Create canvas
+    canvas = ROOT.TCanvas(f'canvas_{name}')
+    canvas.cd()
 
-# Draw each histogram separately
-hists = [hpid, hp,
-         hm,
-         hpt, hpz]
-titles = ['mc pid', 'mc momentum',
-          'mc mass',
-          'mc transverse momentum', 'mc pz']
-names = ['mc_pid', 'mc_p', 
-         'mc_m', 
-         'mc_pt', 'mc_pz']
-
-for hist, name, title in zip(hists, names, titles):
     hist.SetTitle(title)
     # Include special formatting for specific histograms to look nice
     if name == 'mc_m': hist.GetXaxis().SetTitle("Mass [MeV]")
@@ -82,9 +88,35 @@ for hist, name, title in zip(hists, names, titles):
             stat.SetY1NDC(0.70)
             stat.SetY2NDC(0.85)
         else: hist.SetStats(1)
-    canvas.Print(f'{fileheader}{name}.png')
+    canvas.Print(outfile)
+
+    # Clear the canvas
+    canvas.Clear()
+
+
+def main(argv=None):
+    """Draw the gen-level plots."""
+    args = parse_args(argv)
+
+    if args.sig:
+        infile = 'hist/sig_hist_gen.root'
+        fileheader = 'figs/sig/'
+    else: 
+        infile = 'hist/hist_gen.root'
+        fileheader = 'figs/minbias/'
+
+    print(f'Reading from {infile} and writing to {fileheader}*.png')
+
+    # Draw each histogram separately, in batch mode on njobs processes
+    tasks = [(draw_hist, (infile, name, title, f'{fileheader}{name}.png',
+                          args.stats))
+             for name, title in zip(names, titles)]
+    monitor = Monitor('plot_gen')
+    render_all(tasks, args.jobs, monitor)
+    monitor.write(summary_path(fileheader + 'gen'), input=infile)
+
+    print(f'Done: wrote plots to {fileheader}gen*.png')
 
-# Clear the canvas
-canvas.Clear()
 
-print(f'Done: wrote plots to {fileheader}gen*.png')
+if __name__ == '__main__':
+    main()
@@ -4,78 +4,53 @@
 # Author: Michael Peters                                                      #
 ###############################################################################
 # TODO: consider pull plot. See tutorial; either do difference / bin error OR 
-# ratio.
-
-import ROOT
-import sys
-
-# Optional command line arguments: include legend, include stats box.
-# By default, no legend or stats box.
-include_legend = False
-include_stats = False
-sig_file = False
-if len(sys.argv) > 1:
-    if 'legend' in sys.argv[1:]:
-        include_legend = True
-    if 'stats' in sys.argv[1:]:
-        include_stats = True
-    if 'sig' in sys.argv[1:]:
-        sig_file = True
-
-if sig_file:
-    infile = 'hist/sig_hist_m.root'
-    fileheader = 'figs/sig/tag_m'
-else:
-    infile = 'hist/hist_m.root'
-    fileheader = 'figs/minbias/tag_m'
-
-print(f'Reading from {infile} and writing to {fileheader}_*.png')
-
-tfile = ROOT.TFile.Open(infile, 'READ')
-
-# Get histograms from TFile
-print("Getting histograms...")  # debug
-hsig = tfile.Get('sig')
-hbkg = tfile.Get('bkg')
-htot = tfile.Get('tot')
-
-# Configure histogram
-for hist in (hbkg, hsig, htot):
-    # hist.Sumw2()  # statistical uncertainties by sum of weights squared
-    # Keep histogram in memory (not remove when files are closed)
-    hist.SetDirectory(0)
-    hist.SetStats(0)
-    hist.GetXaxis().SetTitle("Mass [MeV]")
-    hist.GetYaxis().SetTitle("Events")
-
-# Histogram styling
-# Signal styling - black points with error bars
-hsig.SetMarkerStyle(20)  # filled circle
-hsig.SetMarkerSize(.5)
-hsig.SetLineWidth(1)
-hsig.SetLineColor(ROOT.kBlack)
-hsig.SetMarkerColor(ROOT.kBlack)
-
-# Background styling - gray fill
-hbkg.SetFillStyle(1001)
-hbkg.SetFillColor(ROOT.kGray+1)
-hbkg.SetLineColor(ROOT.kGray+1)
-
-# Total styling - black histogram
-htot.SetFillStyle(1001)
-htot.SetFillColor(ROOT.kBlack)
-htot.SetLineColor(ROOT.kBlack)
-
-# Create canvas
-canvas = ROOT.TCanvas('canvas')
-canvas.cd()
-
-
-# =============================================================================
-
-# Configure legend
+# ratio. utils/hist_view.py provides both (pull, ratio).
+
+import argparse
+from utils.lazy_import import ROOT
+from utils.render import render_all, load_hist, default_jobs
+from utils.hist_view import max_with_error
+from utils.instrument import Monitor, summary_path
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default). The
+    options 'legend', 'stats', 'sig' may be given in any order and set the
+    attributes of the same name. Other words are ignored with a warning, as
+    before."""
+    parser = argparse.ArgumentParser(
+        description='Draw the mass histograms to figs/*/tag_m_*.png')
+    parser.add_argument(
+        'options',
+        nargs='*',
+        metavar='{legend,stats,sig}',
+        help="'legend': include legend, 'stats': include stats box, "
+             "'sig': use signal file"
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=default_jobs(3),
+        help='Number of plots rendered in parallel'
+    )
+    args = parser.parse_args(argv)
+    unknown = [opt for opt in args.options
+               if opt not in ('legend', 'stats', 'sig')]
+    if unknown:
+        print(f'Warning: ignoring unknown options: {", ".join(unknown)}')
+    args.legend = 'legend' in args.options
+    args.stats = 'stats' in args.options
+    args.sig = 'sig' in args.options
+    return args
+
+
+#===============================================================================
+
+
 def draw_legend(hsig=None, hbkg=None):
-    print("Drawing legend...")  # debug
+    """Draw a legend for the signal and/or background histograms."""
     # Place legend in top-right corner partially inside plot area
     # (xlow, ylow, xup, yup)
     leg = ROOT.TLegend(0.79, 0.78, 0.98, 0.88)
@@ -87,73 +62,105 @@ def draw_legend(hsig=None, hbkg=None):
     leg.Draw()
     return leg
 
-# =============================================================================
+
+def load_mass_hists(infile):
+    """Return the styled signal, background and total histograms of
+    infile."""
+    # Get histograms from TFile
+    hsig = load_hist(infile, 'sig')
+    hbkg = load_hist(infile, 'bkg')
+    htot = load_hist(infile, 'tot')
+
+    # Configure histogram
+    for hist in (hbkg, hsig, htot):
+        # hist.Sumw2()  # statistical uncertainties by sum of weights squared
+        hist.SetStats(0)
+        hist.GetXaxis().SetTitle("Mass [MeV]")
+        hist.GetYaxis().SetTitle("Events")
+
+    # Histogram styling
+    # Signal styling - black points with error bars
+    hsig.SetMarkerStyle(20)  # filled circle
+    hsig.SetMarkerSize(.5)
+    hsig.SetLineWidth(1)
+    hsig.SetLineColor(ROOT.kBlack)
+    hsig.SetMarkerColor(ROOT.kBlack)
+
+    # Background styling - gray fill
+    hbkg.SetFillStyle(1001)
+    hbkg.SetFillColor(ROOT.kGray+1)
+    hbkg.SetLineColor(ROOT.kGray+1)
+
+    # Total styling - black histogram
+    htot.SetFillStyle(1001)
+    htot.SetFillColor(ROOT.kBlack)
+    htot.SetLineColor(ROOT.kBlack)
+    return hsig, hbkg, htot
+
+
+#===============================================================================
 # Draw each histogram separately
 
-print("Drawing individual histograms...")  # debug
 
-# Signal
-hsig.SetTitle('signal tag mass')
-hsig.Draw('pe1x0')  # p e 1 x0 : points; error bars; error bar lines; no x bars
-if include_stats: hsig.SetStats(1)
-canvas.Print(f'{fileheader}_sig.png')
+def draw_sig(infile, outfile, include_stats):
+    """Draw the signal mass histogram."""
+    hsig, _, _ = load_mass_hists(infile)
+    canvas = ROOT.TCanvas('canvas_sig')
+    canvas.cd()
+
+    hsig.SetTitle('signal tag mass')
+    hsig.Draw('pe1x0')  # p e 1 x0 : points; error bars; error bar lines; no x bars
+    if include_stats: hsig.SetStats(1)
+    canvas.Print(outfile)
+    canvas.Clear()
+
+
+def draw_bkg(infile, outfile, include_stats):
+    """Draw the background mass histogram."""
+    _, hbkg, _ = load_mass_hists(infile)
+    canvas = ROOT.TCanvas('canvas_bkg')
+    canvas.cd()
 
-# Background
-hbkg.SetTitle('background tag mass')
-hbkg.Draw('h')  # h: histogram
-if include_stats: hbkg.SetStats(1)
-canvas.Print(f'{fileheader}_bkg.png')
+    hbkg.SetTitle('background tag mass')
+    hbkg.Draw('h')  # h: histogram
+    if include_stats: hbkg.SetStats(1)
+    canvas.Print(outfile)
+    canvas.Clear()
 
-# Clear custom configs
-for hist in (hbkg, hsig):
-    hist.SetStats(0)
-    hist.SetTitle('')
-# Clear the canvas
-canvas.Clear()
 
-# =============================================================================
+#===============================================================================
 # Combine histograms and stack them on one canvas
 
-# htot used instead of hsig since it includes both signal and background, and
-# when background is superimposed only the signal will remain, creating the
-# appearance of a stacked histogram.
-
-print("Drawing stacked histogram...")  # debug
-
-# Title on combined plot
-hbkg.SetTitle('tag mass')
-
-# Find the largest y value among all histograms
-def get_max_with_error(hist, err=False, margin=1):
-    max_val = -float('inf')
-    for i in range(1, hist.GetNbinsX()+1):
-        val = hist.GetBinContent(i)
-        bin_err = hist.GetBinError(i) if err else 0
-        if val + bin_err > max_val:
-            max_val = val + bin_err
-    # Add a small margin to avoid clipping error bars
-    return max_val + margin
-
-# Find combined max y value considering error bars
-ymax = get_max_with_error(htot, err=True) + get_max_with_error(hbkg, margin=0)
-
-# Set the maximum for all histograms to ensure consistent y range
-for hist in (htot, hbkg):
-    hist.SetMaximum(ymax)
-    hist.SetMinimum(0)
-
-htot.Draw('h')
-hbkg.Draw('h, same')
-if include_legend: leg = draw_legend(hsig=htot, hbkg=hbkg)
-# Save canvas to file
-canvas.Print(f'{fileheader}_stacked.png')
-
-# Clear the canvas
-# Reset formatting
-for hist in (htot, hbkg):
-    hist.SetMaximum()
-    hist.SetMinimum()
-canvas.Clear()
+
+def draw_stacked(infile, outfile, include_legend):
+    """Draw the background on top of the total mass histogram.
+
+    htot used instead of hsig since it includes both signal and background,
+    and when background is superimposed only the signal will remain, creating
+    the appearance of a stacked histogram.
+    """
+    _, hbkg, htot = load_mass_hists(infile)
+    canvas = ROOT.TCanvas('canvas_stacked')
+    canvas.cd()
+
+    # Title on combined plot
+    hbkg.SetTitle('tag mass')
+
+    # Find combined max y value considering error bars
+    ymax = max_with_error(htot, err=True) + max_with_error(hbkg, margin=0)
+
+    # Set the maximum for all histograms to ensure consistent y range
+    for hist in (htot, hbkg):
+        hist.SetMaximum(ymax)
+        hist.SetMinimum(0)
+
+    htot.Draw('h')
+    hbkg.Draw('h, same')
+    if include_legend: leg = draw_legend(hsig=htot, hbkg=hbkg)
+    # Save canvas to file
+    canvas.Print(outfile)
+    canvas.Clear()
+
 
 # # =============================================================================
 # # Draw all histograms on one canvas
@@ -278,4 +285,33 @@ canvas.Clear()
 # # Clear the canvas
 # canvas.Clear()
 
-print(f'Done: wrote plots to {fileheader}_*.png')
+#===============================================================================
+
+
+def main(argv=None):
+    """Draw the signal, background and stacked mass plots."""
+    args = parse_args(argv)
+
+    if args.sig:
+        infile = 'hist/sig_hist_m.root'
+        fileheader = 'figs/sig/tag_m'
+    else:
+        infile = 'hist/hist_m.root'
+        fileheader = 'figs/minbias/tag_m'
+
+    print(f'Reading from {infile} and writing to {fileheader}_*.png')
+
+    # Independent plots, in batch mode on njobs processes
+    tasks = [(draw_sig, (infile, f'{fileheader}_sig.png', args.stats)),
+             (draw_bkg, (infile, f'{fileheader}_bkg.png', args.stats)),
+             (draw_stacked, (infile, f'{fileheader}_stacked.png',
+                             args.legend))]
+    monitor = Monitor('plot_mass')
+    render_all(tasks, args.jobs, monitor)
+    monitor.write(summary_path(fileheader), input=infile)
+
+    print(f'Done: wrote plots to {fileheader}_*.png')
+
+
+if __name__ == '__main__':
+    main()
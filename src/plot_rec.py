@@ -7,73 +7,73 @@
 # consider:
 # pull plot: see example, either do difference / bin error OR ratio
 
-import ROOT
-import sys
-
-# Optional command line argument: include stats box (none by default)
-include_stats = False
-sig_file = False
-if len(sys.argv) > 1:
-    if 'stats' in sys.argv[1:]:
-        include_stats = True
-    if 'sig' in sys.argv[1:]:
-        sig_file = True
-
-if sig_file:
-    infile = 'hist/sig_hist_rec.root'
-    fileheader = 'figs/sig/rec'
-else:
-    infile = 'hist/hist_rec.root'
-    fileheader = 'figs/minbias/rec'
-
-print(f'Reading from {infile} and writing to {fileheader}_*.png')
-
-tfile = ROOT.TFile.Open(infile, 'READ')
-
-# Get histograms from TFile
-htpid = tfile.Get('tag_pid')
-htm = tfile.Get('tag_m')
-htp = tfile.Get('tag_p')
-htpt = tfile.Get('tag_pt')
-htpz = tfile.Get('tag_pz')
-hppid = tfile.Get('prt_pid')
-hpp = tfile.Get('prt_p')
-hppz = tfile.Get('prt_pz')
-hppt = tfile.Get('prt_pt')
-
-# Configure histogram
-for hist in (htpid, htm, htp, htpt, htpz, hppid, hpp, hppz, hppt):
+import argparse
+from utils.lazy_import import ROOT
+from utils.render import render_all, load_hist, default_jobs
+from utils.instrument import Monitor, summary_path
+
+# Histograms to draw, one png each
+names = ['tag_pid', 'tag_p', 
+         'tag_pt', 'tag_pz', 
+         'tag_m',
+         'prt_pid', 'prt_p', 
+         'prt_pt', 'prt_pz']
+titles = ['reconstructed tag pid', 'reconstructed tag momentum', 
+          'reconstructed tag transverse momentum', 'reconstructed tag pz',
+          'reconstructed tag mass',
+          'reconstructed daughter pid', 'reconstructed daughter momentum', 
+          'reconstructed daughter transverse momentum', 'reconstructed daughter pz']
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default). The
+    options 'stats', 'sig' may be given in any order and set the
+    attributes of the same name. 'legend' is accepted for symmetry with
+    plot_mass.py and ignored; other words are ignored with a warning, as
+    before."""
+    parser = argparse.ArgumentParser(
+        description='Draw the reconstructed histograms to figs/*/rec*.png')
+    parser.add_argument(
+        'options',
+        nargs='*',
+        metavar='{stats,sig,legend}',
+        help="'stats': include stats box, 'sig': use signal file, "
+             "'legend': no effect (these plots have no legend)"
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=default_jobs(len(names)),
+        help='Number of plots rendered in parallel'
+    )
+    args = parser.parse_args(argv)
+    unknown = [opt for opt in args.options
+               if opt not in ('stats', 'sig', 'legend')]
+    if unknown:
+        print(f'Warning: ignoring unknown options: {", ".join(unknown)}')
+    args.stats = 'stats' in args.options
+    args.sig = 'sig' in args.options
+    return args
+
+
+def draw_hist(infile, name, title, outfile, include_stats):
+    """Draw one histogram of infile to outfile on its own canvas."""
+    hist = load_hist(infile, name)
+
+    # Configure histogram
     # hist.Sumw2()  # statistical uncertainties by sum of weights squared
-    # Keep histogram in memory (not remove when files are closed)
-    hist.SetDirectory(0)
     hist.SetStats(0)
     hist.GetYaxis().SetTitle("Events")
     hist.GetXaxis().SetTitle("Momentum [MeV/c]")
     hist.SetFillStyle(0)  # no fill style
     hist.SetLineColor(ROOT.kBlue)
 
-# Create canvas
-canvas = ROOT.TCanvas('canvas')
-canvas.cd()
+    # Create canvas
+    canvas = ROOT.TCanvas(f'canvas_{name}')
+    canvas.cd()
 
-# Draw each histogram separately
-hists = [htpid, htp, 
-         htpt, htpz,
-         htm,
-         hppid, hpp, 
-         hppt, hppz]
-titles = ['reconstructed tag pid', 'reconstructed tag momentum', 
-          'reconstructed tag transverse momentum', 'reconstructed tag pz',
-          'reconstructed tag mass',
-          'reconstructed daughter pid', 'reconstructed daughter momentum', 
-          'reconstructed daughter transverse momentum', 'reconstructed daughter pz']
-names = ['tag_pid', 'tag_p', 
-         'tag_pt', 'tag_pz', 
-         'tag_m',
-         'prt_pid', 'prt_p', 
-         'prt_pt', 'prt_pz']
-
-for hist, name, title in zip(hists, names, titles):
     hist.SetTitle(title)
     if name == 'tag_m': hist.GetXaxis().SetTitle("Mass [MeV]")  # special case
     elif name in ['prt_pid', 'tag_pid']: hist.GetXaxis().SetTitle("Particle ID")  # special case
@@ -89,9 +89,35 @@ for hist, name, title in zip(hists, names, titles):
             stat.SetY1NDC(0.70)
             stat.SetY2NDC(0.85)
         else: hist.SetStats(1)
-    canvas.Print(f'{fileheader}{name}.png')
+    canvas.Print(outfile)
+
+    # Clear the canvas
+    canvas.Clear()
+
+
+def main(argv=None):
+    """Draw the reconstructed tag and daughter plots."""
+    args = parse_args(argv)
+
+    if args.sig:
+        infile = 'hist/sig_hist_rec.root'
+        fileheader = 'figs/sig/rec'
+    else:
+        infile = 'hist/hist_rec.root'
+        fileheader = 'figs/minbias/rec'
+
+    print(f'Reading from {infile} and writing to {fileheader}_*.png')
+
+    # Draw each histogram separately, in batch mode on njobs processes
+    tasks = [(draw_hist, (infile, name, title, f'{fileheader}{name}.png',
+                          args.stats))
+             for name, title in zip(names, titles)]
+    monitor = Monitor('plot_rec')
+    render_all(tasks, args.jobs, monitor)
+    monitor.write(summary_path(fileheader), input=infile)
+
+    print(f'Done: wrote plots to {fileheader}*.png')
 
-# Clear the canvas
-canvas.Clear()
 
-print(f'Done: wrote plots to {fileheader}*.png')
+if __name__ == '__main__':
+    main()
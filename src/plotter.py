@@ -1,23 +1,273 @@
+###############################################################################
+# Script to run steps 3 and 4 (histograms and plots) as a dependency graph.   #
+# Author: Michael Peters                                                      #
+###############################################################################
+'''Each stage of a pipeline declares the files it reads and writes. A stage is
+started as soon as the stages producing its inputs have finished, so
+independent stages (and the signal and MinBias pipelines) run at the same time
+on a pool of workers. Like make, a stage is skipped if all its outputs exist
+and are newer than all its inputs (including its own script); use --force to
+run everything.
+
+By default every stage is a separate lb-conda python3 process. With
+--in-process (run plotter.py itself inside lb-conda), ROOT and the step
+scripts are imported once, and stages call the main() of their script in
+worker processes forked from this one, so the interpreter and ROOT startup
+cost is paid once per run instead of once per stage.
+'''
+
+import os
+import sys
+import time
+import argparse
+import importlib
+import traceback
 import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, wait
+from utils.hist_cache import CODE_FILES
 
 PY = ["lb-conda", "default", "python3"]
 
-commands = [
-    # Signal
-    # ['src/rec_hist.py', 'sig'],
-    # ['src/rec_plot.py', 'sig', 'stats', 'legend'],
-    # ['src/gen_hist.py', 'sig'],
-    # ['src/gen_plot.py', 'sig', 'stats', 'legend'],
-    # ['src/mass_hist.py', 'sig'],
-    # ['src/mass_plot.py', 'sig', 'stats', 'legend'],
-    # Minbias
-    ['src/hist_rec.py'],
-    ['src/plot_rec.py', 'stats', 'legend'],
-    ['src/hist_gen.py'],
-    ['src/plot_gen.py', 'stats', 'legend'],
-    ['src/hist_mass.py'],
-    ['src/plot_mass.py', 'stats', 'legend'],
-]
-
-for args in commands:
-    subprocess.run(PY + args, check=True)
+# Input ntuple of each histogram stage
+NTUPLES = {
+    'minbias': {'gen': 'red/reduced_fiducial_cuts.root',
+                'rec': 'red/reduced_fiducial_cuts.root',
+                'mass': 'red/reduced_fiducial_cuts.root'},
+    'sig': {'gen': 'MC_2018_Signal/eta2MuMuGamma_mc_20251121.root',
+            'rec': 'MC_2018_Signal/eta2MuMuGamma_mc_20251208.root',
+            'mass': 'MC_2018_Signal/eta2MuMuGamma_mc_20251208.root'},
+}
+# Histogram file prefix and figure directory of each pipeline
+HIST_PREFIX = {'minbias': 'hist/', 'sig': 'hist/sig_'}
+FIGS_DIR = {'minbias': 'figs/minbias/', 'sig': 'figs/sig/'}
+
+# Histogram engine sources, inputs of every hist stage (the same files as
+# the code version of the histogram cache)
+HIST_CODE = ['src/hist_all.py'] + [f'src/utils/{name}' for name in CODE_FILES]
+# Shared rendering sources, inputs of every plot stage
+PLOT_CODE = ['src/utils/render.py', 'src/utils/hist_view.py']
+
+#===============================================================================
+
+
+class Stage:
+    """A command with the files it reads and writes."""
+
+    def __init__(self, name, args, inputs, outputs):
+        self.name = name
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+
+    @property
+    def module(self):
+        """Module name of the stage's script."""
+        return os.path.splitext(os.path.basename(self.args[0]))[0]
+
+    def up_to_date(self):
+        """Check whether all outputs exist and are newer than all inputs."""
+        if not all(os.path.exists(f) for f in self.outputs): return False
+        inputs = [f for f in self.inputs if os.path.exists(f)]
+        if not inputs: return True
+        newest_input = max(os.path.getmtime(f) for f in inputs)
+        oldest_output = min(os.path.getmtime(f) for f in self.outputs)
+        return oldest_output >= newest_input
+
+
+def pipeline(mode):
+    """Return the stages of the signal ('sig') or MinBias ('minbias')
+    pipeline."""
+    hist = {'gen': HIST_PREFIX[mode] + 'hist_gen.root',
+            'rec': HIST_PREFIX[mode] + 'hist_rec.root',
+            'mass': HIST_PREFIX[mode] + 'hist_m.root'}
+    figs = FIGS_DIR[mode]
+    sig = ['sig'] if mode == 'sig' else []
+
+    stages = []
+    # Histogram stages sharing an input ntuple are filled in a single pass
+    groups = {}
+    for name, ntuple in NTUPLES[mode].items():
+        groups.setdefault(ntuple, []).append(name)
+    for ntuple, names in groups.items():
+        stages.append(Stage(
+            f'{mode}:hist_{"_".join(names)}',
+            ['src/hist_all.py'] + sig + ['--stages'] + names,
+            [ntuple] + HIST_CODE,
+            [hist[name] for name in names]))
+
+    # Plot stages, one per histogram file
+    rec_names = ['tag_pid', 'tag_p', 'tag_pt', 'tag_pz', 'tag_m',
+                 'prt_pid', 'prt_p', 'prt_pt', 'prt_pz']
+    gen_names = ['mc_pid', 'mc_p', 'mc_m', 'mc_pt', 'mc_pz']
+    mass_names = ['sig', 'bkg', 'stacked']
+    stages += [
+        Stage(f'{mode}:plot_rec',
+              ['src/plot_rec.py'] + sig + ['stats'],
+              [hist['rec'], 'src/plot_rec.py'] + PLOT_CODE,
+              [f'{figs}rec{name}.png' for name in rec_names]),
+        Stage(f'{mode}:plot_gen',
+              ['src/plot_gen.py'] + sig + ['stats'],
+              [hist['gen'], 'src/plot_gen.py'] + PLOT_CODE,
+              [f'{figs}{name}.png' for name in gen_names]),
+        Stage(f'{mode}:plot_mass',
+              ['src/plot_mass.py'] + sig + ['stats', 'legend'],
+              [hist['mass'], 'src/plot_mass.py'] + PLOT_CODE,
+              [f'{figs}tag_m_{name}.png' for name in mass_names]),
+    ]
+    return stages
+
+
+#===============================================================================
+
+
+def run_stage(stage, dry_run=False):
+    """Run the command of a stage. Returns its exit code."""
+    print(f'[{stage.name}] ' + ' '.join(PY + stage.args), flush=True)
+    if dry_run: return 0
+    for f in stage.outputs:
+        if os.path.dirname(f): os.makedirs(os.path.dirname(f), exist_ok=True)
+    start = time.time()
+    try:
+        code = subprocess.run(PY + stage.args).returncode
+    except OSError as err:
+        print(f'[{stage.name}] {err}', flush=True)
+        code = 127
+    status = 'done' if code == 0 else f'FAILED (exit code {code})'
+    print(f'[{stage.name}] {status} in {time.time() - start:.1f} s',
+          flush=True)
+    return code
+
+
+def run_stage_in_process(stage, dry_run=False):
+    """Run a stage by calling main() of its script module. Returns its exit
+    code."""
+    print(f'[{stage.name}] {stage.module}.main({stage.args[1:]})', flush=True)
+    if dry_run: return 0
+    for f in stage.outputs:
+        if os.path.dirname(f): os.makedirs(os.path.dirname(f), exist_ok=True)
+    start = time.time()
+    try:
+        importlib.import_module(stage.module).main(stage.args[1:])
+        code = 0
+    except SystemExit as err:
+        code = err.code if isinstance(err.code, int) else int(bool(err.code))
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    status = 'done' if code == 0 else f'FAILED (exit code {code})'
+    print(f'[{stage.name}] {status} in {time.time() - start:.1f} s',
+          flush=True)
+    return code
+
+
+def in_process_pool(stages, njobs):
+    """Import ROOT and the stages' script modules, then return a pool of
+    worker processes forked from this one, which inherit them."""
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    for stage in stages:
+        importlib.import_module(stage.module)
+    ctx = multiprocessing.get_context('fork')
+    return ProcessPoolExecutor(max_workers=njobs, mp_context=ctx)
+
+
+def run_graph(stages, njobs, force=False, dry_run=False, in_process=False):
+    """Run stages on njobs workers as soon as their dependencies are done.
+
+    Stages are separate processes, or with in_process, calls to main() of
+    their script in forked workers. Stages depending on a failed stage are
+    not run. Returns the names of the failed stages.
+    """
+    if in_process and not dry_run:
+        pool, run = in_process_pool(stages, njobs), run_stage_in_process
+    else:
+        pool, run = ThreadPoolExecutor(max_workers=njobs), run_stage
+    producer = {f: s for s in stages for f in s.outputs}
+    deps = {s: {producer[f] for f in s.inputs if f in producer}
+            for s in stages}
+    pending, running = list(stages), {}
+    done, failed = set(), set()
+
+    with pool:
+        while pending or running:
+            # Start (or skip) every stage whose dependencies have finished
+            for stage in list(pending):
+                if deps[stage] & failed:
+                    print(f'[{stage.name}] not run: a dependency failed',
+                          flush=True)
+                    pending.remove(stage)
+                    failed.add(stage)
+                elif deps[stage] <= done:
+                    pending.remove(stage)
+                    if not force and not dry_run and stage.up_to_date():
+                        print(f'[{stage.name}] up to date', flush=True)
+                        done.add(stage)
+                    else:
+                        running[pool.submit(run, stage, dry_run)] = stage
+            if not running: continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                (done if future.result() == 0 else failed).add(stage)
+
+    return [s.name for s in stages if s in failed]
+
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-m', '--pipelines',
+        nargs='+',
+        choices=['minbias', 'sig'],
+        default=['minbias'],
+        help='Pipelines to run side by side (default: minbias)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of stages run at the same time'
+    )
+    parser.add_argument(
+        '-B', '--force',
+        action='store_true',
+        help='Run all stages, even if their outputs are up to date'
+    )
+    parser.add_argument(
+        '-n', '--dry-run',
+        action='store_true',
+        help='Print the commands without running them'
+    )
+    parser.add_argument(
+        '--in-process',
+        action='store_true',
+        help='Load ROOT once and run the stages in forked workers of this '
+             'process'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the stages of the selected pipelines."""
+    args = parse_args(argv)
+
+    stages = []
+    for mode in args.pipelines:
+        stages += pipeline(mode)
+
+    failed = run_graph(stages, args.jobs, args.force, args.dry_run,
+                       args.in_process)
+    if failed:
+        print(f'Failed stages: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,66 +6,573 @@
 '''This is step one of four in generating plots from ntuple data. This script
 reads in multiple ntuple root files, extracts all non-empty events and fills
 all information into a new ntuple root file.
+
+Three skim engines are available, all writing the same reduced tree:
+- loop: a python event loop over per-event views of the indicator branches,
+  read in chunks (see utils/columnar.py); only kept entries are read in full.
+- rdf: the same non-empty filter expressed as an RDataFrame Filter + Snapshot,
+  run with implicit multithreading switched off for the snapshot, so entries
+  are written in input order.
+- twophase: first scans only the indicator branches, a chunk at a time with
+  array operations, to find the non-empty entries, then reads and copies just
+  those entries with all branches on.
+  The non-empty entries of each input are stored in an occupancy index
+  sidecar next to it (see utils/event_index.py), so reruns skip the scan.
+
+With --jobs N each input file is skimmed into its own partial reduced file by a
+pool of N processes, and the partials are then merged into the output in input
+order, so the result does not depend on the number of workers. Partials can
+also be written by separate invocations (--no-merge) and merged later
+(--merge-only).
+
+With --incremental, a manifest next to the output (see utils/manifest.py)
+records which inputs it contains, with the engine and event counts of each,
+and only new or changed inputs (or all, if the engine changed) are skimmed.
+
+Progress lines and a JSON run summary next to the output (reduced.run.json)
+give the time, throughput and memory use of every phase (see
+utils/instrument.py).
+
+The loop and twophase engines on a single chain checkpoint their progress
+every --checkpoint-every input entries (see utils/checkpoint.py): the partial
+output is AutoSaved and the next entry recorded. After a crash, --resume
+continues from the last checkpoint and gives the same reduced tree as an
+uninterrupted run.
 '''
 
-import ROOT
 import os
+import bisect
+import hashlib
+import argparse
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils.lazy_import import ROOT
+from utils.columnar import iter_chunks, iter_events
+from utils.event_index import load_index, write_index
+from utils.manifest import load_manifest, save_manifest, file_record, is_current
+from utils.instrument import Monitor, summary_path, bytes_read
+from utils.checkpoint import Checkpoint, DEFAULT_EVERY
+from utils.checkpoint import open_output, save_output, close_output
+
+# Empty event indicators: an event is kept if any of these is non-empty
+branch_names = ['tag_pid', 'prt_pid', 'mc_pid']
+
+#===============================================================================
+
+
+def skim_loop(chain, outfile, monitor=None, checkpoint=None):
+    """Copy all non-empty events of chain into outfile with a python loop,
+    saving and resuming from checkpoint if given.
+
+    Returns the number of kept events.
+    """
+    # Create reduced TFile and TTree (after the events of a resumed run)
+    tfile, tree, nkept = open_output(chain, outfile, checkpoint)
+    start = checkpoint.start if checkpoint else 0
+
+    # Loop over all entries in chain and fill only non-empty events. The
+    # indicator branches are read in chunks, full entries only when kept.
+    nentries = chain.GetEntries()
+    with (monitor or Monitor()).phase('skim', nentries) as phase:
+        for event in iter_events(chain, branch_names, first=start):
+            phase.update(event.entry, nkept)  # progress line
+            if checkpoint and checkpoint.due(event.entry):
+                save_output(tree, checkpoint, event.entry)
+
+            # Check if event is empty by looking at all branches
+            is_empty = True
+            for branch_name in branch_names:
+                if len(event[branch_name]) > 0:
+                    is_empty = False
+                    break
+            if is_empty: continue
+
+            # print("Event passed selection. Filling event...")  # debug
+
+            # Fill all branches for this entry
+            chain.GetEntry(event.entry)
+            tree.Fill()
+            nkept += 1
+        phase.update(nentries, nkept)
+
+    # Write to TFile
+    return close_output(tfile, tree, outfile, checkpoint, nentries)
+
+
+#===============================================================================
+
+
+def skim_rdf(chain, outfile, monitor=None):
+    """Copy all non-empty events of chain into outfile with RDataFrame.
+
+    Under ROOT.EnableImplicitMT, a Snapshot writes entries in whatever order
+    the worker threads finish, and rdfentry_ is not the chain entry number,
+    so the order could not be restored reliably. Implicit multithreading is
+    therefore switched off while the snapshot runs, which writes the kept
+    entries in chain order, the same tree as skim_loop, and the caller's
+    setting (and thread pool size) is restored afterwards. Use --jobs to skim
+    several input files at once.
+
+    Returns the number of kept events.
+    """
+    # Keep event if any indicator branch is non-empty
+    selection = ' || '.join(f'{name}.size() > 0' for name in branch_names)
+    columns = [str(b.GetName()) for b in chain.GetListOfBranches()]
+
+    nentries = chain.GetEntries()
+    imt_threads = ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() \
+        else None
+    ROOT.DisableImplicitMT()
+    try:
+        with (monitor or Monitor()).phase('snapshot', nentries) as phase:
+            df = ROOT.RDataFrame(chain).Filter(selection)
+            nkept = df.Count()  # filled in the same loop as the snapshot
+            df.Snapshot('tree', outfile, columns)
+            phase.update(nentries, nkept.GetValue())
+    finally:
+        if imt_threads is not None: ROOT.EnableImplicitMT(imt_threads)
+    return nkept.GetValue()
+
+
+#===============================================================================
+
+
+def scan_entries(tree, phase=None, offset=0):
+    """Return the non-empty entry numbers of tree, reading only the indicator
+    branches in chunks, and the numbers of bytes read from disk and
+    decompressed doing so. Progress goes to phase, with the entries of tree
+    counted from offset.
+    """
+    disk_start = ROOT.TFile.GetFileBytesRead()
+    # All entries of the indicator branches are read, so all their baskets
+    # are decompressed
+    unzipped = sum(int(tree.GetBranch(name).GetTotBytes())
+                   for name in branch_names)
+    entries = []
+    for chunk in iter_chunks(tree, branch_names):
+        nonempty = np.zeros(len(chunk), dtype=bool)
+        for branch_name in branch_names:
+            nonempty |= chunk.counts(branch_name) > 0
+        entries.extend((np.flatnonzero(nonempty) + chunk.start).tolist())
+        if phase is not None: phase.update(offset + chunk.stop)
+    return entries, ROOT.TFile.GetFileBytesRead() - disk_start, unzipped
+
+
+def find_entries(chain, use_index=True, monitor=None):
+    """Return the non-empty entry numbers of chain (global chain entries),
+    the numbers of bytes read from disk and decompressed to find them, and
+    the number of files whose entries came from their index.
+
+    Each input file is scanned separately. With use_index, a valid occupancy
+    index sidecar replaces the scan of its file, and files without one get
+    their index written after scanning.
+    """
+    entries = []
+    disk_bytes, unzipped_bytes, nindexed = 0, 0, 0
+    offset = 0
+    with (monitor or Monitor()).phase('scan', chain.GetEntries()) as phase:
+        for element in chain.GetListOfFiles():
+            infile = element.GetTitle()
+            index = load_index(infile, branch_names) if use_index else None
+            if index is not None:
+                print(f'  - Using occupancy index for {infile}')
+                local, nentries = index['entries'], index['nentries']
+                nindexed += 1
+            else:
+                tfile = ROOT.TFile.Open(infile, 'READ')
+                tree = tfile.Get('tree')
+                nentries = tree.GetEntries()
+                local, disk, unzipped = scan_entries(tree, phase, offset)
+                disk_bytes += disk
+                unzipped_bytes += unzipped
+                tfile.Close()
+                if use_index:
+                    write_index(infile, local, nentries, branch_names)
+            entries.extend(offset + e for e in local)
+            offset += nentries
+            phase.update(offset, len(entries))
+    return entries, disk_bytes, unzipped_bytes, nindexed
+
+
+def skim_two_phase(chain, outfile, use_index=True, monitor=None,
+                   checkpoint=None):
+    """Copy all non-empty events of chain into outfile in two passes.
+
+    Phase 1 reads only the indicator branches to collect the non-empty entry
+    numbers (or takes them from the occupancy index sidecars). Phase 2 reads
+    only those entries with all branches on, so the empty events are never
+    fully decompressed. Phase 2 saves and resumes from checkpoint if given;
+    on resume, phase 1 is fast with the index sidecars.
+
+    Returns the number of kept events.
+    """
+    monitor = monitor or Monitor()
+    # Phase 1: find non-empty entries
+    entries, disk_bytes, unzipped_bytes, nindexed = find_entries(
+        chain, use_index, monitor)
+    print(f'  - Phase 1: {disk_bytes:,d} bytes read from disk, '
+          f'{unzipped_bytes:,d} bytes decompressed, {len(entries)} of '
+          f'{chain.GetEntries()} events non-empty ({nindexed} of '
+          f'{chain.GetListOfFiles().GetEntries()} files from their index)')
+
+    # Phase 2: copy surviving entries with all branches on
+    tfile, tree, _ = open_output(chain, outfile, checkpoint)
+    first = bisect.bisect_left(entries, checkpoint.start) if checkpoint else 0
+
+    disk_start = ROOT.TFile.GetFileBytesRead()
+    unzipped_bytes = 0
+    with monitor.phase('copy', len(entries)) as phase:
+        for k in range(first, len(entries)):
+            entryIdx = entries[k]
+            phase.update(k, k)
+            if checkpoint and checkpoint.due(entryIdx):
+                save_output(tree, checkpoint, entryIdx)
+            unzipped_bytes += chain.GetEntry(entryIdx)
+            tree.Fill()
+        phase.update(len(entries), len(entries))
+    disk_bytes = ROOT.TFile.GetFileBytesRead() - disk_start
+    print(f'  - Phase 2: {disk_bytes:,d} bytes read from disk, '
+          f'{unzipped_bytes:,d} bytes decompressed')
+
+    return close_output(tfile, tree, outfile, checkpoint, chain.GetEntries())
+
+
+def run_engine(chain, outfile, engine='loop', use_index=True, monitor=None,
+               checkpoint=None):
+    """Skim chain into outfile with the named engine. Returns kept events.
+    The rdf engine cannot be checkpointed."""
+    if engine == 'rdf': return skim_rdf(chain, outfile, monitor)
+    elif engine == 'twophase':
+        return skim_two_phase(chain, outfile, use_index, monitor, checkpoint)
+    else: return skim_loop(chain, outfile, monitor, checkpoint)
+
+
+#===============================================================================
+
+
+def partial_path(infile, partial_dir):
+    """Return the partial reduced file name for a single input file.
+
+    The name is the input file name with a short hash of its absolute path,
+    e.g. ntuple.1a2b3c4d.reduced.root. It only depends on the input path, so
+    partials written by separate invocations can be found again, and inputs
+    with the same name in different directories do not collide.
+    """
+    path = os.path.abspath(infile)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    tag = hashlib.sha256(path.encode()).hexdigest()[:8]
+    return os.path.join(partial_dir, f'{stem}.{tag}.reduced.root')
+
+
+def skim_file(infile, outfile, engine='loop', use_index=True):
+    """Skim a single input file into outfile with the given engine.
+
+    Returns (number of processed events, number of kept events).
+    """
+    chain = ROOT.TChain('tree')
+    chain.Add(infile)
+    nkept = run_engine(chain, outfile, engine, use_index)
+    return chain.GetEntries(), nkept
+
+
+def _skim_file_job(infile, outfile, engine, use_index):
+    """Worker: skim_file, plus the bytes this worker read from ROOT files."""
+    start = bytes_read()
+    nentries, nkept = skim_file(infile, outfile, engine, use_index)
+    return nentries, nkept, bytes_read() - start
+
+
+def skim_files_parallel(infiles, partial_dir, njobs, engine='loop',
+                        use_index=True, phase=None):
+    """Skim each input file into its own partial file on a process pool.
+
+    The bytes read by the workers are added to phase if given. Returns the
+    list of partial file names and the list of (processed, kept) event counts
+    of each file, both in input order.
+    """
+    os.makedirs(partial_dir, exist_ok=True)
+    partials = [partial_path(f, partial_dir) for f in infiles]
+    # Fork so workers inherit the already initialised ROOT interpreter
+    ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=njobs, mp_context=ctx) as pool:
+        results = list(pool.map(_skim_file_job, infiles, partials,
+                                [engine] * len(infiles),
+                                [use_index] * len(infiles)))
+    if phase is not None: phase.add_bytes(sum(b for _, _, b in results))
+    return partials, [(n, k) for n, k, _ in results]
+
+
+def merge_partials(partials, outfile):
+    """Merge partial reduced files into outfile, in the order given.
+
+    Returns the number of entries in the merged tree.
+    """
+    missing = [p for p in partials if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f'Missing partial files: {missing}')
+
+    merger = ROOT.TFileMerger(False)  # not local: do not copy inputs to /tmp
+    merger.OutputFile(outfile, 'RECREATE')
+    for p in partials:
+        merger.AddFile(p)
+    if not merger.Merge():
+        raise RuntimeError(f'Failed to merge partial files into {outfile}')
+
+    tfile = ROOT.TFile.Open(outfile, 'READ')
+    nkept = tfile.Get('tree').GetEntries()
+    tfile.Close()
+    return nkept
+
+
+def append_partials(partials, outfile):
+    """Append the events of partial reduced files to an existing outfile, in
+    the order given.
+
+    Returns the number of entries in the updated tree.
+    """
+    merger = ROOT.TFileMerger(False)
+    merger.OutputFile(outfile, 'UPDATE')
+    for p in partials:
+        merger.AddFile(p)
+    # Incremental merge: existing objects in outfile are merged with the inputs
+    mode = ROOT.TFileMerger.kAll | ROOT.TFileMerger.kIncremental
+    if not merger.PartialMerge(mode):
+        raise RuntimeError(f'Failed to append partial files to {outfile}')
+
+    tfile = ROOT.TFile.Open(outfile, 'READ')
+    nkept = tfile.Get('tree').GetEntries()
+    tfile.Close()
+    return nkept
+
+
+def skim_incremental(infiles, outfile, partial_dir, njobs=1, engine='loop',
+                     use_index=True, phase=None):
+    """Bring outfile up to date with infiles using its manifest.
+
+    Only inputs that are not in the manifest, have changed since, or were
+    skimmed with another engine are skimmed into partial files. If inputs were
+    only added, their events are appended to outfile; otherwise outfile is
+    re-merged from the partials of all inputs in manifest order. Inputs no
+    longer listed are dropped. The manifest records the engine and the
+    processed and kept events of each input.
+
+    The bytes read by the workers are added to phase if given. Returns
+    (number of processed events, number of events in outfile).
+    """
+    manifest = load_manifest(outfile)
+    records = {r['path']: r for r in manifest['inputs']}
+    paths = [os.path.abspath(f) for f in infiles]
+
+    todo = [p for p in paths if p not in records
+            or not is_current(records[p], p, engine=engine)]
+    changed = [p for p in todo if p in records]
+    removed = [p for p in records if p not in paths]
+    # A full merge needs every partial, re-skim any that were cleaned up.
+    # Without a manifest the content of an existing outfile is unknown.
+    rebuild = (bool(changed or removed) or not records
+               or not os.path.exists(outfile))
+    if rebuild:
+        todo += [p for p in paths if p not in todo
+                 and not os.path.exists(records[p]['partial'])]
+
+    print(f'Incremental: {len(todo)} of {len(paths)} inputs to skim '
+          f'({len(changed)} changed, {len(removed)} removed)')
+    if not todo and not rebuild:
+        tfile = ROOT.TFile.Open(outfile, 'READ')
+        nkept = tfile.Get('tree').GetEntries()
+        tfile.Close()
+        return 0, nkept
+
+    # Skim new and changed inputs, keep the order of infiles
+    todo = [p for p in paths if p in todo]
+    nentries = 0
+    if todo:
+        partials, counts = skim_files_parallel(
+            todo, partial_dir, njobs, engine, use_index, phase)
+        for p, partial, (nin, nout) in zip(todo, partials, counts):
+            records[p] = file_record(p, partial=partial, engine=engine,
+                                     events_in=nin, events_kept=nout)
+            nentries += nin
+
+    # Existing inputs keep their place in the output, new ones go at the end
+    order = [r['path'] for r in manifest['inputs'] if r['path'] in paths]
+    order += [p for p in paths if p not in order]
+    if rebuild:
+        nkept = merge_partials([records[p]['partial'] for p in order], outfile)
+    else:
+        nkept = append_partials([records[p]['partial'] for p in todo], outfile)
+
+    manifest['inputs'] = [records[p] for p in order]
+    save_manifest(outfile, manifest)
+    return nentries, nkept
+
+
+#===============================================================================
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments (sys.argv[1:] by default)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-e', '--engine',
+        choices=['loop', 'rdf', 'twophase'],
+        default='loop',
+        help='Skim engine (default: loop)'
+    )
+    parser.add_argument(
+        '-p', '--jobs',
+        type=int,
+        default=0,
+        help='Skim each input file in its own process, N at a time, then '
+             'merge (default: 0, single chain)'
+    )
+    parser.add_argument(
+        '-i', '--inputs',
+        nargs='+',
+        help='Input ntuple files (default: MinBias magdown/magup files)'
+    )
+    parser.add_argument(
+        '-d', '--input-dirs',
+        nargs='+',
+        help='Use all .root files in these directories as inputs'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only skim inputs that are new or changed since the last run, '
+             'according to the output manifest'
+    )
+    parser.add_argument(
+        '--partial-dir',
+        default='red/partials',
+        help='Directory for per-file partial outputs (default: red/partials)'
+    )
+    parser.add_argument(
+        '--no-merge',
+        action='store_true',
+        help='With --jobs, only write the partial files'
+    )
+    parser.add_argument(
+        '--merge-only',
+        action='store_true',
+        help='Only merge existing partial files of the inputs into the output'
+    )
+    parser.add_argument(
+        '--no-index',
+        action='store_true',
+        help='twophase engine: ignore and do not write occupancy index '
+             'sidecars'
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        type=int,
+        default=DEFAULT_EVERY,
+        help='loop and twophase engines: save a checkpoint every N input '
+             f'entries, 0 for none (default: {DEFAULT_EVERY})'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue from the last checkpoint of the output, if any'
+    )
+    parser.add_argument(
+        '-o', '--outfile',
+        default='red/reduced.root',
+        help='Output ROOT file (default: red/reduced.root)'
+    )
+    args = parser.parse_args(argv)
+    if args.resume and (args.engine == 'rdf' or args.jobs > 0
+                        or args.incremental or args.merge_only):
+        parser.error('--resume needs the loop or twophase engine on a single '
+                     'chain (rerun --jobs/--incremental to redo missing '
+                     'partial files)')
+    return args
+
+
+def main(argv=None):
+    """Skim the input ntuples into the reduced output file."""
+    args = parse_args(argv)
+
+    pre = '/data/home/michael24peters/anaroot/ntuple/MC_2018_MinBias_100M/'
+    infiles = args.inputs or [
+        pre + 'magdown/00334331_00000001_1.etamumugamma.root',
+        pre + 'magdown/00334331_00000002_1.etamumugamma.root',
+        pre + 'magup/00334330_00000001_1.etamumugamma.root',
+        pre + 'magup/00334330_00000002_1.etamumugamma.root'
+    ]
+    if args.input_dirs:
+        infiles = [f for d in args.input_dirs
+                   for f in sorted(glob.glob(os.path.join(d, '*.root')))]
+    outfile = args.outfile
+
+    # Ensure output directory exists
+    os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+
+    print(f'Reading from {len(infiles)} files:')
+    for f in infiles:
+        print(f'  - {f}')
+    print(f'Writing to: {outfile} (engine: {args.engine})')
+
+    # Timing, throughput and memory per phase, saved next to the output
+    monitor = Monitor('red_root')
+    if args.merge_only:
+        partials = [partial_path(f, args.partial_dir) for f in infiles]
+        with monitor.phase('merge') as phase:
+            nkept = merge_partials(partials, outfile)
+            phase.update(nkept, nkept)
+        monitor.write(summary_path(outfile), engine='merge', inputs=infiles)
+        print(f'Done: merged {len(partials)} partial files into {outfile} '
+              f'({nkept} events).')
+        return
+
+    if args.incremental:
+        with monitor.phase('incremental') as phase:
+            nentries, nkept = skim_incremental(
+                infiles, outfile, args.partial_dir, max(args.jobs, 1),
+                args.engine, not args.no_index, phase)
+            phase.update(nentries, nkept)
+    elif args.jobs > 0:
+        with monitor.phase('skim_files') as phase:
+            partials, counts = skim_files_parallel(
+                infiles, args.partial_dir, args.jobs, args.engine,
+                not args.no_index, phase)
+            nentries = sum(n for n, _ in counts)
+            nkept = sum(k for _, k in counts)
+            phase.update(nentries, nkept)
+        print(f'Wrote {len(partials)} partial files to {args.partial_dir}')
+        if args.no_merge:
+            print('Skipping merge (--no-merge).')
+        else:
+            with monitor.phase('merge') as phase:
+                nkept = merge_partials(partials, outfile)
+                phase.update(nkept, nkept)
+    else:
+        # Create TChain from all input files
+        chain = ROOT.TChain('tree')
+        for file in infiles:
+            chain.Add(file)
+
+        checkpoint = None
+        if args.engine != 'rdf':
+            checkpoint = Checkpoint(outfile, 'red_root', infiles,
+                                    {'engine': args.engine},
+                                    args.checkpoint_every, args.resume)
+        nkept = run_engine(chain, outfile, args.engine, not args.no_index,
+                           monitor, checkpoint)
+        nentries = chain.GetEntries()
+
+    summary = monitor.summary()
+    print(f'Processed {nentries} events, kept {nkept}...')
+    print(f'Engine {args.engine}: {summary["wall_s"]:.1f} s, '
+          f'{nentries / max(summary["wall_s"], 1e-9):,.0f} events/sec')
+    monitor.write(summary_path(outfile), engine=args.engine, inputs=infiles)
+    if args.jobs > 0 and args.no_merge and not args.incremental:
+        print(f'Done: wrote partial files to {args.partial_dir}.')
+    else:
+        print(f'Done: wrote tree to {outfile}.')
+
 
-pre = '/data/home/michael24peters/anaroot/ntuple/MC_2018_MinBias_100M/'
-infiles = [
-    pre + 'magdown/00334331_00000001_1.etamumugamma.root',
-    pre + 'magdown/00334331_00000002_1.etamumugamma.root',
-    pre + 'magup/00334330_00000001_1.etamumugamma.root',
-    pre + 'magup/00334330_00000002_1.etamumugamma.root'
-]
-outfile = 'red/reduced.root'
-
-# Ensure output directory exists
-os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
-
-print(f'Reading from {len(infiles)} files:')
-for f in infiles:
-    print(f'  - {f}')
-print(f'Writing to: {outfile}')
-
-# Create TChain from all input files
-chain = ROOT.TChain('tree')
-for file in infiles:
-    chain.Add(file)
-
-# Create reduced TFile and TTree
-tfile = ROOT.TFile.Open(outfile, "RECREATE")
-tree = chain.CloneTree(0)  # structure of original tree only
-
-# Loop variables
-check_interval = 1000000  # print status every n events
-branch_names = ['tag_pid', 'prt_pid', 'mc_pid']  # empty event indicators
-
-# Loop over all entries in chain and fill only non-empty events
-for entryIdx in range(0, chain.GetEntries()):
-    # Print status
-    if entryIdx % check_interval == 0 and entryIdx > 0:
-        print(f'  - Processed {entryIdx:,d} events, kept {tree.GetEntries()}...')
-
-    chain.GetEntry(entryIdx)
-
-    # Check if event is empty by looking at all branches
-    is_empty = True
-    for branch_name in branch_names:
-        branch = getattr(chain, branch_name)
-        if len(branch) > 0:
-            is_empty = False
-            break
-    if is_empty: continue
-
-    # print("Event passed selection. Filling event...")  # debug
-
-    # Fill all branches for this entry
-    tree.Fill()
-
-# Write to TFile
-tree.Write()
-tfile.Close()
-
-print(f'Processed {chain.GetEntries()} events, kept {tree.GetEntries()}...')
-print(f'Done: wrote tree to {outfile}.')
+if __name__ == '__main__':
+    main()
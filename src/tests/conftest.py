@@ -0,0 +1,12 @@
+################################################################################
+# Shared fixtures of the tests.                                                #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Tests run from the repository root with python -m pytest src/tests. The
+scripts import their helpers as utils.*, so src/ is put on the path. Tests
+that need ROOT are skipped where it is not installed.'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
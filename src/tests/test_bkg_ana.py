@@ -0,0 +1,116 @@
+################################################################################
+# Tests of the background analysis counters of bkg_ana.py.                     #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import io
+from collections import Counter
+import numpy as np
+
+from utils.columnar import Chunk
+from utils.synthetic import generate_chunk, BRANCHES
+from utils.truth_match import truth_match, PID_MISMATCH
+from bkg_ana import BkgCounts, CandidateTable, VerboseWriter, ErrorType
+from bkg_ana import ERROR_TYPES
+
+#===============================================================================
+
+
+def _chunks(nchunks=4, nevents=3000):
+    """Consecutive synthetic chunks with plenty of candidates."""
+    rng = np.random.default_rng(4)
+    return [generate_chunk(rng, nevents, sparsity=0.2, signal_fraction=0.5,
+                           start=k * nevents) for k in range(nchunks)]
+
+
+def _concat(chunks):
+    """Join consecutive Chunks into one."""
+    chunk = Chunk(chunks[0].start, chunks[-1].stop)
+    for name in BRANCHES:
+        chunk.values[name] = np.concatenate([c.values[name] for c in chunks])
+        shift = np.cumsum([0] + [len(c.values[name]) for c in chunks[:-1]])
+        chunk.offsets[name] = np.concatenate(
+            [[0]] + [c.offsets[name][1:] + s for c, s in zip(chunks, shift)])
+    return chunk
+
+
+def _state(counts):
+    """All counters of a BkgCounts, with the Counters in ranking order."""
+    return (counts.ncan, counts.nsig, counts.nbkg,
+            counts.mup_mismatches.most_common(),
+            counts.mum_mismatches.most_common(),
+            counts.pho_mismatches.most_common(),
+            counts.other_mismatches.most_common(),
+            counts.error_counts(), counts.mu_AND_dimu_err_count)
+
+
+#===============================================================================
+
+
+def test_counts_match_candidate_loop():
+    """Totals and mismatch pids against a loop over candidates and
+    daughters."""
+    chunk = _concat(_chunks())
+    counts = BkgCounts()
+    counts.add_chunk(chunk)
+
+    match = truth_match(chunk)
+    nsig, nbkg = 0, 0
+    mismatches = {-13: Counter(), 13: Counter(), 22: Counter(), 0: Counter()}
+    for i in range(len(match)):
+        if match.tag_pid[i] != 221: continue
+        if match.is_signal[i]: nsig += 1
+        else: nbkg += 1
+        for j in range(3):
+            if match.code[i, j] != PID_MISMATCH: continue
+            pid = int(match.prt_pid[i, j])
+            key = pid if pid in mismatches else 0
+            mismatches[key][int(match.mc_pid[i, j])] += 1
+
+    assert counts.ncan == len(match)
+    assert (counts.nsig, counts.nbkg) == (nsig, nbkg)
+    assert nsig > 0 and nbkg > 0
+    assert counts.mup_mismatches == mismatches[-13]
+    assert counts.mum_mismatches == mismatches[13]
+    assert counts.pho_mismatches == mismatches[22]
+    assert counts.other_mismatches == mismatches[0]
+
+
+def test_chunked_and_merged_counts_match_single_pass():
+    chunks = _chunks()
+    single = BkgCounts()
+    single.add_chunk(_concat(chunks))
+
+    chunked = BkgCounts()
+    for chunk in chunks:
+        chunked.add_chunk(chunk)
+    assert _state(chunked) == _state(single)
+
+    merged = BkgCounts()
+    for chunk in chunks:
+        shard = BkgCounts()
+        shard.add_chunk(chunk)
+        merged.merge(shard)
+    assert _state(merged) == _state(single)
+
+
+def test_verbose_daughter_without_mc():
+    candidates = CandidateTable()
+    error = ERROR_TYPES.index(ErrorType.MUM_ERROR)
+    candidates.append(evt=[7], can_idx=[0], ndtr=[3],
+                      has_dimu_mismatch=[False], has_dimu_err=[False],
+                      prt_pid=[[-13, 13, 22]], prt_idx_gen=[[1, -1, 3]],
+                      has_mc=[[True, False, True]], mc_pid=[[-13, 0, 22]],
+                      mc_idx_mom=[[0, 0, 0]], err_code=[[-1, error, -1]])
+    writer = VerboseWriter('text')
+    writer.write(candidates)
+    report = io.StringIO()
+    writer.finish(report)
+    lines = report.getvalue().splitlines()
+    assert lines[-3:] == [
+        '- Daughter PID -13, Gen idx  1, MC PID   -13, MC mom idx  0, '
+        'Error type: None',
+        '- Daughter PID  13, Gen idx -1, MC PID     -, MC mom idx  -, '
+        'Error type: ErrorType.MUM_ERROR',
+        '- Daughter PID  22, Gen idx  3, MC PID    22, MC mom idx  0, '
+        'Error type: None']
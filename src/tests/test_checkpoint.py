@@ -0,0 +1,112 @@
+################################################################################
+# Tests of resuming the skim and fiducial selection from a checkpoint.         #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Each test crashes a run in a forked process right after one of its
+checkpoints, resumes it (crashing again once), completes it, and compares
+the output with that of an uninterrupted run.'''
+
+import os
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from trees import write_ntuples, make_chain, assert_same_tree
+from utils.checkpoint import Checkpoint
+from utils.calculate_efficiency import EfficiencyCounts
+import red_root
+import fid_reqs
+
+EVERY = 1500  # input entries between checkpoints
+CRASHED = 3  # exit code of a process killed after a checkpoint
+
+#===============================================================================
+
+
+class CrashingCheckpoint(Checkpoint):
+    """Checkpoint that kills the process right after its second save."""
+
+    def save(self, entry, **state):
+        super().save(entry, **state)
+        self.nsaved = getattr(self, 'nsaved', 0) + 1
+        if self.nsaved == 2: os._exit(CRASHED)
+
+
+def crash(func):
+    """Run func in a forked process. Returns its exit code."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def interrupted_run(run):
+    """Run run(checkpoint_class, resume) twice crashing, then to the end.
+    Returns the result of the last run."""
+    assert crash(lambda: run(CrashingCheckpoint, False)) == CRASHED
+    assert crash(lambda: run(CrashingCheckpoint, True)) == CRASHED
+    return run(Checkpoint, True)
+
+
+#===============================================================================
+
+
+@pytest.mark.parametrize('engine', ['loop', 'twophase'])
+def test_skim_resume(tmp_path, engine):
+    infiles = write_ntuples(tmp_path)
+    expected = str(tmp_path / 'expected.root')
+    nkept = red_root.run_engine(make_chain(infiles), expected, engine,
+                                use_index=False)
+
+    outfile = str(tmp_path / 'reduced.root')
+
+    def skim(checkpoint_class, resume):
+        checkpoint = checkpoint_class(outfile, 'red_root', infiles,
+                                      {'engine': engine}, EVERY, resume)
+        return red_root.run_engine(make_chain(infiles), outfile, engine,
+                                   use_index=False, checkpoint=checkpoint)
+
+    assert interrupted_run(skim) == nkept
+    assert_same_tree(outfile, expected)
+    assert not os.path.exists(str(tmp_path / 'reduced.checkpoint'))
+
+
+@pytest.mark.parametrize('engine', ['loop', 'columnar'])
+def test_fiducial_resume(tmp_path, engine):
+    infile = write_ntuples(tmp_path, nfiles=1, nevents=10000)[0]
+
+    def select(outfile, checkpoint=None):
+        tfile = ROOT.TFile.Open(infile, 'READ')
+        tree = tfile.Get('tree')
+        new_tfile = ROOT.TFile.Open(outfile, 'RECREATE')
+        new_tfile.cd()
+        counts = EfficiencyCounts()
+        if engine == 'columnar':
+            new_tree = fid_reqs.apply_fiducial_reqs_columnar(
+                tree, counts, chunk_size=1000, checkpoint=checkpoint)
+        else:
+            new_tree = fid_reqs.apply_fiducial_reqs(tree, counts,
+                                                    checkpoint=checkpoint)
+        new_tree.Write()
+        new_tfile.Close()
+        tfile.Close()
+        return counts
+
+    expected = str(tmp_path / 'expected.root')
+    expected_counts = select(expected)
+
+    outfile = str(tmp_path / 'fiducial.root')
+
+    def resume(checkpoint_class, resume):
+        checkpoint = checkpoint_class(outfile, 'fid_reqs', [infile],
+                                      {'engine': engine}, EVERY, resume)
+        counts = select(outfile, checkpoint)
+        checkpoint.clear()
+        return counts
+
+    assert interrupted_run(resume) == expected_counts
+    assert_same_tree(outfile, expected)
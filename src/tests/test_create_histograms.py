@@ -0,0 +1,73 @@
+################################################################################
+# Tests of the bulk histogram filling of utils/create_histograms.py.           #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import numpy as np
+import pytest
+
+from utils.create_histograms import BinAccumulator
+
+#===============================================================================
+
+
+def _bins(values, binwidth):
+    """Bin edges fill_histograms chooses for values."""
+    xmin = round(float(values.min()) - binwidth)
+    xmax = round(float(values.max()) + 2*binwidth)
+    nbins = int((xmax - xmin) / binwidth)
+    return -0.5 + xmin + np.arange(nbins + 1) * binwidth
+
+
+def _values(rng, n):
+    """Random values, with some exactly on or next to half-integer edges."""
+    values = rng.normal(0, 3000, n)
+    edges = np.round(values[:n // 10]) - 0.5
+    return np.concatenate([values, edges, np.nextafter(edges, -np.inf),
+                           np.round(values[:n // 10])])
+
+
+@pytest.mark.parametrize('binwidth', [1, 10, 2000])
+def test_contents_match_values(binwidth):
+    values = _values(np.random.default_rng(2), 100000)
+    bins = _bins(values, binwidth)
+    expected = np.bincount(np.searchsorted(bins, values, side='right'),
+                           minlength=len(bins) + 1)
+    acc = BinAccumulator().fill(values)
+    assert np.array_equal(acc.contents(bins), expected)
+    assert acc.entries == len(values)
+    assert (acc.min, acc.max) == (values.min(), values.max())
+
+
+def test_merge_matches_single_fill():
+    values = _values(np.random.default_rng(3), 50000)
+    single = BinAccumulator().fill(values)
+    merged = BinAccumulator()
+    for part in np.array_split(values, 7):
+        merged.merge(BinAccumulator().fill(part))
+    merged.merge(BinAccumulator())
+    assert np.array_equal(merged.cells, single.cells)
+    assert np.array_equal(merged.counts, single.counts)
+    assert merged.entries == single.entries
+    assert merged.sumx == pytest.approx(single.sumx)
+    assert merged.sumx2 == pytest.approx(single.sumx2)
+
+
+def test_sums_do_not_depend_on_grouping():
+    chunks = np.array_split(_values(np.random.default_rng(5), 50000), 12)
+    serial = BinAccumulator()
+    for chunk in chunks:
+        serial.fill(chunk)
+    for groups in ([3, 7], [1, 2, 11], [6]):
+        merged = BinAccumulator()
+        for shard in np.split(np.arange(len(chunks)), groups):
+            acc = BinAccumulator()
+            for k in shard:
+                acc.fill(chunks[k])
+            merged.merge(acc)
+        assert (merged.sumx, merged.sumx2) == (serial.sumx, serial.sumx2)
+
+
+def test_non_finite_values_raise():
+    with pytest.raises(ValueError):
+        BinAccumulator().fill([1.0, np.nan])
@@ -0,0 +1,54 @@
+################################################################################
+# Tests of the occupancy index sidecars of utils/event_index.py.               #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import os
+import json
+
+from utils.event_index import index_path, write_index, load_index
+
+BRANCHES = ['tag_pid', 'prt_pid', 'mc_pid']
+
+#===============================================================================
+
+
+def _indexed_input(tmp_path):
+    infile = str(tmp_path / 'ntuple.root')
+    with open(infile, 'wb') as f:
+        f.write(b'events')
+    write_index(infile, [1, 4], 6, BRANCHES)
+    return infile
+
+
+def test_round_trip(tmp_path):
+    infile = _indexed_input(tmp_path)
+    index = load_index(infile, BRANCHES)
+    assert (index['entries'], index['nentries']) == ([1, 4], 6)
+    assert sorted(os.listdir(tmp_path)) == ['ntuple.root',
+                                            'ntuple.root.occupancy.json']
+
+
+def test_incomplete_index_is_ignored(tmp_path):
+    infile = _indexed_input(tmp_path)
+    path = index_path(infile)
+    with open(path) as f:
+        index = json.load(f)
+    del index['sha256']
+    with open(path, 'w') as f:
+        json.dump(index, f)
+    assert load_index(infile, BRANCHES) is None
+    with open(path, 'w') as f:
+        f.write('{"version": 1, "tree": "tr')
+    assert load_index(infile, BRANCHES) is None
+
+
+def test_touched_input_refreshes_mtime(tmp_path):
+    infile = _indexed_input(tmp_path)
+    stat = os.stat(infile)
+    os.utime(infile, (stat.st_atime, stat.st_mtime + 10))
+    assert load_index(infile, BRANCHES)['entries'] == [1, 4]
+    with open(index_path(infile)) as f:
+        assert json.load(f)['mtime'] == os.stat(infile).st_mtime
+    assert sorted(os.listdir(tmp_path)) == ['ntuple.root',
+                                            'ntuple.root.occupancy.json']
@@ -0,0 +1,68 @@
+################################################################################
+# Tests of the fiducial requirements of fid_reqs.py.                           #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import numpy as np
+import pytest
+
+pytest.importorskip('ROOT')
+
+from utils.columnar import Chunk
+from utils.synthetic import generate_chunk
+from fid_reqs import fiducial_mask, _passes_event
+
+DECAY = [221, -13, 13, 22]
+
+#===============================================================================
+
+
+def _chunk(events):
+    """Build a Chunk of mc branches from a list of events, each a list of
+    (pid, px, py, pz) particles."""
+    chunk = Chunk(0, len(events))
+    counts = [len(particles) for particles in events]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    columns = np.array([p for particles in events for p in particles],
+                       dtype=np.float64).reshape(-1, 4)
+    for k, name in enumerate(['mc_pid', 'mc_px', 'mc_py', 'mc_pz']):
+        chunk.values[name] = columns[:, k].copy()
+        chunk.offsets[name] = offsets
+    return chunk
+
+
+def assert_same_decisions(chunk):
+    mask = fiducial_mask(chunk)
+    expected = [_passes_event(event) for event in chunk.events()]
+    assert mask.tolist() == expected
+
+
+#===============================================================================
+
+
+def test_synthetic_events():
+    rng = np.random.default_rng(1)
+    chunk = generate_chunk(rng, 20000, sparsity=0.3, signal_fraction=0.5)
+    assert_same_decisions(chunk)
+
+
+def test_edge_cases():
+    good = [(pid, 300.0, 600.0, 20000.0) for pid in DECAY]
+    soft = [(pid, 10.0, 10.0, 20000.0) for pid in DECAY]
+    along_z = [(pid, 0.0, 0.0, 20000.0) for pid in DECAY]
+    at_rest = [(pid, 0.0, 0.0, 0.0) for pid in DECAY]
+    other = [(211, 300.0, 600.0, 20000.0)] * 4
+    events = [
+        [],  # empty event passes
+        good,
+        soft,
+        along_z,  # cosTheta^2 == 1
+        at_rest,  # p == 0
+        other,  # no decay group
+        good[:3],  # incomplete group
+        good + soft,  # last decay group decides
+        soft + good,
+        good + other + good[:2],  # trailing partial group is ignored
+        other[:1] + good,  # groups are aligned to multiples of four
+    ]
+    assert_same_decisions(_chunk(events))
@@ -0,0 +1,43 @@
+################################################################################
+# Tests of the histogram stages of utils/hist_engine.py.                       #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import numpy as np
+import pytest
+
+from utils.columnar import Chunk
+from utils.hist_engine import Stage, GenStage
+
+#===============================================================================
+
+
+def _gen_chunk(e):
+    """Chunk of one event with an eta of momentum (3, 4, 0) per energy."""
+    n = len(e)
+    chunk = Chunk(0, 1)
+    values = {'mc_pid': np.full(n, 221.0), 'mc_px': np.full(n, 3.0),
+              'mc_py': np.full(n, 4.0), 'mc_pz': np.zeros(n),
+              'mc_e': np.asarray(e, dtype=float)}
+    for name, value in values.items():
+        chunk.values[name] = value
+        chunk.offsets[name] = np.array([0, n])
+    return chunk
+
+
+def test_stage_requires_fill():
+    with pytest.raises(TypeError):
+        Stage()
+
+
+def test_gen_mass():
+    stage = GenStage()
+    stage.fill(_gen_chunk([13.0, 5.0]))
+    acc = stage.hists['mc_m']
+    assert (acc.entries, acc.min, acc.max) == (2, 0.0, 12.0)
+
+
+def test_gen_negative_mass_squared_raises():
+    stage = GenStage()
+    with pytest.raises(ValueError, match='negative mass squared'):
+        stage.fill(_gen_chunk([13.0, 4.0]))
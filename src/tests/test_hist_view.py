@@ -0,0 +1,35 @@
+################################################################################
+# Tests of the NumPy histogram views of utils/hist_view.py.                    #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from utils.hist_view import max_with_error
+
+#===============================================================================
+
+
+def _max_with_error_loop(hist, err=False, margin=1):
+    """Reference: the per-bin loop plot_mass.py used before."""
+    max_val = -float('inf')
+    for i in range(1, hist.GetNbinsX()+1):
+        val = hist.GetBinContent(i)
+        bin_err = hist.GetBinError(i) if err else 0
+        if val + bin_err > max_val:
+            max_val = val + bin_err
+    return max_val + margin
+
+
+@pytest.mark.parametrize('values', [[], [0.5], [0.5, 2.5, 2.6, 7.5, -3]])
+@pytest.mark.parametrize('err', [False, True])
+def test_max_matches_loop(values, err):
+    hist = ROOT.TH1D(f'h_{len(values)}_{err}', '', 10, 0, 10)
+    hist.Sumw2()
+    for value in values:
+        hist.Fill(value)
+    for margin in (0, 1):
+        assert max_with_error(hist, err, margin) == \
+            _max_with_error_loop(hist, err, margin)
@@ -0,0 +1,23 @@
+################################################################################
+# Tests of the stage measurements of utils/instrument.py.                      #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import io
+import sys
+
+from utils.instrument import Monitor
+
+#===============================================================================
+
+
+def test_phase_without_root(monkeypatch):
+    # A NumPy-only phase records no bytes and does not import ROOT
+    monkeypatch.delitem(sys.modules, 'ROOT', raising=False)
+    monitor = Monitor('numpy', stream=io.StringIO())
+    with monitor.phase('fill', total=10) as phase:
+        phase.update(10, 4)
+        phase.add_bytes(123)
+    assert 'ROOT' not in sys.modules
+    rec = monitor.phases[0]
+    assert (rec['events'], rec['kept'], rec['bytes_read']) == (10, 4, 123)
@@ -0,0 +1,56 @@
+################################################################################
+# Tests of the input records of utils/manifest.py.                             #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import os
+
+from utils.manifest import MANIFEST_VERSION, load_manifest, save_manifest
+from utils.manifest import file_record, is_current
+
+#===============================================================================
+
+
+def _input(tmp_path, content=b'events'):
+    path = tmp_path / 'ntuple.root'
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_record_is_current(tmp_path):
+    infile = _input(tmp_path)
+    record = file_record(infile, engine='loop', events_in=10, events_kept=3)
+    assert (record['events_in'], record['events_kept']) == (10, 3)
+    assert is_current(record, infile, engine='loop')
+
+
+def test_engine_change_invalidates(tmp_path):
+    infile = _input(tmp_path)
+    record = file_record(infile, engine='loop')
+    assert not is_current(record, infile, engine='twophase')
+    # Records written before the engine was stored are skimmed again
+    del record['engine']
+    assert not is_current(record, infile, engine='loop')
+
+
+def test_touched_input_checks_content(tmp_path):
+    infile = _input(tmp_path)
+    record = file_record(infile)
+    stat = os.stat(infile)
+    os.utime(infile, (stat.st_atime, stat.st_mtime + 10))
+    assert is_current(record, infile)
+    assert record['mtime'] == os.stat(infile).st_mtime
+    _input(tmp_path, b'EVENTS')
+    assert not is_current(record, infile)
+
+
+def test_save_and_load(tmp_path):
+    infile = _input(tmp_path)
+    outfile = str(tmp_path / 'reduced.root')
+    open(outfile, 'wb').close()
+    manifest = {'version': MANIFEST_VERSION,
+                'inputs': [file_record(infile, engine='loop')]}
+    save_manifest(outfile, manifest)
+    assert load_manifest(outfile) == manifest
+    assert sorted(os.listdir(tmp_path)) == [
+        'ntuple.root', 'reduced.manifest.json', 'reduced.root']
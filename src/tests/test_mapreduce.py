@@ -0,0 +1,49 @@
+################################################################################
+# Tests of the map-reduce event loop of utils/mapreduce.py.                    #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from utils.synthetic import write_ntuple
+from utils.hist_engine import STAGES, run_stages
+
+#===============================================================================
+
+
+def _read_hists(outfile):
+    """Return {name: (contents, stats)} of the histograms in outfile."""
+    tfile = ROOT.TFile.Open(outfile, 'READ')
+    hists = {}
+    for key in tfile.GetListOfKeys():
+        hist = key.ReadObj()
+        stats = np.zeros(4)
+        hist.GetStats(stats)
+        contents = np.array([hist.GetBinContent(i)
+                             for i in range(hist.GetNbinsX() + 2)])
+        hists[str(key.GetName())] = (contents, stats)
+    tfile.Close()
+    return hists
+
+
+def test_stages_match_serial(tmp_path):
+    # Three chunks of the default 100,000 entries, so three shards
+    infile = str(tmp_path / 'ntuple.root')
+    write_ntuple(infile, 300000, sparsity=0.9, seed=5)
+    outputs = {}
+    for njobs in (1, 3):
+        outfiles = {name: str(tmp_path / f'{name}_{njobs}.root')
+                    for name in STAGES}
+        run_stages(infile, outfiles, use_cache=False, use_columns=False,
+                   njobs=njobs)
+        outputs[njobs] = {name: _read_hists(outfile)
+                          for name, outfile in outfiles.items()}
+    for name in STAGES:
+        serial, sharded = outputs[1][name], outputs[3][name]
+        assert serial.keys() == sharded.keys()
+        for hist in serial:
+            assert serial[hist][0].tobytes() == sharded[hist][0].tobytes()
+            assert serial[hist][1].tobytes() == sharded[hist][1].tobytes()
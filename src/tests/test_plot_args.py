@@ -0,0 +1,28 @@
+################################################################################
+# Tests of the word options of the plot scripts.                               #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import pytest
+
+import plot_gen
+import plot_mass
+import plot_rec
+
+#===============================================================================
+
+
+@pytest.mark.parametrize('script', [plot_gen, plot_rec, plot_mass])
+def test_plotter_commands(script):
+    # The words plotter.py has always passed to every plot script
+    args = script.parse_args(['sig', 'stats', 'legend'])
+    assert args.sig and args.stats
+    args = script.parse_args([])
+    assert not args.sig and not args.stats
+
+
+@pytest.mark.parametrize('script', [plot_gen, plot_rec, plot_mass])
+def test_unknown_words_are_ignored(script, capsys):
+    args = script.parse_args(['stats', 'colour'])
+    assert args.stats and not args.sig
+    assert 'ignoring unknown options: colour' in capsys.readouterr().out
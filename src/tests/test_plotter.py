@@ -0,0 +1,34 @@
+################################################################################
+# Tests of the stage graph driver plotter.py.                                  #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import os
+
+import plotter
+
+#===============================================================================
+
+
+def test_main_dry_run(capsys):
+    plotter.main(['-m', 'minbias', 'sig', '-j', '2', '-n'])
+    out = capsys.readouterr().out
+    for mode in ('minbias', 'sig'):
+        for stage in plotter.pipeline(mode):
+            assert f'[{stage.name}] ' + ' '.join(plotter.PY + stage.args) \
+                in out
+    assert 'Failed stages' not in out
+
+
+def test_plot_stages_depend_on_render_code(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stages = [s for s in plotter.pipeline('minbias') if ':plot_' in s.name]
+    for stage in stages:
+        assert set(plotter.PLOT_CODE) <= set(stage.inputs)
+        for f in stage.inputs + stage.outputs:
+            (tmp_path / f).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / f).touch()
+            os.utime(tmp_path / f, (100, 100))
+    assert all(stage.up_to_date() for stage in stages)
+    os.utime(tmp_path / 'src/utils/render.py', (200, 200))
+    assert not any(stage.up_to_date() for stage in stages)
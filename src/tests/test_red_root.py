@@ -0,0 +1,63 @@
+################################################################################
+# Tests of the skim engines of red_root.py.                                    #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import os
+import pytest
+
+pytest.importorskip('ROOT')
+
+from trees import write_ntuples, make_chain, assert_same_tree
+import red_root
+
+#===============================================================================
+
+
+@pytest.mark.parametrize('engine', ['rdf', 'twophase'])
+def test_engine_matches_loop(tmp_path, engine):
+    chain = make_chain(write_ntuples(tmp_path))
+    expected = str(tmp_path / 'loop.root')
+    nkept = red_root.skim_loop(chain, expected)
+    outfile = str(tmp_path / f'{engine}.root')
+    assert red_root.run_engine(chain, outfile, engine, use_index=False) == nkept
+    assert_same_tree(outfile, expected)
+
+
+def test_rdf_restores_implicit_mt(tmp_path):
+    ROOT = pytest.importorskip('ROOT')
+    chain = make_chain(write_ntuples(tmp_path))
+    ROOT.EnableImplicitMT(2)
+    try:
+        red_root.skim_rdf(chain, str(tmp_path / 'rdf.root'))
+        assert ROOT.IsImplicitMTEnabled()
+        assert ROOT.GetThreadPoolSize() == 2
+    finally:
+        ROOT.DisableImplicitMT()
+
+def test_partial_names_are_unique(tmp_path):
+    infiles = ['/data/a/run1/ntuple.root', '/data/b/run1/ntuple.root',
+               '/data/a/run1/ntuple.root.v2.root']
+    names = [red_root.partial_path(f, str(tmp_path)) for f in infiles]
+    assert len(set(names)) == len(names)
+    assert names[0] == red_root.partial_path(infiles[0], str(tmp_path))
+    assert os.path.basename(names[0]).startswith('ntuple.')
+    assert os.path.basename(names[2]).startswith('ntuple.root.v2.')
+    assert all(n.endswith('.reduced.root') for n in names)
+
+
+@pytest.mark.parametrize('no_merge', [False, True])
+def test_main_jobs(tmp_path, capsys, no_merge):
+    infiles = write_ntuples(tmp_path)
+    expected = str(tmp_path / 'loop.root')
+    nkept = red_root.skim_loop(make_chain(infiles), expected)
+    outfile = str(tmp_path / 'jobs.root')
+    partial_dir = str(tmp_path / 'partials')
+    argv = ['--jobs', '2', '-i', *infiles, '-o', outfile,
+            '--partial-dir', partial_dir]
+    red_root.main(argv + ['--no-merge'] if no_merge else argv)
+    assert f'Processed 10000 events, kept {nkept}...' in capsys.readouterr().out
+    assert os.path.exists(outfile) != no_merge
+    if no_merge:
+        red_root.main(argv + ['--merge-only'])
+    assert_same_tree(outfile, expected)
@@ -0,0 +1,50 @@
+################################################################################
+# Helpers of the tests reading and comparing ROOT trees.                       #
+# Author: Michael Peters                                                       #
+################################################################################
+
+import numpy as np
+from utils.lazy_import import ROOT
+from utils.synthetic import write_ntuple, BRANCHES
+from utils.columnar import read_chunk
+
+#===============================================================================
+
+
+def write_ntuples(tmp_path, nfiles=2, nevents=5000):
+    """Write synthetic ntuples, with small baskets so that each spans
+    several clusters. Returns their paths."""
+    infiles = []
+    for k in range(nfiles):
+        infile = str(tmp_path / f'ntuple_{k}.root')
+        write_ntuple(infile, nevents, sparsity=0.7, seed=k, chunk_size=1000)
+        infiles.append(infile)
+    return infiles
+
+
+def make_chain(infiles):
+    """Return a TChain of the trees of infiles."""
+    chain = ROOT.TChain('tree')
+    for infile in infiles:
+        chain.Add(infile)
+    return chain
+
+
+def read_tree(outfile):
+    """Return the number of entries and a Chunk of all branches of outfile."""
+    tfile = ROOT.TFile.Open(outfile, 'READ')
+    tree = tfile.Get('tree')
+    nentries = int(tree.GetEntries())
+    chunk = read_chunk(tree, BRANCHES, 0, nentries)
+    tfile.Close()
+    return nentries, chunk
+
+
+def assert_same_tree(outfile, expected):
+    """Check that two files hold byte-for-byte the same entries."""
+    n, chunk = read_tree(outfile)
+    n_exp, chunk_exp = read_tree(expected)
+    assert n == n_exp
+    for name in BRANCHES:
+        assert chunk.values[name].tobytes() == chunk_exp.values[name].tobytes()
+        assert np.array_equal(chunk.offsets[name], chunk_exp.offsets[name])
@@ -0,0 +1,2 @@
+'''Shared helpers of the step scripts. None of them imports ROOT at import
+time.'''
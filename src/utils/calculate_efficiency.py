@@ -3,99 +3,203 @@
 # Author: Michael Peters                                                       #
 ################################################################################
 
-import ROOT
-
-def calc_ratio(tree):
-    """Calculate efficiency as ratio with fiducial requirements in place."""
-    nreco, ngen = 0, 0
-    # Loop through tree, count number of reconstructed candidates and number of
-    # generator level candidates.
-    for entryIdx in range(0, tree.GetEntries()):
-        tree.GetEntry(entryIdx)
-        
-        tag_pid = getattr(tree, 'tag_pid')
-        mc_pid = getattr(tree, 'mc_pid')
-
-        tag_pid = [int(pid) for pid in tag_pid]
-        mc_pid = [int(pid) for pid in mc_pid]
-        
-        # Loop over mc_pid and count candidates
-        nreco += 1 if len(tag_pid) > 0 else 0
-        # Each generator level candidate has 4 particles, and all the junk has
-        # already been thrown out, so we can just divide by 4.
-        ngen += len(mc_pid) // 4
+import numpy as np
+from dataclasses import dataclass
+from utils.columnar import iter_chunks
+from utils.truth_match import truth_match
+from utils.mapreduce import map_reduce
 
+# Branches needed by the chunk counting functions
+RATIO_BRANCHES = ['tag_pid', 'mc_pid']
+SIG_RATIO_BRANCHES = ['prt_pid', 'prt_idx_gen', 'mc_pid', 'mc_idx_mom']
+
+
+def count_reco_gen(tag_pid, mc_pid):
+    """Return the (nreco, ngen) contribution of a single event."""
+    # Count events with at least one reconstructed candidate
+    nreco = 1 if len(tag_pid) > 0 else 0
+    # Each generator level candidate has 4 particles, and all the junk has
+    # already been thrown out, so we can just divide by 4.
+    ngen = len(mc_pid) // 4
     return (nreco, ngen)
 
 
+def count_sig_matches(prt_pid, prt_idx_gen, mc_pid, mc_idx_mom):
+    """Return the number of reconstructed signal decays in a single event whose
+    daughters match to generator level signal daughters. All arguments are
+    lists of ints."""
+    nreco_matches = 0
+    # Loop through prt_pid and check if each prt_idx_gen points to a matching
+    # mc_pid which is part of a signal decay. If all 3 reconstructed daughters
+    # match to generator level daughters from the same signal decay, count
+    # this as a reconstructed signal decay matching to generator level.
+    for i in range(0, len(prt_pid), 3):
+        pids = prt_pid[i:i + 3]
+        if len(pids) < 3: continue
+        if pids[0] != -13 or pids[1] != 13 or pids[2] != 22: continue
+        # This is a reco signal candidate, check if all daughters match to
+        # generator level signal daughters.
+        passed = True
+        for j in range(1, 3):
+            gen_idx = prt_idx_gen[i + j]
+            if gen_idx < 0 or gen_idx >= len(mc_pid):
+                passed = False
+                break
+            mcp = mc_pid[gen_idx]
+            mcp_mom_idx = mc_idx_mom[gen_idx]
+            if mcp_mom_idx == -1:
+                passed = False
+                break
+            mc_mom_pid = mc_pid[mcp_mom_idx]
+            if not (mc_mom_pid == 221 and 
+                    ((pids[j] == -13 and mcp == -13) or
+                     (pids[j] == 13 and mcp == 13) or
+                     (pids[j] == 22 and mcp == 22))):
+                passed = False
+                break
+        if passed: nreco_matches += 1
+    return nreco_matches
+
+
+#===============================================================================
+
+
+def chunk_reco_gen(chunk, events=None):
+    """Return the (nreco, ngen) contribution of the events of a Chunk, or of
+    those selected by the boolean mask events. Same as count_reco_gen."""
+    if events is None: events = np.ones(len(chunk), dtype=bool)
+    nreco = np.count_nonzero(events & (chunk.counts('tag_pid') > 0))
+    ngen = np.sum((chunk.counts('mc_pid') // 4)[events])
+    return (int(nreco), int(ngen))
+
+
+def chunk_sig_matches(chunk, events=None):
+    """Return the number of reconstructed signal decays matching to generator
+    level in the events of a Chunk, or in those selected by the boolean mask
+    events. Same as count_sig_matches, using the truth-matching kernel on
+    every complete triplet of daughters."""
+    match = truth_match(chunk, per_tag=False)
+    pids = match.prt_pid
+    is_decay = (pids[:, 0] == -13) & (pids[:, 1] == 13) & (pids[:, 2] == 22)
+    # Daughters 1 and 2 must match in pid to an MC particle whose mother is
+    # an eta (index -1 means no mother, so mom_pid is 0 then)
+    dtr_ok = ((match.prt_idx_gen >= 0) & match.has_mc
+              & (match.mc_pid == pids) & (match.mom_pid == 221))
+    passed = is_decay & dtr_ok[:, 1] & dtr_ok[:, 2]
+    if events is not None: passed &= events[match.evt]
+    return int(np.count_nonzero(passed))
+
+
+#===============================================================================
+
+
+@dataclass
+class EfficiencyCounts:
+    """Counters behind calc_ratio and calc_sig_ratio, filled one event at a
+    time so they can be collected inside another event loop."""
+    nreco: int = 0
+    ngen: int = 0
+    nreco_matches: int = 0
+
+    def add_event(self, tag_pid, prt_pid, prt_idx_gen, mc_pid, mc_idx_mom):
+        """Add a single event. All arguments are lists of ints."""
+        nreco, ngen = count_reco_gen(tag_pid, mc_pid)
+        self.nreco += nreco
+        self.ngen += ngen
+        self.nreco_matches += count_sig_matches(prt_pid, prt_idx_gen, mc_pid,
+                                                mc_idx_mom)
+
+    def add_chunk(self, chunk, events=None):
+        """Add the events of a Chunk, or those selected by the boolean mask
+        events. The chunk needs RATIO_BRANCHES and SIG_RATIO_BRANCHES."""
+        nreco, ngen = chunk_reco_gen(chunk, events)
+        self.nreco += nreco
+        self.ngen += ngen
+        self.nreco_matches += chunk_sig_matches(chunk, events)
+
+    def merge(self, other):
+        """Add the counts of other. Returns self."""
+        self.nreco += other.nreco
+        self.ngen += other.ngen
+        self.nreco_matches += other.nreco_matches
+        return self
+
+    def ratio(self):
+        """Same as calc_ratio."""
+        return (self.nreco, self.ngen)
+
+    def sig_ratio(self):
+        """Same as calc_sig_ratio."""
+        return (self.nreco_matches, self.ngen)
+
+    def efficiency(self):
+        """Same as calc_efficiency."""
+        if self.ngen == 0: return 0.0
+        return self.nreco / self.ngen
+
+    def sig_efficiency(self):
+        """Same as calc_sig_efficiency."""
+        if self.ngen == 0: return 0.0
+        return self.nreco_matches / self.ngen
+
+
+#===============================================================================
+
+
+def count_ratio(tree, first=0, last=None, phase=None):
+    """Shard task of calc_ratio: EfficiencyCounts with nreco and ngen of
+    entries [first, last) of tree (see utils/mapreduce.py)."""
+    counts = EfficiencyCounts()
+    # Count number of reconstructed candidates and number of generator level
+    # candidates, a chunk of events at a time.
+    for chunk in iter_chunks(tree, RATIO_BRANCHES, first=first, last=last):
+        nreco_chunk, ngen_chunk = chunk_reco_gen(chunk)
+        counts.nreco += nreco_chunk
+        counts.ngen += ngen_chunk
+        if phase is not None: phase.update(chunk.stop - first)
+    return counts
+
+
+def calc_ratio(tree, njobs=1):
+    """Calculate efficiency as ratio with fiducial requirements in place,
+    on njobs processes."""
+    return map_reduce(tree, count_ratio, njobs).ratio()
+
+
 #===============================================================================
 
-def calc_efficiency(tree):
+def calc_efficiency(tree, njobs=1):
     """Calculate efficiency with fiducial requirements in place."""
-    nreco, ngen = calc_ratio(tree)
+    nreco, ngen = calc_ratio(tree, njobs)
     if ngen == 0: return 0.0
     return nreco / ngen
 
 #===============================================================================
 
 
-def calc_sig_ratio(tree):
-    """Calculate signal efficiency as ratio with fiducial requirements in place."""
-    nreco_matches, ngen = 0, 0
-    # Loop through tree, count number of reconstructed decays which match to
-    # generator level decays and count number of generator level decays.
-    for entryIdx in range(0, tree.GetEntries()):
-        tree.GetEntry(entryIdx)
-        
-        tag_pid = getattr(tree, 'tag_pid')
-        prt_pid = getattr(tree, 'prt_pid')
-        prt_idx_gen = getattr(tree, 'prt_idx_gen')
-        mc_pid = getattr(tree, 'mc_pid')
-        mc_idx_mom = getattr(tree, 'mc_idx_mom')
-
-        tag_pid = [int(pid) for pid in tag_pid]
-        prt_pid = [int(pid) for pid in prt_pid]
-        prt_idx_gen = [int(idx) for idx in prt_idx_gen]
-        mc_pid = [int(pid) for pid in mc_pid]
-        mc_idx_mom = [int(idx) for idx in mc_idx_mom]
-        
-        # Loop through prt_pid and check if each prt_idx_gen points to a matching
-        # mc_pid which is part of a signal decay. If all 3 reconstructed daughters
-        # match to generator level daughters from the same signal decay, count
-        # this as a reconstructed signal decay matching to generator level.
-        ngen += len(mc_pid) // 4
-        for i in range(0, len(prt_pid), 3):
-            pids = prt_pid[i:i + 3]
-            if len(pids) < 3: continue
-            if pids[0] != -13 or pids[1] != 13 or pids[2] != 22: continue
-            # This is a reco signal candidate, check if all daughters match to
-            # generator level signal daughters.
-            passed = True
-            for j in range(1, 3):
-                gen_idx = prt_idx_gen[i + j]
-                if gen_idx < 0 or gen_idx >= len(mc_pid):
-                    passed = False
-                    break
-                mcp = mc_pid[gen_idx]
-                mcp_mom_idx = mc_idx_mom[gen_idx]
-                if mcp_mom_idx == -1:
-                    passed = False
-                    break
-                mc_mom_pid = mc_pid[mcp_mom_idx]
-                if not (mc_mom_pid == 221 and 
-                        ((pids[j] == -13 and mcp == -13) or
-                         (pids[j] == 13 and mcp == 13) or
-                         (pids[j] == 22 and mcp == 22))):
-                    passed = False
-                    break
-            if passed: nreco_matches += 1
-
-    return (nreco_matches, ngen)
+def count_sig_ratio(tree, first=0, last=None, phase=None):
+    """Shard task of calc_sig_ratio: EfficiencyCounts with nreco_matches and
+    ngen of entries [first, last) of tree."""
+    counts = EfficiencyCounts()
+    # Count number of reconstructed decays which match to generator level
+    # decays and number of generator level decays, a chunk of events at a time.
+    for chunk in iter_chunks(tree, SIG_RATIO_BRANCHES, first=first,
+                             last=last):
+        counts.ngen += int(np.sum(chunk.counts('mc_pid') // 4))
+        counts.nreco_matches += chunk_sig_matches(chunk)
+        if phase is not None: phase.update(chunk.stop - first)
+    return counts
+
+
+def calc_sig_ratio(tree, njobs=1):
+    """Calculate signal efficiency as ratio with fiducial requirements in place,
+    on njobs processes."""
+    return map_reduce(tree, count_sig_ratio, njobs).sig_ratio()
 
 #===============================================================================
 
-def calc_sig_efficiency(tree):
+def calc_sig_efficiency(tree, njobs=1):
     """Calculate signal efficiency with fiducial requirements in place."""
-    nreco_matches, ngen = calc_sig_ratio(tree)
+    nreco_matches, ngen = calc_sig_ratio(tree, njobs)
     if ngen == 0: return 0.0
     return nreco_matches / ngen
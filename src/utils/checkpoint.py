@@ -0,0 +1,195 @@
+################################################################################
+# Methods to checkpoint long event loops and resume them after a crash.        #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A Checkpoint belongs to one output file and lives in a directory next to it
+(<output>.checkpoint/). Every `every` input entries the event loop saves its
+partial output and then calls save(entry, ...), which records in state.json
+the next input entry to process and whatever the loop needs to continue
+(counters, kept events). The state is written atomically after the partial
+output, so it never refers to output that is not on disk.
+
+With resume=True, a Checkpoint loads the saved state if it was written by the
+same stage, with the same options, for inputs whose size and mtime are
+unchanged; otherwise the loop starts from the beginning. The directory is
+removed once the output is complete.
+
+Skims that fill a tree keep their partial output as segments: the tree of the
+running output file is AutoSaved at each checkpoint, and on resume the output
+of the interrupted run becomes a segment holding the entries recorded in the
+state. When the loop ends, the segments and the new output are concatenated
+in order into the output file (open_output, save_output, close_output).
+'''
+
+import os
+import json
+import shutil
+from utils.lazy_import import ROOT
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_VERSION = 1
+DEFAULT_EVERY = 5000000  # input entries
+
+#===============================================================================
+
+
+def checkpoint_dir(outfile):
+    """Return the checkpoint directory of an output file."""
+    return os.path.splitext(outfile)[0] + CHECKPOINT_SUFFIX
+
+
+def input_record(infile):
+    """Return the path, size and mtime of an input file. Unlike a manifest
+    record there is no checksum, so starting a long loop stays cheap."""
+    stat = os.stat(infile)
+    return {'path': os.path.abspath(infile), 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+class Checkpoint:
+    """Saved progress of the event loop of stage writing outfile.
+
+    Args:
+        outfile (str): output file of the loop
+        stage (str): name of the loop, e.g. 'red_root'
+        inputs (list<str>): input files, in order
+        options (dict): options the output depends on (e.g. the engine)
+        every (int): input entries between checkpoints, 0 to never save
+        resume (bool): continue from the saved state if it is valid
+    """
+
+    def __init__(self, outfile, stage, inputs, options=None,
+                 every=DEFAULT_EVERY, resume=False):
+        self.outfile = outfile
+        self.dir = checkpoint_dir(outfile)
+        self.every = every
+        self.key = {'version': CHECKPOINT_VERSION, 'stage': stage,
+                    'inputs': [input_record(f) for f in inputs],
+                    'options': options or {}}
+        self.state = self._load() if resume else None
+        if resume and self.state is None:
+            print(f'No valid checkpoint of {outfile}, starting from the '
+                  f'first entry.')
+        elif self.state is not None:
+            print(f'Resuming {outfile} from entry {self.start:,d}.')
+        if self.state is None: self.clear()
+        self._next = self.start + every
+
+    def _load(self):
+        path = self.path('state.json')
+        if not os.path.exists(path): return None
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.pop('key', None) != self.key: return None
+        return state
+
+    @property
+    def start(self):
+        """First input entry still to process."""
+        return self.state['entry'] if self.state else 0
+
+    def get(self, name, default=None):
+        """Return a value of the saved state."""
+        return self.state.get(name, default) if self.state else default
+
+    def path(self, name):
+        """Return the path of a file in the checkpoint directory."""
+        return os.path.join(self.dir, name)
+
+    def due(self, entry):
+        """Whether a checkpoint should be saved before processing entry."""
+        return self.every > 0 and entry >= self._next
+
+    def save(self, entry, **state):
+        """Record that all entries before entry are done, with the state
+        needed to continue from there."""
+        os.makedirs(self.dir, exist_ok=True)
+        self.state = dict(state, entry=entry)
+        path = self.path('state.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(dict(self.state, key=self.key), f, indent=2)
+        os.replace(path + '.tmp', path)
+        self._next = entry + self.every
+
+    def clear(self):
+        """Remove the checkpoint directory."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+#===============================================================================
+
+
+def open_output(chain, outfile, checkpoint=None):
+    """Create outfile with an empty clone of chain.
+
+    When resuming, the output of the interrupted run is first moved into a
+    segment of the checkpoint. Returns (tfile, tree, number of events kept
+    before this run).
+    """
+    nkept = 0
+    if checkpoint is not None and checkpoint.state is not None:
+        segments = checkpoint.get('segments', [])
+        nout = checkpoint.get('output_entries', 0)
+        if nout > 0 and os.path.exists(outfile):
+            segment = checkpoint.path(f'segment_{len(segments):03d}.root')
+            os.replace(outfile, segment)
+            segments.append([segment, nout])
+        checkpoint.state['segments'] = segments
+        checkpoint.state['output_entries'] = 0
+        nkept = sum(n for _, n in segments)
+    tfile = ROOT.TFile.Open(outfile, 'RECREATE')
+    tree = chain.CloneTree(0)  # structure of original tree only
+    return tfile, tree, nkept
+
+
+def save_output(tree, checkpoint, entry, **state):
+    """AutoSave the output tree, then save the checkpoint at entry."""
+    tree.AutoSave('SaveSelf')
+    checkpoint.save(entry, segments=checkpoint.get('segments', []),
+                    output_entries=int(tree.GetEntries()), **state)
+
+
+def close_output(tfile, tree, outfile, checkpoint=None, entry=0):
+    """Write the output tree and close outfile, once all entries before entry
+    are done. After a resume, the segments and the output of this run are
+    concatenated into outfile. Removes the checkpoint. Returns the number of
+    entries in outfile."""
+    nkept = int(tree.GetEntries())
+    tree_name = str(tree.GetName())  # tree is deleted with its file
+    tree.Write()
+    tfile.Close()
+    segments = checkpoint.get('segments', []) if checkpoint else []
+    if segments:
+        if nkept > 0:
+            segment = checkpoint.path(f'segment_{len(segments):03d}.root')
+            os.replace(outfile, segment)
+            segments = segments + [[segment, nkept]]
+        # A crash while concatenating only has to redo the concatenation
+        checkpoint.save(entry, segments=segments, output_entries=0)
+        nkept = concat_segments(segments, outfile, tree_name)
+    if checkpoint is not None: checkpoint.clear()
+    return nkept
+
+
+def concat_segments(segments, outfile, tree_name='tree'):
+    """Copy the first n entries of the tree named tree_name in each (file, n)
+    segment, in order, into the tree of a new outfile. Returns the number of
+    entries written."""
+    tfile = ROOT.TFile.Open(outfile, 'RECREATE')
+    tree = None
+    for path, n in segments:
+        seg_tfile = ROOT.TFile.Open(path, 'READ')
+        seg_tree = seg_tfile.Get(tree_name)
+        tfile.cd()
+        if tree is None: tree = seg_tree.CloneTree(0)
+        # A crash between AutoSave and the state may leave extra entries
+        tree.CopyEntries(seg_tree, n)
+        seg_tfile.Close()
+    nkept = int(tree.GetEntries())
+    tfile.cd()
+    tree.Write()
+    tfile.Close()
+    return nkept
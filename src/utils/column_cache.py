@@ -0,0 +1,224 @@
+################################################################################
+# Methods to export a tree to a memory-mapped columnar cache and load it.      #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A column cache holds the jagged branches of one ntuple file as NumPy .npy
+files, in a directory next to it (<file>.columns/):
+
+- <branch>.values.npy: flat values of all entries (float64, as read by
+  utils/columnar.py),
+- <branch>.offsets.npy: nentries + 1 offsets, so that the values of entry i
+  are values[offsets[i]:offsets[i + 1]],
+- meta.json: the tree name, number of entries and branches, and the size,
+  mtime and sha256 of the source file.
+
+load_columns memory-maps the arrays read-only, so opening the cache costs
+almost nothing, chunks are zero-copy views, and processes reading the same
+cache share it through the page cache. Neither ROOT nor decompression is
+needed. Like the occupancy index (utils/event_index.py), a cache is only used
+while it still describes the source file: a different size invalidates it,
+and if only the mtime differs the checksum decides.
+
+A ColumnStore can be passed to iter_chunks and to everything built on it in
+place of a TTree. Use src/export_columns.py to write the caches.
+'''
+
+import os
+import json
+import shutil
+import numpy as np
+from utils.lazy_import import ROOT
+from utils.columnar import Chunk, iter_chunks
+from utils.event_index import file_checksum, write_json
+
+COLUMNS_SUFFIX = '.columns'
+COLUMNS_VERSION = 1
+COLUMNS_FIELDS = ['nentries', 'branches', 'size', 'mtime', 'sha256']
+
+#===============================================================================
+
+
+def columns_path(infile):
+    """Return the column cache directory of an ntuple file."""
+    return infile + COLUMNS_SUFFIX
+
+
+def _array_path(cache_dir, name, kind):
+    return os.path.join(cache_dir, f'{name}.{kind}.npy')
+
+
+def _to_npy(raw, path, dtype):
+    """Turn a raw binary file of dtype values into the .npy file path."""
+    n = os.path.getsize(raw) // np.dtype(dtype).itemsize
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n,))
+    if n > 0: out[:] = np.memmap(raw, dtype=dtype, mode='r', shape=(n,))
+    out.flush()
+    del out
+    os.remove(raw)
+
+
+def export_columns(infile, branches=None, tree_name='tree',
+                   chunk_size=100000):
+    """Write the column cache of infile.
+
+    Args:
+        infile (str): ROOT file with the tree
+        branches (list<str>): branches to export (default: all)
+        tree_name (str): name of the tree in infile
+        chunk_size (int): entries read at a time
+    Returns the cache directory.
+    """
+    tfile = ROOT.TFile.Open(infile, 'READ')
+    tree = tfile.Get(tree_name)
+    if branches is None:
+        branches = [str(b.GetName()) for b in tree.GetListOfBranches()]
+    nentries = tree.GetEntries()
+
+    # Build in a temporary directory, so a crash never leaves a bad cache
+    cache_dir = columns_path(infile)
+    tmp_dir = cache_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Stream the chunks to raw files, then add the .npy headers
+    raw = {(name, kind): _array_path(tmp_dir, name, kind) + '.raw'
+           for name in branches for kind in ('values', 'offsets')}
+    files = {key: open(path, 'wb') for key, path in raw.items()}
+    total = dict.fromkeys(branches, 0)
+    for name in branches:
+        np.zeros(1, dtype=np.int64).tofile(files[name, 'offsets'])
+    for chunk in iter_chunks(tree, branches, chunk_size):
+        for name in branches:
+            chunk.values[name].tofile(files[name, 'values'])
+            (chunk.offsets[name][1:] + total[name]).tofile(
+                files[name, 'offsets'])
+            total[name] += len(chunk.values[name])
+    for f in files.values():
+        f.close()
+    tfile.Close()
+    for (name, kind), path in raw.items():
+        _to_npy(path, path[:-len('.raw')],
+                np.float64 if kind == 'values' else np.int64)
+
+    stat = os.stat(infile)
+    meta = {
+        'version': COLUMNS_VERSION,
+        'tree': tree_name,
+        'nentries': int(nentries),
+        'branches': list(branches),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': file_checksum(infile),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return cache_dir
+
+
+#===============================================================================
+
+
+def load_meta(infile, tree_name='tree'):
+    """Return the metadata of the column cache of infile if it is complete
+    and still valid, else None."""
+    path = os.path.join(columns_path(infile), 'meta.json')
+    if not os.path.exists(path): return None
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != COLUMNS_VERSION: return None
+    if meta.get('tree') != tree_name: return None
+    if any(field not in meta for field in COLUMNS_FIELDS): return None
+
+    stat = os.stat(infile)
+    if meta['size'] != stat.st_size: return None
+    if meta['mtime'] != stat.st_mtime:
+        # Same size but touched or copied: only the content can tell
+        if meta['sha256'] != file_checksum(infile): return None
+        meta['mtime'] = stat.st_mtime
+        try:
+            write_json(path, meta, indent=2)
+        except OSError:
+            pass  # read-only location, cache is still valid
+    return meta
+
+
+def load_columns(infile, branches=None, tree_name='tree'):
+    """Memory-map the column cache of infile.
+
+    Returns a ColumnStore, or None if there is no valid cache with all the
+    requested branches.
+    """
+    meta = load_meta(infile, tree_name)
+    if meta is None: return None
+    if branches is not None and not set(branches) <= set(meta['branches']):
+        return None
+    return ColumnStore(columns_path(infile), meta)
+
+
+def open_columns(infile, branches=None, tree_name='tree'):
+    """Load the column cache of infile, exporting it first if it is missing
+    or out of date. Returns a ColumnStore."""
+    store = load_columns(infile, branches, tree_name)
+    if store is None:
+        print(f'Exporting column cache of {infile}...')
+        export_columns(infile, branches, tree_name)
+        store = load_columns(infile, branches, tree_name)
+    return store
+
+
+#===============================================================================
+
+
+class ColumnStore:
+    """Memory-mapped columns of a tree, usable in place of the TTree by
+    iter_chunks."""
+
+    def __init__(self, cache_dir, meta):
+        self.cache_dir = cache_dir
+        self.meta = meta
+        self.branches = meta['branches']
+        self._values = {}
+        self._offsets = {}
+
+    def GetEntries(self):
+        """Number of entries, named like TTree::GetEntries."""
+        return self.meta['nentries']
+
+    def values(self, name):
+        """Return the flat values of a branch for all entries (memory-mapped,
+        read-only)."""
+        if name not in self._values:
+            self._values[name] = np.load(
+                _array_path(self.cache_dir, name, 'values'), mmap_mode='r')
+        return self._values[name]
+
+    def offsets(self, name):
+        """Return the nentries + 1 offsets of a branch (memory-mapped)."""
+        if name not in self._offsets:
+            self._offsets[name] = np.load(
+                _array_path(self.cache_dir, name, 'offsets'), mmap_mode='r')
+        return self._offsets[name]
+
+    def chunk(self, branches, start, stop):
+        """Return a Chunk of entries [start, stop). The values are views of
+        the mapped files; only the offsets are copied (rebased to 0)."""
+        chunk = Chunk(start, stop)
+        for name in branches:
+            offsets = self.offsets(name)[start:stop + 1]
+            first, last = int(offsets[0]), int(offsets[-1])
+            chunk.values[name] = self.values(name)[first:last]
+            chunk.offsets[name] = offsets - first
+        return chunk
+
+    def chunks(self, branches, chunk_size=100000, first=0, last=None):
+        """Yield Chunks of the given branches covering all entries, or the
+        entries [first, last) if given."""
+        last = self.GetEntries() if last is None else last
+        for start in range(first, last, chunk_size):
+            yield self.chunk(branches, start, min(start + chunk_size, last))
@@ -0,0 +1,204 @@
+################################################################################
+# Methods to read TTree branches into flat NumPy arrays in chunks of events.   #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Jagged branches (one vector<double> per event) are returned as a flat array
+of all values in the chunk plus an offsets array of length nevents + 1, so
+that the values of event i are values[offsets[i]:offsets[i + 1]].
+
+The values are read with TTree::Draw in 'goff' mode, one branch at a time, so
+the per-entry loop happens in C++ and only the requested branches are
+decompressed. Chunks are aligned with the clusters of the tree (groups of
+entries whose baskets are stored together), so no basket is decompressed for
+two chunks. A ColumnStore (see utils/column_cache.py) can be used in place of
+the tree, which then reads from its memory-mapped arrays instead.
+
+Code that stays scalar can loop over iter_events, which yields an EventView
+of each entry with the values of every branch as a NumPy slice:
+
+    for event in iter_events(tree, ['mc_pid', 'mc_px']):
+        mc_pid = event.ints('mc_pid')
+        px = event['mc_px']
+'''
+
+import numpy as np
+
+#===============================================================================
+
+
+class Chunk:
+    """Flat values and offsets of several jagged branches for the entries
+    [start, stop) of a tree."""
+
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+        self.values = {}
+        self.offsets = {}
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def counts(self, name):
+        """Return the number of values per event of a branch."""
+        return np.diff(self.offsets[name])
+
+    def event(self, name):
+        """Return the event index (within the chunk) of each value of a
+        branch."""
+        return np.repeat(np.arange(len(self)), self.counts(name))
+
+    def events(self):
+        """Yield an EventView of each event of the chunk. The same view is
+        moved from event to event."""
+        view = EventView(self)
+        for index in range(len(self)):
+            view.index = index
+            yield view
+
+
+class EventView:
+    """The values of one event of a Chunk, by branch name."""
+    __slots__ = ('chunk', 'index')
+
+    def __init__(self, chunk, index=0):
+        self.chunk = chunk
+        self.index = index
+
+    @property
+    def entry(self):
+        """Entry number of the event in the tree."""
+        return self.chunk.start + self.index
+
+    def __getitem__(self, name):
+        """Return the values of a branch for this event (a NumPy view)."""
+        offsets = self.chunk.offsets[name]
+        return self.chunk.values[name][offsets[self.index]:
+                                       offsets[self.index + 1]]
+
+    def ints(self, name):
+        """Return the values of a branch for this event as a list of ints."""
+        return self[name].astype(np.int64).tolist()
+
+
+#===============================================================================
+
+
+def _draw(tree, expr, nentries, first):
+    """Run TTree::Draw in goff mode, growing the estimate if the number of
+    selected rows does not fit. Returns the number of rows."""
+    nrows = tree.Draw(expr, '', 'goff', nentries, first)
+    if nrows > tree.GetEstimate():
+        tree.SetEstimate(nrows)
+        nrows = tree.Draw(expr, '', 'goff', nentries, first)
+    return nrows
+
+
+def _as_array(ptr, n):
+    """Copy n doubles from a PyROOT buffer into a NumPy array. The buffers of
+    TTree::Draw are reused by the next call, so a copy is required."""
+    if n <= 0: return np.zeros(0, dtype=np.float64)
+    ptr.reshape((n,))
+    return np.array(ptr, dtype=np.float64)
+
+
+def read_branch(tree, name, start, stop):
+    """Read a jagged branch for entries [start, stop).
+
+    Returns (values, offsets) as NumPy arrays.
+    """
+    nentries = stop - start
+    nrows = _draw(tree, f'{name}:Entry$', nentries, start)
+    values = _as_array(tree.GetV1(), nrows)
+    entries = _as_array(tree.GetV2(), nrows).astype(np.int64) - start
+    counts = np.bincount(entries, minlength=nentries)
+    offsets = np.zeros(nentries + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return values, offsets
+
+
+def read_chunk(tree, branches, start, stop):
+    """Read several jagged branches for entries [start, stop) into a Chunk."""
+    chunk = Chunk(start, stop)
+    for name in branches:
+        chunk.values[name], chunk.offsets[name] = read_branch(tree, name,
+                                                              start, stop)
+    return chunk
+
+
+def _cluster_starts(tree, offset=0):
+    """Return the first entry of every cluster of a TTree, plus offset."""
+    nentries = tree.GetEntries()
+    it = tree.GetClusterIterator(0)
+    starts = []
+    start = it()
+    while start < nentries:
+        starts.append(offset + start)
+        start = it()
+    return starts
+
+
+def cluster_starts(tree):
+    """Return the first entry of every cluster of a TTree or TChain, or None
+    if the tree does not know its clusters."""
+    if not hasattr(tree, 'GetClusterIterator'): return None
+    if not tree.InheritsFrom('TChain'): return _cluster_starts(tree)
+    # Clusters of each file of the chain, in global entry numbers
+    tree.GetEntries()  # fills the tree offsets
+    offsets = tree.GetTreeOffset()
+    starts = []
+    for i in range(tree.GetNtrees()):
+        tree.LoadTree(offsets[i])
+        starts += _cluster_starts(tree.GetTree(), offsets[i])
+    return starts
+
+
+def chunk_ranges(tree, chunk_size=100000, first=0, last=None):
+    """Return the (start, stop) entry ranges of the chunks of tree.
+
+    Whole clusters are grouped until a chunk holds at least chunk_size
+    entries; a cluster larger than that is split into pieces of chunk_size.
+    Without cluster information the ranges are simply chunk_size long. Only
+    the entries [first, last) are covered, if given.
+    """
+    nentries = tree.GetEntries()
+    last = nentries if last is None else min(last, nentries)
+    if first > 0 or last < nentries:
+        return [(max(start, first), min(stop, last))
+                for start, stop in chunk_ranges(tree, chunk_size)
+                if start < last and stop > first]
+    starts = cluster_starts(tree)
+    if not starts:
+        return [(start, min(start + chunk_size, nentries))
+                for start in range(0, nentries, chunk_size)]
+    ranges = []
+    start = 0
+    for stop in starts[1:] + [nentries]:
+        while stop - start >= 2 * chunk_size:
+            ranges.append((start, start + chunk_size))
+            start += chunk_size
+        if stop - start >= chunk_size or stop == nentries:
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def iter_chunks(tree, branches, chunk_size=100000, first=0, last=None):
+    """Yield cluster-aligned Chunks of the given branches covering all
+    entries of tree (a TTree, TChain or ColumnStore), or the entries
+    [first, last) if given."""
+    if hasattr(tree, 'chunks'):
+        yield from tree.chunks(branches, chunk_size, first, last)
+        return
+    for start, stop in chunk_ranges(tree, chunk_size, first, last):
+        yield read_chunk(tree, branches, start, stop)
+
+
+def iter_events(tree, branches, chunk_size=100000, first=0, last=None):
+    """Yield an EventView of every entry of tree (or of the entries
+    [first, last)), read a chunk at a time."""
+    for chunk in iter_chunks(tree, branches, chunk_size, first, last):
+        yield from chunk.events()
@@ -1,46 +1,171 @@
-import ROOT
-from array import array
+from utils.lazy_import import ROOT
+import math
+import numpy as np
 
-# TODO: Consider only filling histograms and returning array of histograms,
-# instead of writing to file here. This would make the function more flexible.
-def create_histograms(outfile, binwidths, arrays, names):
-    '''Create histograms from arrays of data and save to ROOT TFile.
+
+class BinAccumulator:
+    '''Mergeable summary of the values of one histogram.
+
+    The bin edges chosen by fill_histograms are -0.5 + n for whole numbers n
+    (whole-number bin widths, range rounded to whole numbers), so the values
+    are counted per unit cell [n - 0.5, n + 0.5), stored sparsely, and the
+    histogram gets the same bin contents as from the values themselves.
+    Memory grows with the number of distinct cells, not with the number of
+    values. Also kept: the number of values, their sum and sum of squares
+    (statistics), and their minimum and maximum (range).
+
+    The sums are kept as one partial sum per fill (a chunk of events) and
+    added with math.fsum, which rounds the exact total once. Accumulators
+    filled from the same chunks therefore give bit-identical sums however
+    the chunks were grouped and merged.
+    '''
+
+    def __init__(self):
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.entries = 0
+        self.sums = []  # (sum of x, sum of x^2) of each fill
+        self.min, self.max = np.inf, -np.inf
+
+    @property
+    def sumx(self):
+        '''Sum of the values.'''
+        return math.fsum(sx for sx, _ in self.sums)
+
+    @property
+    def sumx2(self):
+        '''Sum of the squared values.'''
+        return math.fsum(sx2 for _, sx2 in self.sums)
+
+    def fill(self, values):
+        '''Add an array of values. Returns self.'''
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0: return self
+        if not np.all(np.isfinite(values)):
+            raise ValueError("Histogram values must be finite.")
+        # Cell of each value, compared exactly with the half-integer edges
+        cell = np.floor(values + 0.5)
+        cell -= values < cell - 0.5
+        cell += values >= cell + 0.5
+        cells, counts = np.unique(cell.astype(np.int64), return_counts=True)
+        self._add(cells, counts)
+        self.entries += len(values)
+        self.sums.append((float(values.sum()), float((values**2).sum())))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def _add(self, cells, counts):
+        if len(self.cells) == 0:
+            self.cells, self.counts = cells, counts
+            return
+        self.cells, inverse = np.unique(np.concatenate([self.cells, cells]),
+                                        return_inverse=True)
+        merged = np.zeros(len(self.cells), dtype=np.int64)
+        np.add.at(merged, inverse, np.concatenate([self.counts, counts]))
+        self.counts = merged
+
+    def merge(self, other):
+        '''Add the values of another accumulator. Returns self.'''
+        if other.entries == 0: return self
+        self._add(other.cells, other.counts)
+        self.entries += other.entries
+        self.sums += other.sums
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def contents(self, bins):
+        '''Return the nbins + 2 bin contents (with under- and overflow) for
+        the given half-integer bin edges.'''
+        # Same bin lookup as TAxis::FindBin: bin 0 is underflow, nbins + 1 is
+        # overflow, and bins include their lower edge
+        idx = np.searchsorted(bins, self.cells, side='right')
+        contents = np.zeros(len(bins) + 1, dtype=np.int64)
+        np.add.at(contents, idx, self.counts)
+        return contents.astype(np.float64)
+
+
+def fill_histograms(binwidths, arrays, names):
+    '''Create histograms from arrays of data, filled in bulk.
     Args:
-        outfile (str): output ROOT file name
-        binwidths (list<float>): list of bin widths for each histogram
-        arrays (list<list<float>>): list of arrays of data for each histogram
+        binwidths (list<int>): list of (whole-number) bin widths for each
+            histogram
+        arrays (list<list<float>, np.ndarray or BinAccumulator>): data for each
+            histogram
         names (list<str>): list of histogram names
+    Returns:
+        list<ROOT.TH1D>: histograms, not attached to any TFile
     '''
     # Check if binwidths, arrays, names have same length
     if not (len(binwidths) == len(arrays) == len(names)):
         raise ValueError("binwidths, arrays, and names must have the same length.")
-    
-    histfile = ROOT.TFile.Open(outfile, "RECREATE")
-    # Switch scope to being in output TFile
-    histfile.cd()
 
+    hists = []
     # Loop over histogram variables, create histograms
-    for i, (arr, name) in enumerate(zip(arrays, names)):
-        binwidth = binwidths[i]
-        xmin = round(min(arr) - binwidth)
+    for binwidth, arr, name in zip(binwidths, arrays, names):
+        if binwidth != int(binwidth):
+            raise ValueError(f"Bin width of {name} must be a whole number.")
+        acc = arr
+        if not isinstance(acc, BinAccumulator):
+            acc = BinAccumulator().fill(arr)
+        if acc.entries == 0:
+            raise ValueError(f"No values to fill histogram {name}.")
+        xmin = round(acc.min - binwidth)
         # Since the hist is shifted to left, need to add another binwidth to the
         # right side (max).
-        xmax = round(max(arr) + 2*binwidth)
+        xmax = round(acc.max + 2*binwidth)
         nbins = int((xmax - xmin) / binwidth)
-        bins = []
-        # nbins + 1 to give margin on right edge
-        for i in range(nbins+1):
-            # Shifted by -0.5 to get proper binning
-            bins.append(-0.5 + xmin + i * binwidth)
+        # nbins + 1 edges to give margin on right edge, shifted by -0.5 to get
+        # proper binning
+        bins = -0.5 + xmin + np.arange(nbins + 1) * binwidth
         # Args: source, title;x-axis label;y-axis label, bins, xmin, xmax
         # Create histogram with manual binning
-        hist = ROOT.TH1D(name, name, nbins, array('d', bins))
-        # Fill histogram
-        for val in arr: hist.Fill(val)
-        
-        # Write histogram to TFile
-        hist.Write()
+        hist = ROOT.TH1D(name, name, nbins, bins)
+        hist.SetDirectory(ROOT.nullptr)
+
+        hist.SetContent(acc.contents(bins))
+        hist.SetEntries(acc.entries)
+        # Statistics as TH1::Fill accumulates them (in-range values only):
+        # sum of weights, sum of weights^2, sum of w*x, sum of w*x^2. The range
+        # above holds every value, so all of them are in range.
+        stats = np.array([acc.entries, acc.entries, acc.sumx, acc.sumx2])
+        hist.PutStats(stats)
+        hists.append(hist)
+
+    return hists
 
+
+def write_histograms(outfile, hists):
+    '''Write histograms to a new ROOT TFile.
+    Args:
+        outfile (str): output ROOT file name
+        hists (list<ROOT.TH1>): histograms to write
+    '''
+    histfile = ROOT.TFile.Open(outfile, "RECREATE")
+    # Switch scope to being in output TFile
+    histfile.cd()
+    for hist in hists:
+        hist.Write()
     # Close histogram TFile
     histfile.Close()
-    return
+
+
+def create_histograms(outfile, binwidths, arrays, names):
+    '''Create histograms from arrays of data and save to ROOT TFile.
+    Args:
+        outfile (str or None): output ROOT file name, or None to only return
+            the histograms
+        binwidths (list<int>): list of (whole-number) bin widths for each
+            histogram
+        arrays (list<list<float>, np.ndarray or BinAccumulator>): data for each
+            histogram
+        names (list<str>): list of histogram names
+    Returns:
+        list<ROOT.TH1D>: the histograms, so callers can compose stages in
+            memory
+    '''
+    hists = fill_histograms(binwidths, arrays, names)
+    if outfile is not None:
+        write_histograms(outfile, hists)
+    return hists
@@ -0,0 +1,118 @@
+################################################################################
+# Methods to read and write event-occupancy index sidecars for raw ntuples.    #
+# Author: Michael Peters                                                       #
+################################################################################
+'''An occupancy index lists the entry numbers of the non-empty events of one
+raw ntuple file. It is stored as a JSON sidecar next to the file together with
+the file size, mtime and checksum, so that later skims (or any other tool) can
+go straight to the surviving entries without scanning the file again.
+
+An index is only returned by load_index if it still describes the file on
+disk: a different size, tree or set of indicator branches invalidates it. If
+only the mtime differs (e.g. the file was copied), the checksum decides.
+'''
+
+import os
+import json
+import hashlib
+
+INDEX_SUFFIX = '.occupancy.json'
+INDEX_VERSION = 1
+INDEX_FIELDS = ['size', 'mtime', 'sha256', 'nentries', 'entries']
+
+#===============================================================================
+
+
+def index_path(infile):
+    """Return the sidecar index file name for an input ntuple file."""
+    return infile + INDEX_SUFFIX
+
+
+def file_checksum(path, blocksize=1 << 24):
+    """Return the sha256 hex digest of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_json(path, data, **kwargs):
+    """Write data as JSON to path atomically: readers see either the old or
+    the new file, never a partial one. Raises OSError on failure."""
+    # Temporary file per process, so concurrent writers do not mix
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(data, f, **kwargs)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+
+#===============================================================================
+
+
+def write_index(infile, entries, nentries, branches, tree_name='tree'):
+    """Write the occupancy index sidecar for infile.
+
+    Args:
+        infile (str): raw ntuple file the index describes
+        entries (list<int>): non-empty entry numbers, local to the file
+        nentries (int): total number of entries in the file's tree
+        branches (list<str>): indicator branches used to decide emptiness
+        tree_name (str): name of the tree in infile
+    Returns the index file name, or None if it could not be written.
+    """
+    stat = os.stat(infile)
+    index = {
+        'version': INDEX_VERSION,
+        'tree': tree_name,
+        'branches': list(branches),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': file_checksum(infile),
+        'nentries': int(nentries),
+        'entries': [int(e) for e in entries],
+    }
+    path = index_path(infile)
+    try:
+        write_json(path, index)
+    except OSError as e:
+        print(f'Warning: could not write index {path}: {e}')
+        return None
+    return path
+
+
+def load_index(infile, branches, tree_name='tree'):
+    """Load the occupancy index of infile if it is still valid.
+
+    Returns the index dict (with 'entries' and 'nentries' keys), or None if
+    there is no index, it is truncated or from another version, or the input
+    file has changed since it was written.
+    """
+    path = index_path(infile)
+    if not os.path.exists(path): return None
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('version') != INDEX_VERSION: return None
+    if index.get('tree') != tree_name: return None
+    if index.get('branches') != list(branches): return None
+    if any(field not in index for field in INDEX_FIELDS): return None
+
+    stat = os.stat(infile)
+    if index['size'] != stat.st_size: return None
+    if index['mtime'] != stat.st_mtime:
+        # Same size but touched or copied: only the content can tell
+        if index['sha256'] != file_checksum(infile): return None
+        index['mtime'] = stat.st_mtime
+        try:
+            write_json(path, index)
+        except OSError:
+            pass  # read-only location, index is still valid
+    return index
@@ -0,0 +1,184 @@
+################################################################################
+# Content-addressed cache of the histogram files written by the hist stages.   #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A cached histogram file is stored under a key computed from:
+
+- the sha256 of the input ntuple (content, not path or mtime),
+- the stage name, binwidths and histogram names,
+- the code version, a hash of the sources the histograms are computed with.
+
+On a hit the stored file is copied to the requested output file and the event
+loop of that stage is skipped. The cache lives in CACHE_DIR, together with an
+index.json recording the size and last use of each entry, and input checksums
+keyed on path, size and mtime so that unchanged inputs are not hashed again.
+Once the cache grows past its size cap the least recently used entries are
+evicted. Use src/hist_cache.py to inspect or clear it.
+'''
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from utils.event_index import file_checksum
+
+CACHE_DIR = os.environ.get('HIST_CACHE_DIR', 'hist/.cache')
+CACHE_MAX_BYTES = 1 << 30  # 1 GB
+CACHE_VERSION = 1
+
+# Sources in src/utils/ that determine the content of the histogram files:
+# the engine and what it imports to read, fill and merge histograms
+CODE_FILES = ['hist_engine.py', 'create_histograms.py', 'columnar.py',
+              'column_cache.py', 'mapreduce.py', 'truth_match.py']
+
+#===============================================================================
+
+
+def code_version():
+    """Return a hash of the sources the histograms are computed with."""
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(here, name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(input_sha256, stage, code=None):
+    """Return the cache key of a stage run on an input with given checksum.
+
+    Args:
+        input_sha256 (str): sha256 of the input ntuple
+        stage (Stage): stage class or instance (name, binwidths, names)
+        code (str): code version, computed if not given
+    """
+    config = {
+        'version': CACHE_VERSION,
+        'input': input_sha256,
+        'stage': stage.name,
+        'binwidths': list(stage.binwidths),
+        'names': list(stage.names),
+        'code': code or code_version(),
+    }
+    blob = json.dumps(config, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+#===============================================================================
+
+
+class HistCache:
+    """Histogram file cache in a directory, with LRU eviction."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'index.json')
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.root')
+
+    @contextmanager
+    def _locked(self):
+        """Lock the cache (several stages may run at once) and yield its
+        index, which is saved on exit."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self._load()
+            yield index
+            self._save(index)
+
+    def _load(self):
+        empty = {'version': CACHE_VERSION, 'entries': {}, 'inputs': {}}
+        if not os.path.exists(self.index_file): return empty
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if index.get('version') != CACHE_VERSION: return empty
+        # Drop entries whose file has gone
+        index['entries'] = {k: e for k, e in index['entries'].items()
+                            if os.path.exists(self.entry_path(k))}
+        return index
+
+    def _save(self, index):
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self.index_file)
+
+    #---------------------------------------------------------------------------
+
+    def input_checksum(self, infile):
+        """Return the sha256 of infile, reusing the stored one while the
+        file's size and mtime are unchanged."""
+        path = os.path.abspath(infile)
+        stat = os.stat(infile)
+        with self._locked() as index:
+            rec = index['inputs'].get(path)
+            if rec and rec['size'] == stat.st_size \
+                    and rec['mtime'] == stat.st_mtime:
+                return rec['sha256']
+        sha = file_checksum(infile)
+        with self._locked() as index:
+            index['inputs'][path] = {'size': stat.st_size,
+                                     'mtime': stat.st_mtime, 'sha256': sha}
+        return sha
+
+    def fetch(self, key, outfile):
+        """Copy the cached file of key to outfile. Returns False on a miss."""
+        with self._locked() as index:
+            entry = index['entries'].get(key)
+            if entry is None: return False
+            shutil.copyfile(self.entry_path(key), outfile)
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+        return True
+
+    def store(self, key, outfile, **info):
+        """Add a copy of outfile to the cache under key, then evict least
+        recently used entries beyond the size cap."""
+        with self._locked() as index:
+            tmp = self.entry_path(key) + '.tmp'
+            shutil.copyfile(outfile, tmp)
+            os.replace(tmp, self.entry_path(key))
+            now = time.time()
+            entry = {'size': os.path.getsize(outfile), 'created': now,
+                     'last_used': now, 'hits': 0}
+            entry.update(info)
+            index['entries'][key] = entry
+            self._evict(index)
+
+    def _evict(self, index):
+        entries = index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes: break
+            total -= entries[key]['size']
+            os.remove(self.entry_path(key))
+            del entries[key]
+
+    #---------------------------------------------------------------------------
+
+    def entries(self):
+        """Return the cache entries as (key, entry) pairs, most recently used
+        first."""
+        with self._locked() as index:
+            items = list(index['entries'].items())
+        return sorted(items, key=lambda item: -item[1]['last_used'])
+
+    def clear(self, keep_bytes=0):
+        """Evict least recently used entries until at most keep_bytes are
+        left (all of them by default). Returns the number removed."""
+        with self._locked() as index:
+            n = len(index['entries'])
+            max_bytes, self.max_bytes = self.max_bytes, keep_bytes
+            self._evict(index)
+            self.max_bytes = max_bytes
+            if keep_bytes == 0: index['inputs'] = {}
+            return n - len(index['entries'])
@@ -0,0 +1,315 @@
+################################################################################
+# Single-pass engine filling the gen, reco and mass histograms of step 3.      #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Each histogram stage (gen, rec, mass) declares the branches it needs and
+fills its arrays from a Chunk of events (see utils/columnar.py). The engine
+reads a tree once, a chunk at a time, for the union of the branches of all
+requested stages, hands every chunk to every stage and finally writes one
+histogram file per stage.
+
+hist_gen.py, hist_rec.py and hist_mass.py run one stage each, hist_all.py runs
+all three in one pass. Stage outputs are cached (see utils/hist_cache.py), so
+stages whose input, configuration and code are unchanged skip the event loop.
+If the input has a valid column cache (see utils/column_cache.py), the chunks
+are read from it instead of the ROOT file. With njobs > 1 the event loop runs
+as map-reduce over shards of the tree (see utils/mapreduce.py). Stages keep
+their values as BinAccumulators (see utils/create_histograms.py), so the
+result a worker returns stays small and the merged bin contents are the same
+as in a single pass.
+'''
+
+import os
+import abc
+import functools
+import numpy as np
+from utils.lazy_import import ROOT
+from utils.columnar import iter_chunks
+from utils.column_cache import load_columns
+from utils.create_histograms import create_histograms, BinAccumulator
+from utils.truth_match import truth_match
+from utils.hist_cache import HistCache, cache_key, code_version
+from utils.instrument import Monitor
+from utils.mapreduce import map_reduce
+
+#===============================================================================
+
+
+def invariant_mass(e, p2, name):
+    """Return sqrt(e**2 - p2) of the histogram name. Raises ValueError if
+    any mass squared is negative, as the per-event loops did."""
+    m2 = e**2 - p2
+    if np.any(m2 < 0):
+        raise ValueError(f'{name}: {np.count_nonzero(m2 < 0)} candidates '
+                         f'with negative mass squared (min {m2.min():g})')
+    return np.sqrt(m2)
+
+
+class Stage(abc.ABC):
+    """Base class of a histogram stage.
+
+    Subclasses set branches, names, binwidths and counters (attributes summed
+    by merge) and implement fill(), which adds the values of a chunk to the
+    BinAccumulator of each histogram in hists.
+    """
+    name = ''
+    branches = []
+    names = []
+    binwidths = []
+    counters = []
+
+    def __init__(self):
+        self.hists = {name: BinAccumulator() for name in self.names}
+
+    @abc.abstractmethod
+    def fill(self, chunk):
+        """Add the values of a chunk of events to the histograms."""
+
+    def accumulators(self):
+        """Return the BinAccumulators in the same order as names."""
+        return [self.hists[name] for name in self.names]
+
+    def merge(self, other):
+        """Add a stage filled from other entries. Returns self."""
+        for name in self.names:
+            self.hists[name].merge(other.hists[name])
+        for attr in self.counters:
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+        return self
+
+    def report(self):
+        """Print summary counters after the event loop."""
+        pass
+
+
+class GenStage(Stage):
+    """Generator-level pid, mass, momentum, pt and pz of all MC particles."""
+    name = 'gen'
+    branches = ['mc_pid', 'mc_px', 'mc_py', 'mc_pz', 'mc_e']
+    names = ['mc_pid',
+             'mc_m',
+             'mc_p', 'mc_pt', 'mc_pz']
+    binwidths = [1,  # pid bins
+                 1,  # mass bins (MeV)
+                 2000, 100, 2000]  # momentum, pt, pz bins (MeV)
+    counters = ['ntag']
+
+    def __init__(self):
+        super().__init__()
+        self.ntag = 0
+
+    def fill(self, chunk):
+        pid = np.trunc(chunk['mc_pid'])
+        px, py, pz = chunk['mc_px'], chunk['mc_py'], chunk['mc_pz']
+        # Compute momentum and transverse momentum
+        p = np.sqrt(px**2 + py**2 + pz**2)
+        pt = np.sqrt(px**2 + py**2)
+        # Compute mass for eta only
+        is_eta = pid == 221
+        m = invariant_mass(chunk['mc_e'][is_eta], p[is_eta]**2, 'mc_m')
+
+        self.hists['mc_pid'].fill(pid)
+        self.hists['mc_m'].fill(m)
+        self.hists['mc_p'].fill(p)
+        self.hists['mc_pt'].fill(pt)
+        self.hists['mc_pz'].fill(pz)
+        self.ntag += len(pid)
+
+    def report(self):
+        print('Number of generated tags = ', self.ntag)
+
+
+class RecStage(Stage):
+    """Reconstructed pid, momentum, pt and pz of tags and daughters, and the
+    tag mass, for events with at least one tag."""
+    name = 'rec'
+    branches = ['tag_pid', 'tag_px', 'tag_py', 'tag_pz', 'tag_e',
+                'prt_pid', 'prt_px', 'prt_py', 'prt_pz']
+    names = ['tag_pid', 'prt_pid',
+             'tag_m',
+             'tag_p', 'tag_pt', 'tag_pz',
+             'prt_p', 'prt_pt', 'prt_pz']
+    binwidths = [1, 1,  # pid bins
+                 10,  # mass bins (MeV)
+                 1000, 100, 1000,  # momentum, pt, pz bins (MeV)
+                 1000, 100, 1000]  # momentum, pt, pz bins (MeV)
+    counters = ['ntag', 'nprt']
+
+    def __init__(self):
+        super().__init__()
+        self.ntag, self.nprt = 0, 0
+
+    def fill(self, chunk):
+        # Skip empty events (no reconstructed tag)
+        has_tag = chunk.counts('tag_pid') > 0
+        prt = has_tag[chunk.event('prt_pid')]
+
+        tag_px, tag_py, tag_pz = chunk['tag_px'], chunk['tag_py'], chunk['tag_pz']
+        prt_px = chunk['prt_px'][prt]
+        prt_py = chunk['prt_py'][prt]
+        prt_pz = chunk['prt_pz'][prt]
+
+        # Compute momentum, transverse momentum and mass
+        tag_p2 = tag_px**2 + tag_py**2 + tag_pz**2
+        tag_m = invariant_mass(chunk['tag_e'], tag_p2, 'tag_m')
+        self.hists['tag_pid'].fill(chunk['tag_pid'])
+        self.hists['tag_m'].fill(tag_m)
+        self.hists['tag_p'].fill(np.sqrt(tag_p2))
+        self.hists['tag_pt'].fill(np.sqrt(tag_px**2 + tag_py**2))
+        self.hists['tag_pz'].fill(tag_pz)
+        self.hists['prt_pid'].fill(chunk['prt_pid'][prt])
+        self.hists['prt_p'].fill(np.sqrt(prt_px**2 + prt_py**2 + prt_pz**2))
+        self.hists['prt_pt'].fill(np.sqrt(prt_px**2 + prt_py**2))
+        self.hists['prt_pz'].fill(prt_pz)
+        self.ntag += len(tag_pz)
+        self.nprt += len(prt_pz)
+
+    def report(self):
+        print('Number of reconstructed tags = ', self.ntag)
+        print('Number of reconstructed daughters = ', self.nprt)
+
+
+class MassStage(Stage):
+    """Tag mass of eta candidates, split into truth-matched signal and
+    background (see utils/truth_match.py)."""
+    name = 'mass'
+    branches = ['tag_pid', 'tag_m', 'prt_pid', 'prt_idx_gen', 'prt_idx_mom',
+                'mc_pid', 'mc_idx_mom']
+    names = ['sig', 'bkg', 'tot']
+    binwidths = [10] * 3  # MeV
+    counters = ['nevents', 'nsig', 'nbkg', 'ntot']
+
+    def __init__(self):
+        super().__init__()
+        self.nevents = 0
+        self.nsig, self.nbkg, self.ntot = 0, 0, 0
+
+    def fill(self, chunk):
+        # TODO: create sub-categories of background for mis-matched photons vs
+        # mis-matched muons vs mis-matched dimuon pairs.
+        # TODO: This doesn't handle multiple eta candidates (very rare).
+        match = truth_match(chunk)
+        self.nevents += len(chunk)
+
+        # Skip failed reco/non-eta candidates
+        is_eta = match.tag_pid == 221
+        tag_off = chunk.offsets['tag_m']
+        tag_m = chunk['tag_m'][tag_off[match.evt] + match.can_idx][is_eta]
+        is_signal = match.is_signal[is_eta]
+
+        self.hists['tot'].fill(tag_m)
+        self.hists['sig'].fill(tag_m[is_signal])
+        self.hists['bkg'].fill(tag_m[~is_signal])
+        self.ntot += len(tag_m)
+        self.nsig += int(np.count_nonzero(is_signal))
+        self.nbkg += int(np.count_nonzero(~is_signal))
+
+    def report(self):
+        print(f'Number of events processed: {self.nevents}')
+        print(f'Number of signal candidates: {self.nsig}')
+        print(f'Number of background candidates: {self.nbkg}')
+        print(f'Number of total candidates: {self.ntot}')
+
+
+STAGES = {stage.name: stage for stage in (GenStage, RecStage, MassStage)}
+
+# Default (input, output) files of each stage, for minbias and signal
+DEFAULT_FILES = {
+    'gen': {'minbias': ('red/reduced_fiducial_cuts.root', 'hist/hist_gen.root'),
+            'sig': ('MC_2018_Signal/eta2MuMuGamma_mc_20251121.root',
+                    'hist/sig_hist_gen.root')},
+    'rec': {'minbias': ('red/reduced_fiducial_cuts.root', 'hist/hist_rec.root'),
+            'sig': ('MC_2018_Signal/eta2MuMuGamma_mc_20251208.root',
+                    'hist/sig_hist_rec.root')},
+    'mass': {'minbias': ('red/reduced_fiducial_cuts.root', 'hist/hist_m.root'),
+             'sig': ('MC_2018_Signal/eta2MuMuGamma_mc_20251208.root',
+                     'hist/sig_hist_m.root')},
+}
+
+
+def default_files(name, sig_file=False):
+    """Return the default (input, output) files of a stage."""
+    return DEFAULT_FILES[name]['sig' if sig_file else 'minbias']
+
+#===============================================================================
+
+
+def fill_stages(names, tree, first=0, last=None, phase=None):
+    """Shard task: fill new stages of the given names from entries
+    [first, last) of tree. Returns the list of stages."""
+    stages = [STAGES[name]() for name in names]
+    branches = []
+    for stage in stages:
+        branches += [b for b in stage.branches if b not in branches]
+    for chunk in iter_chunks(tree, branches, first=first, last=last):
+        for stage in stages:
+            stage.fill(chunk)
+        if phase is not None: phase.update(chunk.stop - first)
+    return stages
+
+
+def merge_stages(stages, others):
+    """Merge the stages of the next shard into stages (same order)."""
+    for stage, other in zip(stages, others):
+        stage.merge(other)
+    return stages
+
+
+def run_stages(infile, outfiles, use_cache=True, monitor=None,
+               use_columns=True, njobs=1):
+    """Fill the histograms of several stages in one pass over infile.
+
+    Args:
+        infile (str): ROOT file with the tree
+        outfiles (dict<str, str>): output histogram file per stage name
+        use_cache (bool): reuse cached histogram files, and cache new ones
+        monitor (Monitor): records the fill and write phases
+        use_columns (bool): read from the column cache of infile if valid
+        njobs (int): number of processes filling shards of the tree
+    Returns:
+        dict<str, Stage>: the filled stages (cache hits are not included)
+    """
+    if use_cache:
+        cache = HistCache()
+        sha, code = cache.input_checksum(infile), code_version()
+        keys = {name: cache_key(sha, STAGES[name], code) for name in outfiles}
+        hits = [name for name in outfiles
+                if cache.fetch(keys[name], outfiles[name])]
+        for name in hits:
+            print(f'Done: cache hit, copied histograms to {outfiles[name]}')
+        outfiles = {name: outfile for name, outfile in outfiles.items()
+                    if name not in hits}
+        if not outfiles: return {}
+
+    names = list(outfiles)
+    branches = []
+    for name in names:
+        branches += [b for b in STAGES[name].branches if b not in branches]
+
+    monitor = monitor or Monitor()
+    label = '+'.join(names)
+    tree = load_columns(infile, branches) if use_columns else None
+    if tree is not None:
+        tfile = None
+        print(f'Reading columns from {tree.cache_dir}')
+    else:
+        tfile = ROOT.TFile.Open(infile, 'READ')
+        tree = tfile.Get('tree')
+    # Single chunked event loop shared by all stages, per shard if njobs > 1
+    with monitor.phase(f'fill:{label}', tree.GetEntries()) as phase:
+        filled = map_reduce(tree, functools.partial(fill_stages, names),
+                            njobs, phase, merge_stages)
+    stages = dict(zip(names, filled))
+    if tfile is not None: tfile.Close()
+
+    # Create histograms and save to output files
+    with monitor.phase(f'write:{label}'):
+        for name, stage in stages.items():
+            stage.report()
+            create_histograms(outfiles[name], stage.binwidths,
+                              stage.accumulators(), stage.names)
+            if use_cache:
+                cache.store(keys[name], outfiles[name], stage=name,
+                            input=os.path.abspath(infile))
+            print(f'Done: wrote histograms to {outfiles[name]}')
+    return stages
@@ -0,0 +1,119 @@
+################################################################################
+# NumPy views of ROOT histogram bins, and vectorized scans over them.          #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Reading a histogram bin by bin through PyROOT (GetBinContent, GetBinError)
+costs a Python call per bin, and the automatic ranges of create_histograms
+can give histograms with very many bins. The functions below instead wrap the
+histogram's internal arrays (TH1::GetArray, the Sumw2 array and the bin edges)
+as NumPy arrays without copying, and compute from those:
+
+- max_with_error: largest bin content (plus its error) of the visible bins,
+- integral: sum of bin contents and its error over an x range,
+- ratio and pull: bin-by-bin ratio or pull between two histograms.
+
+The views share memory with the histogram, so they are only valid while the
+histogram exists and see any later change of its bins. Arrays include the
+underflow (index 0) and overflow (index nbins + 1) bins, like the histogram.
+'''
+
+import numpy as np
+
+# NumPy type of the bin array of each TH1 storage class
+_ARRAY_TYPES = [('TArrayD', np.float64), ('TArrayF', np.float32),
+                ('TArrayI', np.int32), ('TArrayS', np.int16),
+                ('TArrayC', np.int8), ('TArrayL64', np.int64)]
+
+#===============================================================================
+
+
+def _view(ptr, n, dtype=np.float64):
+    """Wrap n values of a PyROOT buffer as a NumPy array, without copying."""
+    if n <= 0: return np.zeros(0, dtype=dtype)
+    ptr.reshape((n,))
+    return np.frombuffer(ptr, dtype=dtype, count=n)
+
+
+def contents(hist):
+    """Return the bin contents of a 1D histogram, including under/overflow,
+    as a NumPy view."""
+    n = hist.GetNbinsX() + 2
+    for cls, dtype in _ARRAY_TYPES:
+        if hist.InheritsFrom(cls): return _view(hist.GetArray(), n, dtype)
+    raise TypeError(f'Unsupported histogram class {hist.ClassName()}')
+
+
+def errors(hist):
+    """Return the bin errors of a 1D histogram, including under/overflow.
+
+    Same as TH1::GetBinError for the default error option: the square root of
+    the sum of squared weights if Sumw2 is set, else of |content|.
+    """
+    if hist.GetSumw2N() > 0:
+        sumw2 = hist.GetSumw2()
+        return np.sqrt(_view(sumw2.GetArray(), sumw2.GetSize()))
+    return np.sqrt(np.abs(contents(hist).astype(np.float64)))
+
+
+def edges(hist):
+    """Return the nbins + 1 bin edges of the x axis."""
+    axis = hist.GetXaxis()
+    nbins = axis.GetNbins()
+    xbins = axis.GetXbins()
+    if xbins.GetSize() == nbins + 1:
+        return _view(xbins.GetArray(), nbins + 1)
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+
+#===============================================================================
+
+
+def max_with_error(hist, err=False, margin=1):
+    """Find the largest y value among the visible bins, plus the bin error if
+    err, plus a small margin to avoid clipping error bars. Without visible
+    bins the largest value is -inf, as in the per-bin loop."""
+    vals = contents(hist)[1:-1].astype(np.float64)
+    if err: vals = vals + errors(hist)[1:-1]
+    max_val = float(vals.max()) if len(vals) > 0 else -float('inf')
+    return max_val + margin
+
+
+def integral(hist, xmin=None, xmax=None):
+    """Return (integral, error) of the bins from the one containing xmin to
+    the one containing xmax, as TH1::IntegralAndError (visible bins by
+    default)."""
+    bin_edges = edges(hist)
+    nbins = len(bin_edges) - 1
+    # Same bin lookup as TAxis::FindBin
+    first = 1 if xmin is None else int(np.searchsorted(bin_edges, xmin,
+                                                       side='right'))
+    last = nbins if xmax is None else int(np.searchsorted(bin_edges, xmax,
+                                                          side='right'))
+    first, last = max(first, 0), min(last, nbins + 1)
+    vals = contents(hist)[first:last + 1].astype(np.float64)
+    errs = errors(hist)[first:last + 1]
+    return float(vals.sum()), float(np.sqrt(np.sum(errs**2)))
+
+
+def ratio(num, den):
+    """Return (ratio, error) arrays of num / den for the visible bins, with
+    uncorrelated errors added in quadrature. Bins with den == 0 give 0."""
+    n = contents(num)[1:-1].astype(np.float64)
+    d = contents(den)[1:-1].astype(np.float64)
+    en, ed = errors(num)[1:-1], errors(den)[1:-1]
+    ok = d != 0
+    r = np.divide(n, d, out=np.zeros_like(n), where=ok)
+    # Same error propagation as TH1::Divide
+    err = np.divide(np.sqrt(en**2 * d**2 + ed**2 * n**2), d**2,
+                    out=np.zeros_like(n), where=ok)
+    return r, err
+
+
+def pull(data, model):
+    """Return the per-bin pull (data - model) / sigma for the visible bins,
+    with sigma the bin errors of both added in quadrature. Bins with
+    sigma == 0 give 0."""
+    diff = (contents(data)[1:-1].astype(np.float64)
+            - contents(model)[1:-1].astype(np.float64))
+    sigma = np.sqrt(errors(data)[1:-1]**2 + errors(model)[1:-1]**2)
+    return np.divide(diff, sigma, out=np.zeros_like(diff), where=sigma != 0)
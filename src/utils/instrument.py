@@ -0,0 +1,202 @@
+################################################################################
+# Methods to measure the throughput and memory use of the processing stages.   #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A Monitor collects measurements for one stage (one script run), split into
+named sub-phases:
+
+    monitor = Monitor('red_root')
+    with monitor.phase('skim', total=chain.GetEntries()) as phase:
+        for entryIdx in range(chain.GetEntries()):
+            ...
+            phase.update(entryIdx + 1, nkept)
+    monitor.write(summary_path(outfile))
+
+For each phase it records the wall and CPU time, events processed and kept,
+events/sec, bytes read from ROOT files and the peak RSS of the process (and
+of its finished child processes). ROOT counts the bytes read per process, so
+code that reads in worker processes (utils/mapreduce.py, red_root.py --jobs)
+measures them in each worker and reports them with add_bytes(). Processes that
+never import ROOT (NumPy-only or column cache runs) record 0 bytes without
+loading it. While a phase runs, update() prints a compact progress line with
+the rate and ETA at most every `interval` seconds; a final line is printed
+when the phase ends. write() saves the phases and
+their totals as a JSON run summary.
+
+Functions that take an optional monitor use a throwaway Monitor when none is
+given, so they still print progress but no summary is written.
+'''
+
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+from utils.lazy_import import ROOT
+
+#===============================================================================
+
+
+def peak_rss_mb():
+    """Return the peak RSS (MB) of this process and its waited-for children."""
+    # ru_maxrss is in kB on Linux
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss / 1024
+
+
+def bytes_read():
+    """Return the number of bytes read from ROOT files so far by this
+    process, or 0 if ROOT has not been imported (nothing was read then)."""
+    if 'ROOT' not in sys.modules: return 0
+    return int(ROOT.TFile.GetFileBytesRead())
+
+
+def format_duration(seconds):
+    """Format a duration as e.g. 45s, 12m05s or 3h20m."""
+    seconds = int(seconds)
+    if seconds < 60: return f'{seconds}s'
+    if seconds < 3600: return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+
+
+def summary_path(outfile):
+    """Return the run summary file next to an output file."""
+    return os.path.splitext(outfile)[0] + '.run.json'
+
+
+#===============================================================================
+
+
+class Phase:
+    """Measurements of one sub-phase of a stage."""
+
+    def __init__(self, name, total=None, interval=10.0, stream=None,
+                 unit='events'):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.events = 0
+        self.kept = None
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._bytes = bytes_read()
+        self._child_bytes = 0
+        self._next_print = self._wall + interval
+        self.record = None
+
+    def update(self, events, kept=None):
+        """Set the number of events processed (and kept) so far, printing a
+        progress line if interval seconds passed since the last one."""
+        self.events = events
+        if kept is not None: self.kept = kept
+        now = time.perf_counter()
+        if now >= self._next_print:
+            self._next_print = now + self.interval
+            self.stream.write(self.progress_line(now) + '\n')
+            self.stream.flush()
+
+    def add_bytes(self, nbytes):
+        """Add bytes read from ROOT files by a worker process."""
+        self._child_bytes += nbytes
+
+    def progress_line(self, now=None):
+        """Return the progress line, e.g.
+
+        [skim] 1,200,000/100,000,000 (1.2%) kept 12,345 | 85,000 events/s
+               | ETA 19m32s
+
+        (on one line).
+        """
+        elapsed = (now or time.perf_counter()) - self._wall
+        rate = self.events / elapsed if elapsed > 0 else 0.0
+        line = f'  [{self.name}] {self.events:,d}'
+        if self.total:
+            line += f'/{self.total:,d} ({100 * self.events / self.total:.1f}%)'
+        if self.kept is not None: line += f' kept {self.kept:,d}'
+        line += f' | {rate:,.0f} {self.unit}/s'
+        if self.total and rate > 0:
+            eta = (self.total - self.events) / rate
+            line += f' | ETA {format_duration(eta)}'
+        return line
+
+    def finish(self):
+        """Stop the clocks and return the phase record."""
+        wall = time.perf_counter() - self._wall
+        self.record = {
+            'phase': self.name,
+            'wall_s': wall,
+            'cpu_s': time.process_time() - self._cpu,
+            'events': self.events,
+            'kept': self.kept,
+            'events_per_s': self.events / wall if wall > 0 else 0.0,
+            'bytes_read': bytes_read() - self._bytes + self._child_bytes,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        return self.record
+
+
+class Monitor:
+    """Collect the phases of one stage and write its run summary."""
+
+    def __init__(self, stage='', interval=10.0, stream=None):
+        self.stage = stage
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.phases = []
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    @contextmanager
+    def phase(self, name, total=None, unit='events'):
+        """Measure the code in the with block as phase name, of total
+        events (or other units) if known. Yields the Phase to report progress
+        to."""
+        phase = Phase(name, total, self.interval, self.stream, unit)
+        try:
+            yield phase
+        finally:
+            rec = phase.finish()
+            self.phases.append(rec)
+            kept = f', kept {rec["kept"]:,d}' if rec['kept'] is not None else ''
+            self.stream.write(
+                f'  [{name}] done: {rec["events"]:,d} {unit}{kept} in '
+                f'{rec["wall_s"]:.1f} s ({rec["events_per_s"]:,.0f} {unit}/s), '
+                f'{rec["bytes_read"] / 1e6:,.1f} MB read, peak RSS '
+                f'{rec["peak_rss_mb"]:,.0f} MB\n')
+            self.stream.flush()
+
+    def summary(self, **extra):
+        """Return the run summary: totals over the stage plus its phases.
+        Events are those of the first phase, kept those of the last phase
+        that counts them."""
+        wall = time.perf_counter() - self._wall
+        events = self.phases[0]['events'] if self.phases else 0
+        kept = [p['kept'] for p in self.phases if p['kept'] is not None]
+        summary = {
+            'stage': self.stage,
+            'argv': sys.argv,
+            'start': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                   time.localtime(self._start)),
+            'wall_s': wall,
+            'cpu_s': time.process_time() - self._cpu,
+            'events': events,
+            'kept': kept[-1] if kept else None,
+            'events_per_s': events / wall if wall > 0 else 0.0,
+            'bytes_read': sum(p['bytes_read'] for p in self.phases),
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': self.phases,
+        }
+        summary.update(extra)
+        return summary
+
+    def write(self, path, **extra):
+        """Write the run summary (plus any extra fields) as JSON to path."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.summary(**extra), f, indent=2)
+        print(f'Wrote run summary to {path}')
@@ -0,0 +1,40 @@
+################################################################################
+# Deferred import of heavy modules (ROOT).                                     #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Importing ROOT takes seconds, so modules that only need it in some code
+paths use a LazyModule instead of a top-level import:
+
+    from utils.lazy_import import ROOT
+
+ROOT is then imported the first time one of its attributes is used, e.g.
+ROOT.TFile. Printing --help, parsing arguments or plain counting never
+pays for it.
+'''
+
+import importlib
+
+#===============================================================================
+
+
+class LazyModule:
+    """Stand-in for a module, imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+ROOT = LazyModule('ROOT')
@@ -0,0 +1,84 @@
+################################################################################
+# Methods to keep track of which raw inputs are in a reduced output file.      #
+# Author: Michael Peters                                                       #
+################################################################################
+'''The manifest of a reduced file lists, in output order, the raw input files
+whose non-empty events it contains. Each record holds the input path, size,
+mtime and checksum, the partial reduced file it was skimmed into, the skim
+engine used and the number of events read (events_in) and kept (events_kept).
+An incremental skim uses it to only process new or changed inputs, and skims
+again the inputs whose partials were written by another engine.
+'''
+
+import os
+import json
+from utils.event_index import file_checksum, write_json
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+#===============================================================================
+
+
+def manifest_path(outfile):
+    """Return the manifest file name for a reduced output file."""
+    return os.path.splitext(outfile)[0] + MANIFEST_SUFFIX
+
+
+def load_manifest(outfile):
+    """Load the manifest of outfile.
+
+    Returns an empty manifest if there is none, it cannot be read, or the
+    reduced output file it describes is missing.
+    """
+    empty = {'version': MANIFEST_VERSION, 'inputs': []}
+    path = manifest_path(outfile)
+    if not os.path.exists(path) or not os.path.exists(outfile): return empty
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION: return empty
+    return manifest
+
+
+def save_manifest(outfile, manifest):
+    """Write the manifest of outfile atomically."""
+    write_json(manifest_path(outfile), manifest, indent=2)
+
+
+#===============================================================================
+
+
+def file_record(infile, **extra):
+    """Return a manifest record (path, size, mtime, sha256) for infile.
+
+    Extra keyword arguments are stored in the record as well.
+    """
+    stat = os.stat(infile)
+    record = {
+        'path': os.path.abspath(infile),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': file_checksum(infile),
+    }
+    record.update(extra)
+    return record
+
+
+def is_current(record, infile, **expected):
+    """Check whether a manifest record still describes infile on disk.
+
+    Keyword arguments are extra fields the record must have (e.g. the
+    engine). Size and mtime are checked first; the checksum is only computed
+    when the size matches but the mtime does not.
+    """
+    if any(record.get(k) != v for k, v in expected.items()): return False
+    if not os.path.exists(infile): return False
+    stat = os.stat(infile)
+    if record['size'] != stat.st_size: return False
+    if record['mtime'] == stat.st_mtime: return True
+    if record['sha256'] != file_checksum(infile): return False
+    record['mtime'] = stat.st_mtime
+    return True
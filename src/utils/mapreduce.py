@@ -0,0 +1,130 @@
+################################################################################
+# Methods to run an event loop as map-reduce over shards of a tree.            #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A shard task is a module-level function
+
+    task(tree, first=0, last=None, phase=None) -> accumulator
+
+that processes the entries [first, last) of tree (all entries by default),
+reporting progress to phase if given, and returns a mergeable accumulator: an
+object with a merge(other) method that adds in the result of the entries
+following its own and returns itself (Stage, BkgCounts, EfficiencyCounts).
+
+map_reduce splits the entry range of a tree into contiguous shards made of
+whole chunks (see utils/columnar.py), runs the task on each shard on a pool of
+worker processes forked from the caller and merges the accumulators in shard
+order. Each worker reopens the tree from its files (or column cache), since
+open ROOT files cannot be shared between processes. Merging in entry order
+keeps the results identical to a single task over the whole tree: counts are
+sums of integers, Counters see their keys in the same order, and histograms
+are merged as integer counts per unit cell (BinAccumulator), whose size does
+not grow with the number of events. Shards are made of the same chunks as a
+single pass, and the sums behind the histogram mean and RMS are kept per
+chunk and added exactly (math.fsum), so they do not depend on the shards
+either.
+'''
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.lazy_import import ROOT
+from utils.columnar import chunk_ranges
+from utils.column_cache import ColumnStore
+from utils.instrument import bytes_read
+
+# Shards per job, so that uneven shards still keep all workers busy
+SHARDS_PER_JOB = 4
+
+#===============================================================================
+
+
+def tree_source(tree):
+    """Return what is needed to reopen tree (a TTree, TChain or ColumnStore)
+    in another process: (kind, location, tree name)."""
+    if isinstance(tree, ColumnStore):
+        return ('columns', (tree.cache_dir, tree.meta), tree.meta['tree'])
+    if tree.InheritsFrom('TChain'):
+        files = [str(f.GetTitle()) for f in tree.GetListOfFiles()]
+    else:
+        files = [str(tree.GetCurrentFile().GetName())]
+    return ('root', files, str(tree.GetName()))
+
+
+def open_source(source):
+    """Reopen a tree described by tree_source."""
+    kind, location, name = source
+    if kind == 'columns': return ColumnStore(*location)
+    chain = ROOT.TChain(name)
+    for infile in location:
+        chain.Add(infile)
+    return chain
+
+
+def shard_ranges(tree, nshards, chunk_size=100000):
+    """Split the entries of tree into at most nshards contiguous (first, last)
+    ranges of whole chunks, of about the same number of entries."""
+    ranges = chunk_ranges(tree, chunk_size)
+    if not ranges: return []
+    nentries = ranges[-1][1]
+    shards, first = [], ranges[0][0]
+    for start, stop in ranges:
+        # Close the shard once it reaches its share of the entries
+        if stop >= nentries * (len(shards) + 1) / nshards:
+            shards.append((first, stop))
+            first = stop
+    if first < nentries: shards.append((first, nentries))
+    return shards
+
+
+def _run_shard(task, source, first, last):
+    """Worker: reopen the tree and run task on entries [first, last).
+    Returns the accumulator and the bytes this worker read from ROOT files."""
+    start = bytes_read()
+    acc = task(open_source(source), first, last)
+    return acc, bytes_read() - start
+
+
+def _merge(acc, other):
+    return acc.merge(other)
+
+
+def map_reduce(tree, task, njobs=1, phase=None, merge=_merge,
+               chunk_size=100000):
+    """Run a shard task over all entries of tree on njobs processes.
+
+    Args:
+        tree (TTree, TChain or ColumnStore): input tree
+        task (function): module-level shard task (see above)
+        njobs (int): number of worker processes; 1 runs task(tree) in this
+            process
+        phase (Phase): progress of the event loop, updated per finished shard
+            and given the bytes read by the workers
+        merge (function): merge(acc, other) returning the combined
+            accumulator (default: acc.merge(other))
+        chunk_size (int): entries per chunk, shards are made of whole chunks
+    Returns:
+        The merged accumulator.
+    """
+    if njobs <= 1: return task(tree, 0, None, phase)
+    shards = shard_ranges(tree, njobs * SHARDS_PER_JOB, chunk_size)
+    if len(shards) <= 1: return task(tree, 0, None, phase)
+
+    source = tree_source(tree)
+    # Fork so workers inherit the already initialised ROOT interpreter
+    ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=njobs, mp_context=ctx) as pool:
+        futures = {pool.submit(_run_shard, task, source, first, last):
+                   last - first for first, last in shards}
+        ndone = 0
+        for future in as_completed(futures):
+            ndone += futures[future]
+            if phase is not None:
+                phase.add_bytes(future.result()[1])
+                phase.update(ndone)
+        results = [future.result()[0] for future in futures]
+
+    # Merge in entry order
+    acc = results[0]
+    for other in results[1:]:
+        acc = merge(acc, other)
+    return acc
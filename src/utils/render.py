@@ -0,0 +1,56 @@
+################################################################################
+# Methods to render independent plots in ROOT batch mode on a process pool.    #
+# Author: Michael Peters                                                       #
+################################################################################
+'''A plot script describes each PNG it writes as a task: a module-level
+function and its (picklable) arguments, which opens the histogram file, draws
+on its own canvas and prints one file. render_all turns on ROOT batch mode
+(no graphics windows) and runs the tasks, spread over worker processes forked
+from the caller when more than one job is requested. Progress is reported as
+a 'render' phase of the caller's Monitor (see utils/instrument.py), counting
+finished plots.
+'''
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.lazy_import import ROOT
+from utils.instrument import Monitor
+
+#===============================================================================
+
+
+def default_jobs(ntasks):
+    """Return the default number of render workers for ntasks plots."""
+    return max(1, min(ntasks, os.cpu_count() or 1))
+
+
+def load_hist(infile, name):
+    """Return histogram name from infile, detached from the file."""
+    tfile = ROOT.TFile.Open(infile, 'READ')
+    hist = tfile.Get(name)
+    # Keep histogram in memory (not remove when files are closed)
+    hist.SetDirectory(0)
+    tfile.Close()
+    return hist
+
+
+def render_all(tasks, njobs=1, monitor=None):
+    """Run the plot tasks (function, args) in batch mode on njobs processes.
+
+    Returns the return values of the tasks, in order.
+    """
+    ROOT.gROOT.SetBatch(True)
+    with (monitor or Monitor()).phase('render', len(tasks), 'plots') as phase:
+        if njobs <= 1 or len(tasks) <= 1:
+            results = []
+            for func, args in tasks:
+                results.append(func(*args))
+                phase.update(len(results))
+            return results
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=njobs, mp_context=ctx) as pool:
+            futures = [pool.submit(func, *args) for func, args in tasks]
+            for ndone, _ in enumerate(as_completed(futures), 1):
+                phase.update(ndone)
+            return [future.result() for future in futures]
@@ -0,0 +1,209 @@
+################################################################################
+# Methods to generate synthetic ntuples with the schema of the real ones.      #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Synthetic events for tests and benchmarks, with every branch a
+vector<double> as in the real ntuples:
+
+- mc_*: generated particles. Signal events start with an eta -> mu+ mu- gamma
+  decay (mc_pid 221, -13, 13, 22 with mc_idx_mom -1, 0, 0, 0), background
+  events with four random particles. A few extra particles follow.
+- tag_*: reconstructed eta candidates (tag_pid 221), at most two per event.
+- prt_*: three daughters (-13, 13, 22) per candidate, with prt_idx_mom the
+  candidate index and prt_idx_gen the matched MC particle. Signal candidates
+  are matched to the MC decay, background daughters to a random particle or
+  nothing (-1).
+
+A fraction of the events (sparsity) is completely empty, like most events of
+the raw MinBias files. The kinematics are only roughly realistic (momenta,
+a signal mass peak over a flat background); they are meant to exercise the
+selection, truth-matching and histogram code, not physics.
+
+Events are generated a chunk at a time as a Chunk of flat values and offsets
+(see utils/columnar.py) and written with a small C++ fill loop.
+'''
+
+import numpy as np
+from utils.columnar import Chunk
+from utils.lazy_import import ROOT
+
+# Branches of the ntuple, in output order
+TAG_BRANCHES = ['tag_pid', 'tag_px', 'tag_py', 'tag_pz', 'tag_e', 'tag_m']
+PRT_BRANCHES = ['prt_pid', 'prt_px', 'prt_py', 'prt_pz', 'prt_idx_gen',
+                'prt_idx_mom']
+MC_BRANCHES = ['mc_pid', 'mc_px', 'mc_py', 'mc_pz', 'mc_e', 'mc_idx_mom']
+BRANCHES = TAG_BRANCHES + PRT_BRANCHES + MC_BRANCHES
+
+ETA_MASS = 547.862  # MeV
+MASSES = {221: ETA_MASS, 13: 105.658, -13: 105.658, 22: 0.0, 211: 139.570,
+          -211: 139.570, 111: 134.977, 321: 493.677, -321: 493.677,
+          2212: 938.272}
+BKG_PIDS = np.array([211, -211, 111, 22, 13, -13, 321, -321, 2212])
+DECAY_PIDS = np.array([221, -13, 13, 22])
+
+_FILL_CODE = '''
+#include <vector>
+#include "TTree.h"
+// Fill nevents entries of tree from flat values and per-branch offsets:
+// branch b of entry i holds values[offsets[b][i]:offsets[b][i + 1]].
+void synthetic_fill(TTree *tree, std::vector<std::vector<double>> &vecs,
+                    const double *values, const Long64_t *offsets,
+                    Long64_t nevents)
+{
+    const size_t nbranches = vecs.size();
+    for (Long64_t i = 0; i < nevents; ++i) {
+        for (size_t b = 0; b < nbranches; ++b) {
+            const Long64_t *off = offsets + b * (nevents + 1);
+            vecs[b].assign(values + off[i], values + off[i + 1]);
+        }
+        tree->Fill();
+    }
+}
+'''
+
+#===============================================================================
+
+
+def _momenta(rng, n, pid):
+    """Random momenta (px, py, pz, e) of n particles with given pids."""
+    px = rng.normal(0, 800, n)
+    py = rng.normal(0, 800, n)
+    pz = rng.exponential(20000, n) + 2000
+    mass = np.vectorize(MASSES.get, otypes=[np.float64])(pid) if n else 0
+    e = np.sqrt(px**2 + py**2 + pz**2 + mass**2)
+    return px, py, pz, e
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def generate_chunk(rng, nevents, sparsity=0.9, signal_fraction=0.1,
+                   start=0):
+    """Generate nevents synthetic events as a Chunk.
+
+    Args:
+        rng (np.random.Generator): random number generator
+        nevents (int): number of events
+        sparsity (float): fraction of empty events
+        signal_fraction (float): fraction of non-empty events with a signal
+            decay
+        start (int): entry number of the first event
+    """
+    chunk = Chunk(start, start + nevents)
+    filled = rng.random(nevents) >= sparsity
+    is_sig = filled & (rng.random(nevents) < signal_fraction)
+
+    # MC particles: a decay-like group of four, then a few extra particles
+    nmc = np.where(filled, 4 + rng.poisson(1.0, nevents), 0)
+    mc_off = _offsets(nmc)
+    ntot = int(mc_off[-1])
+    evt = np.repeat(np.arange(nevents), nmc)
+    pos = np.arange(ntot) - mc_off[evt]  # index within the event
+    mc_pid = rng.choice(BKG_PIDS, ntot)
+    mc_mom = np.full(ntot, -1, dtype=np.int64)
+    # Background: random earlier mother for some particles
+    has_mom = (pos > 0) & (rng.random(ntot) < 0.3)
+    mc_mom[has_mom] = rng.integers(0, np.maximum(pos[has_mom], 1))
+    # Signal: the first four particles are eta -> mu+ mu- gamma
+    sig_decay = is_sig[evt] & (pos < 4)
+    mc_pid[sig_decay] = DECAY_PIDS[pos[sig_decay]]
+    mc_mom[sig_decay] = np.where(pos[sig_decay] == 0, -1, 0)
+    px, py, pz, e = _momenta(rng, ntot, mc_pid)
+    # The eta carries the momentum of its daughters
+    eta = np.flatnonzero(sig_decay & (pos == 0))
+    for comp in (px, py, pz):
+        comp[eta] = comp[eta + 1] + comp[eta + 2] + comp[eta + 3]
+    e[eta] = np.sqrt(px[eta]**2 + py[eta]**2 + pz[eta]**2 + ETA_MASS**2)
+    for name, vals in zip(MC_BRANCHES, [mc_pid, px, py, pz, e, mc_mom]):
+        chunk.values[name] = vals.astype(np.float64)
+        chunk.offsets[name] = mc_off
+
+    # Reconstructed candidates: signal events are found with 80% efficiency,
+    # background events give 0, 1 or 2 fake candidates
+    ntag = np.where(is_sig, rng.random(nevents) < 0.8,
+                    np.where(filled, rng.choice(3, nevents, p=[0.5, 0.45, 0.05]),
+                             0)).astype(np.int64)
+    tag_off = _offsets(ntag)
+    tag_evt = np.repeat(np.arange(nevents), ntag)
+    tag_idx = np.arange(len(tag_evt)) - tag_off[tag_evt]
+    tag_sig = is_sig[tag_evt] & (tag_idx == 0)
+
+    # Three daughters per candidate
+    prt_off = _offsets(3 * ntag)
+    prt_evt = np.repeat(tag_evt, 3)
+    prt_can = np.repeat(tag_idx, 3)
+    prt_k = np.tile(np.arange(3), len(tag_evt))
+    prt_sig = np.repeat(tag_sig, 3)
+    prt_pid = DECAY_PIDS[1:][prt_k]
+    prt_gen = rng.integers(-1, np.maximum(nmc[prt_evt], 1))
+    prt_gen[prt_sig] = prt_k[prt_sig] + 1
+    ppx, ppy, ppz, _ = _momenta(rng, len(prt_evt), prt_pid)
+    # Signal daughters are their MC particle, smeared by 1%
+    gen = mc_off[prt_evt[prt_sig]] + prt_gen[prt_sig]
+    for reco, true in ((ppx, px), (ppy, py), (ppz, pz)):
+        reco[prt_sig] = true[gen] * rng.normal(1, 0.01, len(gen))
+    for name, vals in zip(PRT_BRANCHES, [prt_pid, ppx, ppy, ppz, prt_gen,
+                                         prt_can]):
+        chunk.values[name] = vals.astype(np.float64)
+        chunk.offsets[name] = prt_off
+
+    # Candidate momentum is the sum of its daughters; the mass peaks at the
+    # eta mass for signal and is flat for background
+    tpx, tpy, tpz = (comp.reshape(-1, 3).sum(axis=1)
+                     for comp in (ppx, ppy, ppz))
+    tag_m = np.where(tag_sig, rng.normal(ETA_MASS, 8, len(tag_evt)),
+                     rng.uniform(250, 1000, len(tag_evt)))
+    tag_e = np.sqrt(tpx**2 + tpy**2 + tpz**2 + tag_m**2)
+    tag_pid = np.full(len(tag_evt), 221)
+    for name, vals in zip(TAG_BRANCHES, [tag_pid, tpx, tpy, tpz, tag_e,
+                                         tag_m]):
+        chunk.values[name] = vals.astype(np.float64)
+        chunk.offsets[name] = tag_off
+    return chunk
+
+
+#===============================================================================
+
+
+def fill_tree(tree, vecs, chunk):
+    """Append the events of a Chunk to tree, whose branches point into
+    vecs (one vector<double> per name in BRANCHES)."""
+    if not hasattr(ROOT, 'synthetic_fill'):
+        ROOT.gInterpreter.Declare(_FILL_CODE)
+    nevents = len(chunk)
+    values = np.concatenate([chunk.values[name] for name in BRANCHES])
+    # Offsets of every branch into the concatenated values
+    shift = np.cumsum([0] + [len(chunk.values[name]) for name in BRANCHES])
+    offsets = np.concatenate([chunk.offsets[name] + shift[b]
+                              for b, name in enumerate(BRANCHES)])
+    ROOT.synthetic_fill(tree, vecs, np.ascontiguousarray(values),
+                        np.ascontiguousarray(offsets, dtype=np.longlong),
+                        nevents)
+
+
+def write_ntuple(outfile, nevents, sparsity=0.9, signal_fraction=0.1,
+                 seed=0, chunk_size=100000):
+    """Write a synthetic ntuple with a 'tree' of nevents events to outfile.
+
+    Returns the number of non-empty events.
+    """
+    rng = np.random.default_rng(seed)
+    tfile = ROOT.TFile.Open(outfile, 'RECREATE')
+    tree = ROOT.TTree('tree', 'synthetic events')
+    vecs = ROOT.std.vector[ROOT.std.vector['double']](len(BRANCHES))
+    for b, name in enumerate(BRANCHES):
+        tree.Branch(name, vecs[b])
+
+    nfilled = 0
+    for start in range(0, nevents, chunk_size):
+        chunk = generate_chunk(rng, min(chunk_size, nevents - start),
+                               sparsity, signal_fraction, start)
+        fill_tree(tree, vecs, chunk)
+        nfilled += int(np.count_nonzero(chunk.counts('mc_pid')))
+
+    tree.Write()
+    tfile.Close()
+    return nfilled
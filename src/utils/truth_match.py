@@ -0,0 +1,152 @@
+################################################################################
+# Vectorized MC truth-matching of reconstructed candidates.                    #
+# Author: Michael Peters                                                       #
+################################################################################
+'''Truth-matching of eta -> mu+ mu- gamma candidates for a whole Chunk of events
+(see utils/columnar.py) in one call.
+
+Candidate i of an event owns the reconstructed daughters 3i, 3i+1 and 3i+2.
+Each daughter is followed through prt_idx_gen into the MC particles, and its
+MC pid and mother index (mc_idx_mom) are compared with the reconstructed pid
+and the candidate index. The result holds (ncandidates, 3) arrays of per-
+daughter match codes and information, and one signal flag per candidate:
+
+- MATCHED: MC match with the same pid, coming from the candidate's MC eta.
+- NO_MATCH: daughter has no MC match (prt_idx_gen == -1).
+- PID_MISMATCH: MC match has a different pid.
+- WRONG_MOTHER: MC match has the right pid but not the candidate as mother.
+- MISSING: daughter was not reconstructed for this candidate. As in the loop
+  versions, once prt_idx_mom of a daughter does not point back to the
+  candidate, the remaining daughters are ignored.
+
+Indices into the MC particles follow Python list semantics (negative indices
+count from the end), so the looked-up values are those of the loop versions.
+'''
+
+import numpy as np
+
+# Daughter match codes
+MISSING = -1
+MATCHED = 0
+NO_MATCH = 1
+PID_MISMATCH = 2
+WRONG_MOTHER = 3
+
+ETA_PID = 221
+
+#===============================================================================
+
+
+class TruthMatch:
+    """Per-candidate truth-matching result for a Chunk.
+
+    Attributes (one row per candidate, three columns for daughter arrays):
+        evt (int): event index within the chunk
+        can_idx (int): candidate index within the event
+        tag_pid (int): reconstructed tag pid (0 unless matching per tag)
+        prt_pid, prt_idx_gen (int, (n, 3)): reconstructed daughter info
+        has_mc (bool, (n, 3)): prt_idx_gen points to an MC particle
+        mc_pid, mc_idx_mom (int, (n, 3)): MC pid and mother index of the
+            matched MC particle (0 / -1 without one)
+        mom_pid (int, (n, 3)): MC pid of that particle's mother (0 if none)
+        valid (bool, (n, 3)): daughter belongs to the candidate
+        code (int, (n, 3)): daughter match code
+        has_mc_eta (bool): first MC particle of the event is an eta
+        is_signal (bool): MC eta present and all daughters MATCHED
+    """
+
+    def __len__(self):
+        return len(self.evt)
+
+
+def _take(values, idx, ok, fill):
+    """Return values[idx] as int64 where ok, fill elsewhere."""
+    out = np.full(idx.shape, fill, dtype=np.int64)
+    out[ok] = values[idx[ok]].astype(np.int64)
+    return out
+
+
+def _wrap(idx, n):
+    """Resolve list-style indices idx into lists of length n.
+
+    Returns (index, in_range) with negative indices counted from the end.
+    """
+    ok = (idx >= -n) & (idx < n)
+    return np.where(idx < 0, idx + n, idx), ok
+
+
+#===============================================================================
+
+
+def truth_match(chunk, per_tag=True):
+    """Truth-match all candidates of a Chunk.
+
+    Args:
+        chunk (Chunk): events with prt_pid, prt_idx_gen, mc_pid and
+            mc_idx_mom, plus tag_pid and prt_idx_mom if per_tag
+        per_tag (bool): one candidate per reconstructed tag, daughters cut
+            off at the first one whose prt_idx_mom is not the candidate.
+            Otherwise one candidate per complete triplet of daughters, all
+            of them used.
+    Returns a TruthMatch.
+    """
+    nevents = len(chunk)
+    prt_off = chunk.offsets['prt_pid']
+    mc_off = chunk.offsets['mc_pid']
+    nprt = np.diff(prt_off)
+    nmc = np.diff(mc_off)
+
+    ncand = chunk.counts('tag_pid') if per_tag else nprt // 3
+    evt = np.repeat(np.arange(nevents), ncand)
+    can_idx = np.arange(len(evt)) - np.repeat(np.cumsum(ncand) - ncand, ncand)
+
+    res = TruthMatch()
+    res.evt = evt
+    res.can_idx = can_idx
+    res.tag_pid = np.zeros(len(evt), dtype=np.int64)
+    if per_tag:
+        tag_off = chunk.offsets['tag_pid']
+        res.tag_pid = chunk['tag_pid'][tag_off[evt] + can_idx].astype(np.int64)
+
+    # Reconstructed daughters of each candidate
+    local = 3 * can_idx[:, None] + np.arange(3)
+    exists = local < nprt[evt][:, None]
+    dtr = prt_off[evt][:, None] + local
+    res.prt_pid = _take(chunk['prt_pid'], dtr, exists, 0)
+    res.prt_idx_gen = _take(chunk['prt_idx_gen'], dtr, exists, -1)
+    if per_tag:
+        prt_idx_mom = _take(chunk['prt_idx_mom'], dtr, exists, -1)
+        is_dtr = exists & (prt_idx_mom == can_idx[:, None])
+        res.valid = np.cumprod(is_dtr, axis=1).astype(bool)
+    else:
+        res.valid = exists
+
+    # MC particle matched to each daughter
+    nmc_evt = nmc[evt][:, None]
+    gen, res.has_mc = _wrap(res.prt_idx_gen, nmc_evt)
+    res.has_mc &= res.valid
+    mc = mc_off[evt][:, None] + gen
+    res.mc_pid = _take(chunk['mc_pid'], mc, res.has_mc, 0)
+    res.mc_idx_mom = _take(chunk['mc_idx_mom'], mc, res.has_mc, -1)
+
+    # Mother of the matched MC particle
+    mom, has_mom = _wrap(res.mc_idx_mom, nmc_evt)
+    has_mom &= res.has_mc & (res.mc_idx_mom != -1)
+    res.mom_pid = _take(chunk['mc_pid'], mc_off[evt][:, None] + mom, has_mom, 0)
+
+    # Daughter match codes
+    is_gen = res.has_mc & (res.prt_idx_gen != -1)
+    pid_ok = res.mc_pid == res.prt_pid
+    mom_ok = res.mc_idx_mom == can_idx[:, None]
+    res.code = np.full(local.shape, MISSING, dtype=np.int64)
+    res.code[res.valid] = NO_MATCH
+    res.code[is_gen & ~pid_ok] = PID_MISMATCH
+    res.code[is_gen & pid_ok & ~mom_ok] = WRONG_MOTHER
+    res.code[is_gen & pid_ok & mom_ok] = MATCHED
+
+    # Candidate is signal if the event has an MC eta and all daughters match
+    first_mc = _take(chunk['mc_pid'], mc_off[evt], nmc[evt] > 0, 0)
+    res.has_mc_eta = first_mc == ETA_PID
+    res.is_signal = res.has_mc_eta & np.all(~res.valid | (res.code == MATCHED),
+                                            axis=1)
+    return res